@@ -0,0 +1,228 @@
+"""
+Idempotent like / bookmark / follow writes.
+
+Every write is a single `INSERT ... ON CONFLICT DO NOTHING RETURNING` (or
+`DELETE ... RETURNING`) via upserts.insert_new, so a double tap or two
+racing requests never raise on the unique constraints, and counters are
+only recorded for rows that were actually inserted or deleted. The
+functions take lists so the single-item endpoints in posts.py / follows.py
+and `POST /actions/batch` (offline-queued actions from the app, up to 100
+per request) share one code path.
+"""
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Dict, Iterable, List, Set, Tuple
+
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from . import counters, devices, fanout, timeline, viewer
+from .auth import Principal, get_current_writer
+from .database import get_db
+from .models import Follow, Post, PostBookmark, PostLike, User
+from .schemas import ActionBatchOut, ActionBatchRequest, ActionResult
+from .upserts import delete_returning, insert_new
+
+router = APIRouter(prefix="/actions", tags=["actions"])
+
+# action type -> (relationship, add?)
+ACTIONS: Dict[str, Tuple[str, bool]] = {
+    "like": ("like", True),
+    "unlike": ("like", False),
+    "bookmark": ("bookmark", True),
+    "unbookmark": ("bookmark", False),
+    "follow": ("follow", True),
+    "unfollow": ("follow", False),
+}
+
+STATUSES = {
+    "like": ("liked", "already_liked", "unliked", "not_liked"),
+    "bookmark": ("bookmarked", "already_bookmarked", "unbookmarked", "not_bookmarked"),
+    "follow": ("followed", "already_following", "unfollowed", "not_following"),
+}
+
+
+@contextmanager
+def rejecting_missing_rows(db: Session, user_id: int, not_found: str):
+    """Report a foreign-key failure (caller or target deleted meanwhile) as 401 / 404 instead of a 500.
+
+    Unique conflicts never get here (insert_new skips them); wrap the writes and the commit.
+    """
+    try:
+        yield
+    except IntegrityError:
+        db.rollback()
+        if db.get(User, user_id) is None:
+            raise HTTPException(status_code=401, detail="User not found")
+        raise HTTPException(status_code=404, detail=not_found)
+
+
+def add_likes(db: Session, user_id: int, posts: Iterable[Post]) -> Set[int]:
+    """Like `posts`; returns the ids of posts that were not liked yet. The caller commits."""
+    posts = {p.id: p for p in posts}
+    inserted = insert_new(
+        db, PostLike, ("post_id", "user_id"),
+        [{"post_id": post_id, "user_id": user_id} for post_id in posts], PostLike.post_id,
+    )
+    for post_id in inserted:
+        counters.record(db, "post", post_id, "likes_count", 1)
+        counters.record(db, "user_stats", posts[post_id].user_id, "total_likes", 1)
+    return set(inserted)
+
+
+def remove_likes(db: Session, user_id: int, posts: Iterable[Post]) -> Set[int]:
+    posts = {p.id: p for p in posts}
+    if not posts:
+        return set()
+    deleted = delete_returning(
+        db, PostLike, PostLike.post_id, PostLike.user_id == user_id, PostLike.post_id.in_(list(posts))
+    )
+    for post_id in deleted:
+        counters.record(db, "post", post_id, "likes_count", -1)
+        counters.record(db, "user_stats", posts[post_id].user_id, "total_likes", -1)
+    return set(deleted)
+
+
+def add_bookmarks(db: Session, user_id: int, posts: Iterable[Post]) -> Set[int]:
+    inserted = insert_new(
+        db, PostBookmark, ("post_id", "user_id"),
+        [{"post_id": p.id, "user_id": user_id} for p in {p.id: p for p in posts}.values()], PostBookmark.post_id,
+    )
+    if inserted:
+        counters.record(db, "user_stats", user_id, "saved_posts_count", len(inserted))
+    return set(inserted)
+
+
+def remove_bookmarks(db: Session, user_id: int, posts: Iterable[Post]) -> Set[int]:
+    post_ids = list({p.id for p in posts})
+    if not post_ids:
+        return set()
+    deleted = delete_returning(
+        db, PostBookmark, PostBookmark.post_id, PostBookmark.user_id == user_id, PostBookmark.post_id.in_(post_ids)
+    )
+    if deleted:
+        counters.record(db, "user_stats", user_id, "saved_posts_count", -len(deleted))
+    return set(deleted)
+
+
+def add_follows(db: Session, user_id: int, targets: Iterable[User]) -> Set[int]:
+    """Follow `targets` (never the user themself); returns the ids newly followed. The caller commits."""
+    targets = {t.id: t for t in targets if t.id != user_id}
+    inserted = insert_new(
+        db, Follow, ("follower_id", "followed_id"),
+        [{"follower_id": user_id, "followed_id": target_id} for target_id in targets], Follow.followed_id,
+    )
+    if inserted:
+        counters.record(db, "user", user_id, "following_count", len(inserted))
+    for target_id in inserted:
+        counters.record(db, "user", target_id, "followers_count", 1)
+        timeline.on_follow(db, user_id, targets[target_id])
+    return set(inserted)
+
+
+def remove_follows(db: Session, user_id: int, targets: Iterable[User]) -> Set[int]:
+    target_ids = list({t.id for t in targets})
+    if not target_ids:
+        return set()
+    deleted = delete_returning(
+        db, Follow, Follow.followed_id, Follow.follower_id == user_id, Follow.followed_id.in_(target_ids)
+    )
+    if deleted:
+        counters.record(db, "user", user_id, "following_count", -len(deleted))
+    for target_id in deleted:
+        counters.record(db, "user", target_id, "followers_count", -1)
+        timeline.on_unfollow(db, user_id, target_id)
+    return set(deleted)
+
+
+def schedule_topic_unsubscribe(db: Session, background_tasks: BackgroundTasks, user_id: int,
+                               targets: Iterable[Tuple[int, str]]) -> None:
+    """After unfollows are committed: drop the follower's devices from topic-mode creators' topics.
+
+    `targets` are (user id, uid) pairs of the unfollowed users.
+    """
+    targets = [(target_id, uid) for target_id, uid in targets if fanout.has_topic(db, target_id)]
+    if not targets:
+        return
+    tokens = devices.tokens_for(db, [user_id])
+    if tokens:
+        for _, uid in targets:
+            background_tasks.add_task(fanout.unsubscribe_follower, tokens, uid)
+
+
+WRITERS = {
+    ("like", True): add_likes,
+    ("like", False): remove_likes,
+    ("bookmark", True): add_bookmarks,
+    ("bookmark", False): remove_bookmarks,
+    ("follow", True): add_follows,
+    ("follow", False): remove_follows,
+}
+
+
+@router.post("/batch", response_model=ActionBatchOut)
+def apply_batch(
+    payload: ActionBatchRequest,
+    background_tasks: BackgroundTasks,
+    db: Session = Depends(get_db),
+    current_user: Principal = Depends(get_current_writer),
+):
+    """
+    Apply up to 100 queued actions in one transaction, in order.
+    For each relationship and target only the last action counts (like then
+    unlike of the same post is an unlike); earlier ones report "superseded".
+    Unknown targets report "not_found", unknown types "invalid".
+    """
+    actions = payload.actions
+    last: Dict[Tuple[str, str], int] = {}
+    for index, action in enumerate(actions):
+        if action.type in ACTIONS:
+            last[(ACTIONS[action.type][0], action.target_uid)] = index
+
+    post_uids = {uid for (kind, uid) in last if kind != "follow"}
+    user_uids = {uid for (kind, uid) in last if kind == "follow"}
+    posts = {p.uid: p for p in db.query(Post).filter(Post.uid.in_(post_uids))} if post_uids else {}
+    users = {u.uid: u for u in db.query(User).filter(User.uid.in_(user_uids))} if user_uids else {}
+
+    # (relationship, add?) -> targets, resolved with one query per table above
+    groups: Dict[Tuple[str, bool], List] = defaultdict(list)
+    for (kind, uid), index in last.items():
+        target = (users if kind == "follow" else posts).get(uid)
+        if target is not None:
+            groups[ACTIONS[actions[index].type]].append(target)
+
+    with rejecting_missing_rows(db, current_user.id, "Target not found"):
+        changed: Dict[Tuple[str, bool], Set[int]] = {
+            key: WRITERS[key](db, current_user.id, targets) for key, targets in groups.items()
+        }
+    unfollowed = [(t.id, t.uid) for t in groups.get(("follow", False), []) if t.id in changed[("follow", False)]]
+
+    # Build the response before committing: the loaded rows expire on commit
+    results = []
+    for index, action in enumerate(actions):
+        if action.type not in ACTIONS:
+            status = "invalid"
+        else:
+            kind, add = ACTIONS[action.type]
+            target = (users if kind == "follow" else posts).get(action.target_uid)
+            if last[(kind, action.target_uid)] != index:
+                status = "superseded"
+            elif target is None:
+                status = "not_found"
+            elif kind == "follow" and target.id == current_user.id:
+                status = "invalid"
+            else:
+                done, noop, undone, absent = STATUSES[kind]
+                if add:
+                    status = done if target.id in changed[(kind, add)] else noop
+                else:
+                    status = undone if target.id in changed[(kind, add)] else absent
+        results.append(ActionResult(type=action.type, target_uid=action.target_uid, status=status))
+
+    with rejecting_missing_rows(db, current_user.id, "Target not found"):
+        db.commit()
+    if ("follow", True) in groups or ("follow", False) in groups:
+        viewer.invalidate_following(current_user.id)
+    schedule_topic_unsubscribe(db, background_tasks, current_user.id, unfollowed)
+    return ActionBatchOut(results=results)
@@ -0,0 +1,116 @@
+"""
+Async database layer for the hot routes.
+
+Hot route handlers are `async def` and run their (sync-style) query code
+through a `DbRunner` from `get_db_runner`:
+
+- USE_ASYNC_DB=true: an `AsyncSession` on an AsyncEngine (asyncpg for
+  PostgreSQL, aiosqlite for SQLite, aiomysql for MySQL). The query code runs
+  via `AsyncSession.run_sync`, i.e. on the event loop with awaited network
+  I/O, so concurrent requests are not capped by the threadpool size.
+- USE_ASYNC_DB=false (default): a regular `Session` whose work is handed to
+  Starlette's threadpool, which is what the sync handlers did before.
+
+Keep code passed to `run()` free of other blocking calls (HTTP, sleeps): in
+async mode it runs on the event loop.
+"""
+from abc import ABC, abstractmethod
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Callable
+
+import anyio
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy.orm import Session
+
+from .config import ASYNC_DATABASE_URL, USE_ASYNC_DB
+from .database import DATABASE_URL, SessionLocal
+from . import db_pool
+
+ASYNC_DRIVERS = {
+    "postgresql": "postgresql+asyncpg",
+    "postgresql+psycopg2": "postgresql+asyncpg",
+    "sqlite": "sqlite+aiosqlite",
+    "mysql+pymysql": "mysql+aiomysql",
+}
+
+
+def async_url(url: str) -> str:
+    scheme, sep, rest = url.partition("://")
+    return ASYNC_DRIVERS.get(scheme, scheme) + sep + rest
+
+
+def make_async_engine(url: str, name: str):
+    """AsyncEngine with the same pool sizing, pre-ping strategy and PgBouncer handling as make_engine"""
+    from sqlalchemy.ext.asyncio import create_async_engine
+
+    new_engine = create_async_engine(url, echo=False, **db_pool.pool_options(url, is_async=True))
+    db_pool.instrument(name, new_engine.sync_engine)
+    return new_engine
+
+
+def make_async_sessionmaker(bind):
+    from sqlalchemy.ext.asyncio import async_sessionmaker
+
+    return async_sessionmaker(bind, autoflush=False, expire_on_commit=True)
+
+
+async_engine = None
+AsyncSessionLocal = None
+if USE_ASYNC_DB:
+    async_engine = make_async_engine(ASYNC_DATABASE_URL or async_url(DATABASE_URL), "async")
+    AsyncSessionLocal = make_async_sessionmaker(async_engine)
+
+
+class DbRunner(ABC):
+    """Runs `fn(session, *args)` against the request's database session"""
+
+    @abstractmethod
+    async def run(self, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        ...
+
+
+class AsyncRunner(DbRunner):
+    def __init__(self, session):
+        self.session = session
+
+    async def run(self, fn, *args, **kwargs):
+        return await self.session.run_sync(fn, *args, **kwargs)
+
+
+class ThreadpoolRunner(DbRunner):
+    def __init__(self, session: Session):
+        self.session = session
+
+    async def run(self, fn, *args, **kwargs):
+        return await run_in_threadpool(fn, self.session, *args, **kwargs)
+
+
+# Closing returns the connection to the pool. It must not wait for a threadpool
+# slot: those can all be held by requests waiting for a connection (the same
+# reason FastAPI exits sync dependencies on a separate limiter).
+_close_limiter = anyio.CapacityLimiter(16)
+
+
+@asynccontextmanager
+async def open_runner(session_factory, async_session_factory) -> AsyncIterator[DbRunner]:
+    """Runner over a new session from the factory matching USE_ASYNC_DB"""
+    if USE_ASYNC_DB:
+        async with async_session_factory() as session:
+            yield AsyncRunner(session)
+        return
+    db = session_factory()
+    try:
+        yield ThreadpoolRunner(db)
+    finally:
+        await anyio.to_thread.run_sync(db.close, limiter=_close_limiter)
+
+
+# Dependency for FastAPI (async routes)
+async def get_db_runner() -> AsyncIterator[DbRunner]:
+    async with open_runner(SessionLocal, AsyncSessionLocal) as runner:
+        yield runner
+
+
+async def dispose() -> None:
+    if async_engine is not None:
+        await async_engine.dispose()
@@ -2,22 +2,67 @@ from fastapi import APIRouter, Depends, HTTPException, status
 from sqlalchemy.orm import Session
 from sqlalchemy.exc import IntegrityError
 from jose import jwt
-from passlib.context import CryptContext
+from sqlalchemy import DateTime, select
+from sqlalchemy.orm import make_transient_to_detached
+from dataclasses import dataclass
 from datetime import datetime, timedelta
+import secrets
+import uuid
 from .database import get_db
-from .config import SECRET_KEY, ALGORITHM, ACCESS_TOKEN_EXPIRE_MINUTES
-from . import models
+from .async_database import DbRunner, get_db_runner
+from .config import (
+    SECRET_KEY,
+    ALGORITHM,
+    ACCESS_TOKEN_EXPIRE_MINUTES,
+    PRINCIPAL_CACHE_TTL_SECONDS,
+    PRINCIPAL_CACHE_MAX_ENTRIES,
+    PRINCIPAL_CACHE_SHARED_TTL_SECONDS,
+    JWT_EMBED_USER_ID,
+    BACKOFFICE_API_KEY,
+)
+from .cache import TwoTierCache
+from . import hashing, models, user_search
 from .schemas import UserCreate, LoginRequest, AuthResponse, UserOut, RefreshTokenRequest
 
 router = APIRouter(prefix="/auth", tags=["auth"])
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# uid -> column snapshot of the users row, see _load_principal_user(). Shared by
+# all workers through the cache's Redis tier, so invalidations reach every worker.
+# Neither tier may outlive an access token, whatever the environment says.
+_TOKEN_LIFETIME_SECONDS = ACCESS_TOKEN_EXPIRE_MINUTES * 60
+_principal_cache = TwoTierCache(
+    "principal",
+    max_entries=PRINCIPAL_CACHE_MAX_ENTRIES,
+    local_ttl=min(PRINCIPAL_CACHE_TTL_SECONDS, _TOKEN_LIFETIME_SECONDS),
+    shared_ttl=min(PRINCIPAL_CACHE_SHARED_TTL_SECONDS, _TOKEN_LIFETIME_SECONDS),
+)
+# Never copied into the cache (shared tier included)
+_UNCACHED_COLUMNS = {"password_hash"}
+
+
+@dataclass(frozen=True)
+class Principal:
+    """Immutable identity carried by the access token (no database row)"""
+    id: int
+    uid: str
+
+
+def verify_password(plain_password: str, password_hash: str) -> bool:
+    """Blocking variant for sync handlers; still runs in the bounded hashing pool"""
+    return hashing.verify_password_blocking(plain_password, password_hash)
+
+
+def access_claims(user: models.User) -> dict:
+    claims = {"sub": user.uid}
+    if JWT_EMBED_USER_ID:
+        claims["id"] = user.id
+    return claims
 
 
 def create_access_token(data: dict, expires_delta: timedelta | None = None):
     to_encode = data.copy()
     expire = datetime.utcnow() + (expires_delta or timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES))
-    to_encode.update({"exp": expire})
+    to_encode.update({"exp": expire, "jti": uuid.uuid4().hex})
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt, int((expires_delta or timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)).total_seconds())
 
@@ -26,7 +71,7 @@ def create_refresh_token(data: dict):
     """Create a refresh token with longer expiry (7 days)"""
     to_encode = data.copy()
     expire = datetime.utcnow() + timedelta(days=7)
-    to_encode.update({"exp": expire, "type": "refresh"})
+    to_encode.update({"exp": expire, "type": "refresh", "jti": uuid.uuid4().hex})
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
@@ -61,24 +106,26 @@ def user_to_out(user: models.User) -> UserOut:
         settings=settings,
     )
 
-@router.post("/register", response_model=AuthResponse)
-def register(payload: UserCreate, db: Session = Depends(get_db)):
+def _ensure_available(db: Session, payload: UserCreate) -> None:
     # Check if email or username exists
     if db.query(models.User).filter(models.User.email == payload.email).first():
         raise HTTPException(status_code=400, detail="Email already registered")
     if db.query(models.User).filter(models.User.username == payload.username).first():
         raise HTTPException(status_code=400, detail="Username already taken")
 
+
+def _create_user(payload: UserCreate, password_hash: str, db: Session) -> models.User:
     try:
         user = models.User(
             email=payload.email,
             username=payload.username,
             display_name=payload.display_name, # Accessed via snake_case attribute on model
-            password_hash=pwd_context.hash(payload.password),
+            password_hash=password_hash,
         )
         db.add(user)
         db.commit()
         db.refresh(user)
+        user_search.invalidate()
     except IntegrityError as e:
         db.rollback()
         # Handle database constraint violations
@@ -97,59 +144,159 @@ def register(payload: UserCreate, db: Session = Depends(get_db)):
     except Exception as e:
         db.rollback()
         raise HTTPException(status_code=500, detail=f"An error occurred: {str(e)}")
+    return user
 
-    token, expires_in = create_access_token({"sub": user.uid})
+
+def _auth_response(user: models.User) -> AuthResponse:
+    token, expires_in = create_access_token(access_claims(user))
     refresh_token = create_refresh_token({"sub": user.uid})
     return AuthResponse(access_token=token, expires_in=expires_in, user=user_to_out(user), refresh_token=refresh_token)
 
+
+# register/login are async so the bcrypt work waits in the hashing pool (see hashing.py)
+# without holding a threadpool thread; DB work goes through the DbRunner (async_database.py).
+@router.post("/register", response_model=AuthResponse)
+async def register(payload: UserCreate, db: DbRunner = Depends(get_db_runner)):
+    await db.run(_ensure_available, payload)
+    password_hash = await hashing.hash_password(payload.password)
+    return await db.run(_register_response, payload, password_hash)
+
 @router.post("/login", response_model=AuthResponse)
-def login(payload: LoginRequest, db: Session = Depends(get_db)):
-    user = db.query(models.User).filter(models.User.email == payload.email).first()
-    if not user or not pwd_context.verify(payload.password, user.password_hash):
+async def login(payload: LoginRequest, db: DbRunner = Depends(get_db_runner)):
+    user = await db.run(_find_by_email, payload.email)
+    if not user or not await hashing.verify_password(payload.password, user.password_hash):
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid credentials")
-    token, expires_in = create_access_token({"sub": user.uid})
-    refresh_token = create_refresh_token({"sub": user.uid})
-    return AuthResponse(access_token=token, expires_in=expires_in, user=user_to_out(user), refresh_token=refresh_token)
+    if hashing.needs_update(user.password_hash):
+        # Cost factor (BCRYPT_ROUNDS) changed since this hash was created
+        password_hash = await hashing.hash_password(payload.password)
+        return await db.run(_rehash_response, user, password_hash)
+    return _auth_response(user)
+
+
+def _find_by_email(db: Session, email: str) -> models.User | None:
+    return db.query(models.User).filter(models.User.email == email).first()
+
+
+def _register_response(db: Session, payload: UserCreate, password_hash: str) -> AuthResponse:
+    return _auth_response(_create_user(payload, password_hash, db))
+
+
+def _rehash_response(db: Session, user: models.User, password_hash: str) -> AuthResponse:
+    user.password_hash = password_hash
+    db.commit()
+    db.refresh(user)
+    invalidate_principal(user.uid)
+    return _auth_response(user)
 
 from fastapi import Header
 from jose import JWTError
 
-@router.get("/me", response_model=UserOut)
-def me(authorization: str | None = Header(default=None), db: Session = Depends(get_db)):
+
+def invalidate_principal(*uids: str) -> None:
+    """Call after any change to a users row (profile, FCM token, counters, deletion)"""
+    _principal_cache.invalidate(*uids)
+
+
+def invalidate_principal_ids(db: Session, user_ids) -> None:
+    """invalidate_principal() for users known by id (e.g. after a counter fold)"""
+    user_ids = list(user_ids)
+    if user_ids:
+        invalidate_principal(*db.execute(select(models.User.uid).where(models.User.id.in_(user_ids))).scalars())
+
+
+def _decode_bearer(authorization: str | None) -> dict:
     if not authorization or not authorization.lower().startswith("bearer "):
         raise HTTPException(status_code=401, detail="Not authenticated")
     token = authorization.split(" ", 1)[1]
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        uid = payload.get("sub")
-        if not uid:
-            raise HTTPException(status_code=401, detail="Invalid token")
     except JWTError:
         raise HTTPException(status_code=401, detail="Invalid token")
+    if not payload.get("sub"):
+        raise HTTPException(status_code=401, detail="Invalid token")
+    return payload
+
+
+def _snapshot(user: models.User) -> dict:
+    return {
+        attr.key: getattr(user, attr.key)
+        for attr in models.User.__mapper__.column_attrs if attr.key not in _UNCACHED_COLUMNS
+    }
+
+
+def _from_snapshot(snapshot: dict) -> models.User:
+    values = dict(snapshot)
+    for column in models.User.__table__.columns:
+        # The shared tier stores JSON: datetimes come back as strings
+        if isinstance(column.type, DateTime) and isinstance(values.get(column.key), str):
+            values[column.key] = datetime.fromisoformat(values[column.key])
+    user = models.User(**values)
+    make_transient_to_detached(user)
+    return user
+
+
+def _load_principal_user(payload: dict, db: Session) -> models.User | None:
+    """Read-only view of the caller's users row, served from the principal cache when possible.
+
+    A cache hit is a detached copy that is never attached to `db` (and has no
+    password_hash), so nothing is written from it. Handlers that modify the
+    caller's row use get_current_user, which always reads the row.
+    """
+    uid = payload["sub"]
+    snapshot = _principal_cache.get_many([uid]).get(uid)
+    if snapshot is not None:
+        return _from_snapshot(snapshot)
 
     user = db.query(models.User).filter(models.User.uid == uid).first()
+    if user is not None:
+        _principal_cache.set_many({uid: _snapshot(user)})
+    return user
+
+
+@router.get("/me", response_model=UserOut)
+def me(authorization: str | None = Header(default=None), db: Session = Depends(get_db)):
+    user = _load_principal_user(_decode_bearer(authorization), db)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     return user_to_out(user)
 
-# Dependency to get the current authenticated user (for protected routes)
+# Dependency to get the current authenticated user (for protected routes).
+# Always the current row, attached to the request session: safe to modify.
 def get_current_user(authorization: str | None = Header(default=None), db: Session = Depends(get_db)) -> models.User:
-    if not authorization or not authorization.lower().startswith("bearer "):
-        raise HTTPException(status_code=401, detail="Not authenticated")
-    token = authorization.split(" ", 1)[1]
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        uid = payload.get("sub")
-        if not uid:
-            raise HTTPException(status_code=401, detail="Invalid token")
-    except JWTError:
-        raise HTTPException(status_code=401, detail="Invalid token")
-
-    user = db.query(models.User).filter(models.User.uid == uid).first()
+    payload = _decode_bearer(authorization)
+    user = db.query(models.User).filter(models.User.uid == payload["sub"]).first()
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     return user
 
+# Dependency for read-only routes that only need the caller's id/uid.
+# Async so it never takes a threadpool thread: tokens carrying the user id need no database.
+async def get_current_principal(authorization: str | None = Header(default=None), db: DbRunner = Depends(get_db_runner)) -> Principal:
+    payload = _decode_bearer(authorization)
+    if isinstance(payload.get("id"), int):
+        return Principal(id=payload["id"], uid=payload["sub"])
+    # Tokens issued before JWT_EMBED_USER_ID: resolve through the cache
+    principal = await db.run(_principal_from_payload, payload)
+    if not principal:
+        raise HTTPException(status_code=404, detail="User not found")
+    return principal
+
+
+# Dependency for write routes that only need the caller's id/uid. Unlike
+# get_current_principal it confirms the users row still exists, so a deleted
+# account's unexpired token cannot write orphan rows. Served from the principal
+# cache, which account deletion invalidates on every worker.
+async def get_current_writer(authorization: str | None = Header(default=None), db: DbRunner = Depends(get_db_runner)) -> Principal:
+    principal = await db.run(_principal_from_payload, _decode_bearer(authorization))
+    if not principal:
+        raise HTTPException(status_code=401, detail="User not found")
+    return principal
+
+
+def _principal_from_payload(db: Session, payload: dict) -> Principal | None:
+    user = _load_principal_user(payload, db)
+    return Principal(id=user.id, uid=user.uid) if user else None
+
 @router.post("/refresh", response_model=AuthResponse)
 def refresh_token(payload: RefreshTokenRequest, db: Session = Depends(get_db)):
     """Refresh access token using refresh token"""
@@ -171,7 +318,7 @@ def refresh_token(payload: RefreshTokenRequest, db: Session = Depends(get_db)):
             raise HTTPException(status_code=404, detail="User not found")
         
         # Generate new tokens
-        new_access_token, expires_in = create_access_token({"sub": user.uid})
+        new_access_token, expires_in = create_access_token(access_claims(user))
         new_refresh_token = create_refresh_token({"sub": user.uid})
         
         return AuthResponse(
@@ -189,15 +336,13 @@ def get_current_user_optional(authorization: str | None = Header(default=None),
     try:
         if not authorization or not authorization.lower().startswith("bearer "):
             return None
-        token = authorization.split(" ", 1)[1]
-        if not token:
-            return None
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        uid = payload.get("sub")
-        if not uid:
-            return None
-        user = db.query(models.User).filter(models.User.uid == uid).first()
-        return user
-    except (JWTError, Exception):
+        return _load_principal_user(_decode_bearer(authorization), db)
+    except (HTTPException, JWTError, Exception):
         # Silently return None if token is invalid or missing
-        return None
\ No newline at end of file
+        return None
+
+
+# Dependency for back-office / carrier integrations: shared secret in X-Api-Key
+def require_backoffice_key(x_api_key: str | None = Header(default=None)) -> None:
+    if not BACKOFFICE_API_KEY or not x_api_key or not secrets.compare_digest(x_api_key, BACKOFFICE_API_KEY):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Invalid API key")
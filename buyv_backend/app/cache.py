@@ -0,0 +1,349 @@
+"""
+Two-tier cache: a bounded in-process LRU in front of an optional shared backend.
+
+The local tier absorbs repeated reads inside one worker; the shared tier
+(Redis when REDIS_URL is set) lets workers reuse each other's fills and
+receive invalidations. Values must be JSON-serialisable dicts.
+
+Shared-tier calls are blocking. Inside `AsyncSession.run_sync` (async mode,
+see async_database.py) that code runs on the event loop, so the calls are
+handed to a worker thread there; in the threadpool they run inline.
+
+Fills are read-then-set, so a reader that loaded a row just before a writer
+committed could put the old value back after the invalidation. Invalidating
+therefore leaves a tombstone in both tiers for CACHE_TOMBSTONE_SECONDS, and
+fills (`set_many`) only write keys that hold neither a value nor a tombstone.
+
+Invalidations are also published on INVALIDATION_CHANNEL and `listener`
+tombstones the keys in every worker's local tier. A worker that loses its
+subscription clears its local tiers when it reconnects; until then its
+entries are at most CACHE_LOCAL_TTL_SECONDS stale.
+
+Tests and local dev without Redis can install `LocalDictBackend` with
+`set_shared_backend()` to exercise the shared-tier code paths in-process.
+"""
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+import anyio
+from sqlalchemy.util.concurrency import await_only, in_greenlet
+
+from .config import (
+    CACHE_LOCAL_MAX_ENTRIES,
+    CACHE_LOCAL_TTL_SECONDS,
+    CACHE_SHARED_TTL_SECONDS,
+    CACHE_TOMBSTONE_SECONDS,
+    REDIS_URL,
+)
+
+logger = logging.getLogger(__name__)
+
+INVALIDATION_CHANNEL = "buyv:cache:invalidate"
+# Shared-tier value of an invalidated key (never valid JSON for a dict)
+TOMBSTONE = "-"
+_LOCAL_TOMBSTONE = object()
+
+
+class LRUCache:
+    """Thread-safe bounded LRU with a per-entry TTL"""
+
+    def __init__(self, max_entries: int = CACHE_LOCAL_MAX_ENTRIES, ttl_seconds: float = CACHE_LOCAL_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._data: "OrderedDict[Any, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[0] < now:
+                if entry is not None:
+                    del self._data[key]
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value, ttl_seconds: Optional[float] = None) -> None:
+        expires = time.monotonic() + (ttl_seconds if ttl_seconds is not None else self.ttl_seconds)
+        with self._lock:
+            self._data[key] = (expires, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def add(self, key, value) -> bool:
+        """set() unless the key holds a live entry; returns whether it was written"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and entry[0] >= now:
+                return False
+            self._data[key] = (now + self.ttl_seconds, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+            return True
+
+    def delete(self, key) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class LocalDictBackend:
+    """Dict-backed stand-in for the shared tier (tests / single-process dev)"""
+
+    def __init__(self):
+        self._data: Dict[str, tuple] = {}
+        self._lock = threading.Lock()
+
+    def get_many(self, keys: List[str]) -> Dict[str, str]:
+        now = time.time()
+        with self._lock:
+            out = {}
+            for key in keys:
+                entry = self._data.get(key)
+                if entry and entry[0] >= now:
+                    out[key] = entry[1]
+            return out
+
+    def set_many(self, items: Dict[str, str], ttl_seconds: int, overwrite: bool = True) -> None:
+        now = time.time()
+        with self._lock:
+            for key, value in items.items():
+                entry = self._data.get(key)
+                if overwrite or entry is None or entry[0] < now:
+                    self._data[key] = (now + ttl_seconds, value)
+
+    def publish(self, channel: str, message: str) -> None:
+        # Single process: the local tier was already invalidated
+        pass
+
+
+class RedisBackend:
+    """Shared tier on Redis (optional dependency, enabled by REDIS_URL)"""
+
+    def __init__(self, url: str):
+        import redis
+        self._url = url
+        self._client = redis.Redis.from_url(url, socket_timeout=0.25, decode_responses=True)
+
+    def get_many(self, keys: List[str]) -> Dict[str, str]:
+        values = self._client.mget(keys)
+        return {k: v for k, v in zip(keys, values) if v is not None}
+
+    def set_many(self, items: Dict[str, str], ttl_seconds: int, overwrite: bool = True) -> None:
+        """`overwrite=False` writes only absent keys (SET NX), so a tombstone blocks the fill"""
+        pipe = self._client.pipeline(transaction=False)
+        for key, value in items.items():
+            pipe.set(key, value, ex=ttl_seconds, nx=not overwrite)
+        pipe.execute()
+
+    def publish(self, channel: str, message: str) -> None:
+        self._client.publish(channel, message)
+
+    def listen(self, channel: str, on_message: Callable[[str], None], on_subscribe: Callable[[], None],
+               stop: threading.Event) -> None:
+        """Deliver `channel` messages until `stop` is set; raises if the connection drops"""
+        import redis
+        # Own connection without the short socket timeout of the request path
+        client = redis.Redis.from_url(self._url, decode_responses=True)
+        pubsub = client.pubsub(ignore_subscribe_messages=True)
+        try:
+            pubsub.subscribe(channel)
+            on_subscribe()
+            while not stop.is_set():
+                message = pubsub.get_message(timeout=1.0)
+                if message is not None:
+                    on_message(message["data"])
+        finally:
+            pubsub.close()
+            client.close()
+
+
+_shared_backend = None
+_shared_backend_resolved = False
+
+
+def get_shared_backend():
+    global _shared_backend, _shared_backend_resolved
+    if not _shared_backend_resolved:
+        _shared_backend_resolved = True
+        if REDIS_URL:
+            try:
+                _shared_backend = RedisBackend(REDIS_URL)
+            except ImportError:
+                logger.warning("REDIS_URL is set but the redis package is not installed, shared cache disabled")
+    return _shared_backend
+
+
+def set_shared_backend(backend) -> None:
+    """Override the shared tier (e.g. LocalDictBackend() in tests, None to disable)"""
+    global _shared_backend, _shared_backend_resolved
+    _shared_backend = backend
+    _shared_backend_resolved = True
+
+
+# Shared-tier calls made from the event loop wait for these threads, not the request threadpool
+_shared_limiter = anyio.CapacityLimiter(32)
+
+
+def _call_shared(fn, *args):
+    """Run a blocking backend call without blocking the event loop (see module docstring)"""
+    if in_greenlet():
+        return await_only(anyio.to_thread.run_sync(fn, *args, limiter=_shared_limiter))
+    return fn(*args)
+
+
+# namespace -> cache, for invalidations published by other workers
+_caches: Dict[str, "TwoTierCache"] = {}
+
+
+class TwoTierCache:
+    """Namespaced get/set/invalidate over the local LRU and the shared backend"""
+
+    def __init__(self, namespace: str, max_entries: int = CACHE_LOCAL_MAX_ENTRIES,
+                 local_ttl: float = CACHE_LOCAL_TTL_SECONDS, shared_ttl: int = CACHE_SHARED_TTL_SECONDS):
+        self.namespace = namespace
+        self.local = LRUCache(max_entries, local_ttl)
+        self.shared_ttl = shared_ttl
+        _caches[namespace] = self
+
+    def _key(self, key) -> str:
+        return f"buyv:{self.namespace}:{key}"
+
+    def get_many(self, keys: Iterable) -> Dict[Any, dict]:
+        found: Dict[Any, dict] = {}
+        missing = []
+        for key in keys:
+            value = self.local.get(key)
+            if value is None:
+                missing.append(key)
+            elif value is not _LOCAL_TOMBSTONE:
+                found[key] = value
+        backend = get_shared_backend()
+        if missing and backend is not None:
+            try:
+                raw = _call_shared(backend.get_many, [self._key(k) for k in missing])
+            except Exception as e:
+                logger.warning(f"Shared cache read failed: {e}")
+                raw = {}
+            for key in missing:
+                payload = raw.get(self._key(key))
+                if payload is not None and payload != TOMBSTONE:
+                    value = json.loads(payload)
+                    # An invalidation may have tombstoned the key since the read
+                    self.local.add(key, value)
+                    found[key] = value
+        return found
+
+    def set_many(self, items: Dict[Any, dict], overwrite: bool = False) -> None:
+        """Fill keys loaded from the database; keys holding a value or a tombstone are left alone.
+
+        `overwrite=True` replaces both (for values that are not read-then-set fills).
+        """
+        if not items:
+            return
+        for key, value in items.items():
+            if overwrite:
+                self.local.set(key, value)
+            else:
+                self.local.add(key, value)
+        backend = get_shared_backend()
+        if backend is not None:
+            try:
+                _call_shared(
+                    backend.set_many,
+                    {self._key(k): json.dumps(v, default=str) for k, v in items.items()},
+                    self.shared_ttl,
+                    overwrite,
+                )
+            except Exception as e:
+                logger.warning(f"Shared cache write failed: {e}")
+
+    def _tombstone_local(self, key) -> None:
+        self.local.set(key, _LOCAL_TOMBSTONE, ttl_seconds=CACHE_TOMBSTONE_SECONDS)
+
+    def invalidate(self, *keys) -> None:
+        for key in keys:
+            self._tombstone_local(key)
+        backend = get_shared_backend()
+        if keys and backend is not None:
+            try:
+                _call_shared(self._invalidate_shared, backend, list(keys))
+            except Exception as e:
+                logger.warning(f"Shared cache invalidation failed: {e}")
+
+    def _invalidate_shared(self, backend, keys: list) -> None:
+        backend.set_many({self._key(k): TOMBSTONE for k in keys}, CACHE_TOMBSTONE_SECONDS, True)
+        backend.publish(INVALIDATION_CHANNEL, json.dumps({"ns": self.namespace, "keys": keys}, default=str))
+
+    def clear_local(self) -> None:
+        self.local.clear()
+
+
+def _apply_invalidation(message: str) -> None:
+    try:
+        payload = json.loads(message)
+        cache = _caches.get(payload["ns"])
+        keys = payload["keys"]
+    except (ValueError, KeyError, TypeError):
+        logger.warning(f"Ignoring malformed cache invalidation: {message!r}")
+        return
+    if cache is not None:
+        for key in keys:
+            cache._tombstone_local(key)
+
+
+def _clear_all_local() -> None:
+    for cache in list(_caches.values()):
+        cache.clear_local()
+
+
+class _InvalidationListener:
+    """Subscribes to INVALIDATION_CHANNEL and applies other workers' invalidations to the local tiers"""
+
+    def __init__(self):
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self) -> None:
+        backend = get_shared_backend()
+        if not hasattr(backend, "listen") or self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, args=(backend,), name="cache-invalidation", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def _run(self, backend) -> None:
+        while not self._stop.is_set():
+            try:
+                # Messages may have been missed while unsubscribed
+                backend.listen(INVALIDATION_CHANNEL, _apply_invalidation, _clear_all_local, self._stop)
+            except Exception as e:
+                logger.warning(f"Cache invalidation subscription lost: {e}")
+                self._stop.wait(1.0)
+
+
+listener = _InvalidationListener()
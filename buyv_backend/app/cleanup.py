@@ -5,6 +5,8 @@ from fastapi import APIRouter, Depends
 from sqlalchemy.orm import Session
 from .database import get_db
 from .models import Post
+from . import search, timeline
+from .hydration import invalidate_post
 
 router = APIRouter(prefix="/cleanup", tags=["cleanup"])
 
@@ -43,6 +45,7 @@ async def delete_invalid_posts(db: Session = Depends(get_db)):
     """Supprime les posts avec URLs invalides"""
     all_posts = db.query(Post).filter(Post.type.in_(['reel', 'video'])).all()
     deleted_count = 0
+    deleted_uids = []
     
     for post in all_posts:
         is_invalid = False
@@ -54,10 +57,14 @@ async def delete_invalid_posts(db: Session = Depends(get_db)):
             is_invalid = True
         
         if is_invalid:
+            timeline.remove_post(db, post.id)
+            search.unindex_posts(db, post.id)
             db.delete(post)
+            deleted_uids.append(post.uid)
             deleted_count += 1
     
     db.commit()
+    invalidate_post(*deleted_uids)
     
     remaining = db.query(Post).filter(Post.type.in_(['reel', 'video'])).count()
     
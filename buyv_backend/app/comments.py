@@ -1,31 +1,66 @@
-from fastapi import APIRouter, Depends, HTTPException, Query
+"""
+Comment threads.
+
+Threads are read with keyset pagination (`X-Next-Cursor`), so page N costs
+the same as page 1:
+
+- `sort=new` (default) walks `ix_comments_post_created (post_id, created_at, id)`;
+- `sort=top` walks `ix_comment_scores_post_likes (post_id, likes_count, comment_id)`
+  in `comment_scores`, whose like counts are maintained by the counter folder.
+
+The post uid is resolved and author cards are loaded through the hydration
+caches, so a page is usually a single query. Reads and likes run through the
+DbRunner (async engine when USE_ASYNC_DB is set).
+"""
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
+from sqlalchemy import select
 from sqlalchemy.orm import Session
-from typing import List
-from datetime import datetime
+from typing import Dict, List, Optional
 
 from .database import get_db
-from .models import User, Post, Comment
-from .auth import get_current_user
+from .async_database import DbRunner, get_db_runner
+from .replicas import get_read_db_runner
+from .models import User, Comment, CommentLike, CommentScore
+from .auth import Principal, get_current_user, get_current_writer
 from .schemas import CommentCreate, CommentOut
+from .hydration import author_card, load_author_cards, load_post_cards
+from .pagination import encode_cursor, encode_score_cursor, keyset_before, keyset_below, set_next_cursor
+from .upserts import delete_returning, insert_new
+from . import counters
 
 router = APIRouter(prefix="/comments", tags=["comments"])
 
 
-def _map_comment_out(comment: Comment, user: User, post_uid: str) -> CommentOut:
-    """Map Comment model to CommentOut schema"""
+def _map_comment_out(comment, author: dict, post_uid: str, likes_count: int = 0) -> CommentOut:
+    """Map a comment row and its cached author card to the CommentOut schema"""
     return CommentOut(
         id=comment.id,
-        user_id=user.uid,
-        username=user.username,
-        display_name=user.display_name,
-        user_profile_image=user.profile_image_url,
+        user_id=author["uid"],
+        username=author["username"],
+        display_name=author["display_name"],
+        user_profile_image=author["profile_image_url"],
         post_id=post_uid,
         content=comment.content,
+        likes_count=likes_count,
         created_at=comment.created_at,
         updated_at=comment.updated_at,
     )
 
 
+def _post_id(db: Session, post_uid: str) -> int:
+    card = load_post_cards(db, [post_uid]).get(post_uid)
+    if not card:
+        raise HTTPException(status_code=404, detail="Post not found")
+    return card["id"]
+
+
+def _comment_ref(db: Session, comment_id: int):
+    comment = db.query(Comment.id, Comment.post_id).filter(Comment.id == comment_id).first()
+    if not comment:
+        raise HTTPException(status_code=404, detail="Comment not found")
+    return comment
+
+
 @router.post("/{post_uid}", response_model=CommentOut)
 def add_comment(
     post_uid: str,
@@ -34,64 +69,129 @@ def add_comment(
     current_user: User = Depends(get_current_user),
 ):
     """Add a comment to a post"""
-    # Find the post
-    post = db.query(Post).filter(Post.uid == post_uid).first()
-    if not post:
-        raise HTTPException(status_code=404, detail="Post not found")
+    post_id = _post_id(db, post_uid)
     
     # Create the comment
     comment = Comment(
         user_id=current_user.id,
-        post_id=post.id,
+        post_id=post_id,
         content=payload.content,
     )
     db.add(comment)
+    db.flush()
+    db.add(CommentScore(comment_id=comment.id, post_id=post_id, likes_count=0))
     
-    # Increment the post's comments count
-    post.comments_count = (post.comments_count or 0) + 1
+    # Increment the post's comments count (applied by the counter folder)
+    counters.record(db, "post", post_id, "comments_count", 1)
     
+    out = _map_comment_out(comment, author_card(current_user), post_uid)
     db.commit()
-    db.refresh(comment)
-    
-    return _map_comment_out(comment, current_user, post_uid)
+    return out
 
 
 @router.get("/{post_uid}", response_model=List[CommentOut])
-def get_comments(
+async def get_comments(
     post_uid: str,
+    response: Response,
     limit: int = Query(default=20, ge=1, le=100),
     offset: int = Query(default=0, ge=0),
-    db: Session = Depends(get_db),
+    cursor: Optional[str] = None,
+    sort: str = Query(default="new", pattern="^(new|top)$"),
+    db: DbRunner = Depends(get_read_db_runner),
 ):
-    """Fetch comments for a post with pagination"""
-    # Find the post
-    post = db.query(Post).filter(Post.uid == post_uid).first()
-    if not post:
-        raise HTTPException(status_code=404, detail="Post not found")
-    
-    # Fetch comments with pagination, ordered by newest first
-    comments = (
-        db.query(Comment)
-        .filter(Comment.post_id == post.id)
-        .order_by(Comment.created_at.desc())
-        .offset(offset)
-        .limit(limit)
-        .all()
-    )
-    
-    if not comments:
+    """
+    Fetch comments for a post, newest first (`sort=new`) or most liked first
+    (`sort=top`). Pass the `X-Next-Cursor` response header back as `cursor`
+    for the next page; `offset` is still accepted for older clients.
+    """
+    return await db.run(_comment_page, post_uid, response, limit, offset, cursor, sort)
+
+
+def _comment_page(db: Session, post_uid: str, response: Response, limit: int, offset: int,
+                  cursor: Optional[str], sort: str) -> List[CommentOut]:
+    post_id = _post_id(db, post_uid)
+
+    if sort == "top":
+        query = (
+            select(Comment, CommentScore.likes_count)
+            .join(CommentScore, CommentScore.comment_id == Comment.id)
+            .where(CommentScore.post_id == post_id)
+            .order_by(CommentScore.likes_count.desc(), CommentScore.comment_id.desc())
+        )
+        if cursor:
+            query = query.where(keyset_below(CommentScore.likes_count, CommentScore.comment_id, cursor))
+    else:
+        query = (
+            select(Comment, CommentScore.likes_count)
+            .outerjoin(CommentScore, CommentScore.comment_id == Comment.id)
+            .where(Comment.post_id == post_id)
+            .order_by(Comment.created_at.desc(), Comment.id.desc())
+        )
+        if cursor:
+            query = query.where(keyset_before(Comment.created_at, Comment.id, cursor))
+    if offset and not cursor:
+        query = query.offset(offset)
+    rows = db.execute(query.limit(limit)).all()
+
+    if len(rows) == limit:
+        last, likes = rows[-1]
+        if sort == "top":
+            set_next_cursor(response, encode_score_cursor(likes or 0, last.id))
+        else:
+            set_next_cursor(response, encode_cursor(last.created_at, last.id))
+    if not rows:
         return []
-    
-    # Fetch all users who created these comments
-    user_ids = list({c.user_id for c in comments})
-    users = db.query(User).filter(User.id.in_(user_ids)).all()
-    user_map = {u.id: u for u in users}
-    
-    # Map comments to output schema
-    result = []
-    for comment in comments:
-        user = user_map.get(comment.user_id)
-        if user:
-            result.append(_map_comment_out(comment, user, post_uid))
-    
-    return result
+
+    # Author cards come from the shared hydration cache
+    authors: Dict[int, dict] = load_author_cards(db, [comment.user_id for comment, _ in rows])
+    return [
+        _map_comment_out(comment, authors[comment.user_id], post_uid, likes or 0)
+        for comment, likes in rows
+        if comment.user_id in authors
+    ]
+
+
+@router.post("/{comment_id}/like")
+async def like_comment(
+    comment_id: int,
+    db: DbRunner = Depends(get_db_runner),
+    current_user: Principal = Depends(get_current_writer),
+):
+    changed = await db.run(_like, comment_id, current_user.id, True)
+    return {"status": "liked" if changed else "already_liked"}
+
+
+@router.delete("/{comment_id}/like")
+async def unlike_comment(
+    comment_id: int,
+    db: DbRunner = Depends(get_db_runner),
+    current_user: Principal = Depends(get_current_writer),
+):
+    changed = await db.run(_like, comment_id, current_user.id, False)
+    return {"status": "unliked" if changed else "not_liked"}
+
+
+def _like(db: Session, comment_id: int, user_id: int, add: bool) -> list:
+    comment = _comment_ref(db, comment_id)
+    with actions.rejecting_missing_rows(db, user_id, "Comment not found"):
+        if add:
+            changed = insert_new(
+                db, CommentLike, ("comment_id", "user_id"),
+                [{"comment_id": comment.id, "user_id": user_id}], CommentLike.comment_id,
+            )
+        else:
+            changed = delete_returning(
+                db, CommentLike, CommentLike.comment_id,
+                CommentLike.comment_id == comment.id, CommentLike.user_id == user_id,
+            )
+        if changed:
+            counters.record(db, "comment", comment.id, "likes_count", 1 if add else -1)
+        db.commit()
+    return changed
+
+
+def remove_comments(db: Session, *conditions) -> None:
+    """Delete the likes and scores of the comments matching `conditions` (before deleting the comments)"""
+    comment_ids = select(Comment.id).where(*conditions)
+    db.execute(CommentLike.__table__.delete().where(CommentLike.comment_id.in_(comment_ids)))
+    db.execute(CommentScore.__table__.delete().where(CommentScore.comment_id.in_(comment_ids)))
@@ -0,0 +1,95 @@
+"""
+Commission state machine.
+
+Commissions move pending -> paid (order delivered) or pending/paid -> canceled
+(order canceled). A transition is applied set-based, one
+`UPDATE commissions ... WHERE order_id IN (...)` per allowed source state,
+inside the caller's transaction. Source states are matched by ledger bucket
+(`ledger.bucket`), so legacy values such as "Pending", "PAID" or an unknown
+status behave exactly as the ledger counts them. The amounts that
+actually moved (RETURNING) are forwarded to the promoter ledger in the same
+transaction, so a row already in the target state, or moved concurrently by
+another request, is never counted twice.
+"""
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional
+
+from sqlalchemy import select, update
+from sqlalchemy.orm import Session
+
+from . import ledger
+from .config import ORDER_BULK_CHUNK_SIZE
+from .models import Commission, Order
+
+# target commission status -> statuses it may be entered from
+TRANSITIONS: Dict[str, tuple] = {
+    "paid": ("pending",),
+    "canceled": ("pending", "paid"),
+}
+
+# order status -> commission status it implies
+ORDER_STATUS_TARGETS: Dict[str, str] = {
+    "delivered": "paid",
+    "canceled": "canceled",
+}
+
+
+def target_for_order_status(order_status: str) -> Optional[str]:
+    return ORDER_STATUS_TARGETS.get(order_status.lower())
+
+
+def _chunks(ids: List[int]):
+    for start in range(0, len(ids), ORDER_BULK_CHUNK_SIZE):
+        yield ids[start:start + ORDER_BULK_CHUNK_SIZE]
+
+
+def _move(db: Session, order_ids: List[int], source: str, target: str, now: datetime) -> list:
+    where = (Commission.order_id.in_(order_ids), ledger.bucket_sql(Commission.status) == source)
+    values = {"status": target, "updated_at": now}
+    if target == "paid":
+        values["paid_at"] = now
+    stmt = update(Commission).where(*where).values(values).execution_options(synchronize_session=False)
+    if db.get_bind().dialect.update_returning:
+        return db.execute(stmt.returning(Commission.user_uid, Commission.commission_amount)).all()
+    # No UPDATE ... RETURNING (MySQL): lock and read the rows first
+    rows = db.execute(
+        select(Commission.user_uid, Commission.commission_amount).where(*where).with_for_update()
+    ).all()
+    db.execute(stmt)
+    return rows
+
+
+def transition_orders(db: Session, order_ids: Iterable[int], target: str) -> int:
+    """Move the commissions of `order_ids` to `target`; returns how many rows changed. The caller commits."""
+    allowed_from = TRANSITIONS.get(target)
+    if allowed_from is None:
+        raise ValueError(f"Unknown commission state {target!r}")
+    order_ids = sorted(set(order_ids))
+    now = datetime.utcnow()
+    changed = 0
+    for chunk in _chunks(order_ids):
+        for source in allowed_from:
+            rows = _move(db, chunk, source, target, now)
+            ledger.move(db, rows, source, target)
+            changed += len(rows)
+    return changed
+
+
+def set_order_status(db: Session, order_ids: Iterable[int], order_status: str) -> Dict[str, int]:
+    """Set-based order status change plus the implied commission transition. The caller commits."""
+    order_ids = sorted(set(order_ids))
+    now = datetime.utcnow()
+    orders = 0
+    for chunk in _chunks(order_ids):
+        result = db.execute(
+            update(Order)
+            .where(Order.id.in_(chunk))
+            .values(status=order_status, updated_at=now)
+            .execution_options(synchronize_session=False)
+        )
+        orders += result.rowcount
+    commissions = 0
+    target = target_for_order_status(order_status)
+    if target:
+        commissions = transition_orders(db, order_ids, target)
+    return {"orders": orders, "commissions": commissions}
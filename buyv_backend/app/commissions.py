@@ -1,25 +1,23 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
 from sqlalchemy.orm import Session
+from typing import Optional
 import json
-from datetime import datetime
 
 from .database import get_db
 from .models import User, Commission
 from .auth import get_current_user
-from .schemas import CommissionOut, StatusUpdate
+from .pagination import keyset_before, next_cursor_for, set_next_cursor
+from .schemas import CommissionOut, CommissionSummaryOut, StatusUpdate
+from . import ledger
 
 router = APIRouter(prefix="/commissions", tags=["commissions"])
 
+DEFAULT_PAGE_SIZE = 50
 
-def _map_commission_out(row: Commission, db: Session) -> dict:
-    # Resolve user UID
-    uid = None
-    if row.user_id:
-        u = db.query(User).filter(User.id == row.user_id).first()
-        uid = u.uid if u else None
-    if not uid:
-        uid = row.user_uid
 
+def _map_commission_out(row: Commission) -> dict:
+    # user_uid is always written with the commission (migration 0004 backfilled
+    # older rows), so no per-row users lookup is needed
     try:
         metadata = json.loads(row.metadata_json) if row.metadata_json else None
     except Exception:
@@ -27,7 +25,7 @@ def _map_commission_out(row: Commission, db: Session) -> dict:
 
     return {
         "id": row.id,
-        "userId": uid,
+        "userId": row.user_uid,
         "orderId": str(row.order_id),
         "orderItemId": str(row.order_item_id) if row.order_item_id else None,
         "productId": row.product_id,
@@ -44,25 +42,52 @@ def _map_commission_out(row: Commission, db: Session) -> dict:
 
 
 @router.get("/me", response_model=list[CommissionOut])
-def list_my_commissions(db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
-    rows = (
-        db.query(Commission)
-        .filter((Commission.user_id == current_user.id) | (Commission.user_uid == current_user.uid))
-        .order_by(Commission.created_at.desc())
-        .all()
+def list_my_commissions(
+    response: Response,
+    status: Optional[str] = Query(default=None),
+    limit: Optional[int] = Query(default=None, ge=1, le=200),
+    cursor: Optional[str] = Query(default=None, description="Opaque cursor from the X-Next-Cursor header"),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+):
+    # Single predicate on user_uid so ix_commissions_user_uid_created serves the scan
+    query = db.query(Commission).filter(Commission.user_uid == current_user.uid)
+    if status:
+        query = query.filter(Commission.status == status)
+    if cursor:
+        query = query.filter(keyset_before(Commission.created_at, Commission.id, cursor))
+        limit = limit or DEFAULT_PAGE_SIZE
+    query = query.order_by(Commission.created_at.desc(), Commission.id.desc())
+    if limit is None:
+        # Legacy contract: no limit/cursor returns the full list
+        rows = query.all()
+    else:
+        rows = query.limit(limit).all()
+        set_next_cursor(response, next_cursor_for(rows, limit))
+    return [_map_commission_out(row) for row in rows]
+
+
+@router.get("/me/summary", response_model=CommissionSummaryOut)
+def my_commission_summary(db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+    """Pending / paid / canceled totals from promoter_balances (primary-key read)"""
+    balance = ledger.get_balance(db, current_user.uid)
+    if not balance:
+        return CommissionSummaryOut()
+    return CommissionSummaryOut(
+        pending_amount=round(balance.pending_amount, 2),
+        paid_amount=round(balance.paid_amount, 2),
+        canceled_amount=round(balance.canceled_amount, 2),
+        pending_count=balance.pending_count,
+        paid_count=balance.paid_count,
+        canceled_count=balance.canceled_count,
     )
-    return [_map_commission_out(row, db) for row in rows]
 
 
 @router.post("/{commission_id}/status")
 def update_commission_status(commission_id: int, payload: StatusUpdate, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
-    row = db.query(Commission).filter(Commission.id == commission_id).first()
+    row = db.query(Commission).filter(Commission.id == commission_id).with_for_update().first()
     if not row:
         raise HTTPException(status_code=404, detail="Commission not found")
-    row.status = payload.status
-    if payload.status.lower() == "paid":
-        row.paid_at = datetime.utcnow()
-    row.updated_at = datetime.utcnow()
-    db.add(row)
+    ledger.transition(db, [row], payload.status)
     db.commit()
-    return {"status": "ok"}
\ No newline at end of file
+    return {"status": "ok"}
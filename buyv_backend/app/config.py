@@ -26,4 +26,138 @@ if DATABASE_URL.startswith("postgres://"):
 CJ_API_KEY = os.getenv("CJ_API_KEY", "")
 CJ_ACCOUNT_ID = os.getenv("CJ_ACCOUNT_ID", "")
 CJ_EMAIL = os.getenv("CJ_EMAIL", "")
-STRIPE_SECRET_KEY = os.getenv("STRIPE_SECRET_KEY", "")
\ No newline at end of file
+STRIPE_SECRET_KEY = os.getenv("STRIPE_SECRET_KEY", "")
+
+# Home timeline (fan-out-on-write)
+# Authors with at least this many followers are merged in at read time instead of fanned out
+TIMELINE_CELEBRITY_THRESHOLD = int(os.getenv("TIMELINE_CELEBRITY_THRESHOLD", "10000"))
+# Recent posts copied into an inbox when a user follows someone
+TIMELINE_FOLLOW_BACKFILL = int(os.getenv("TIMELINE_FOLLOW_BACKFILL", "50"))
+# Inbox length kept by the backfill/trim command
+TIMELINE_MAX_ENTRIES = int(os.getenv("TIMELINE_MAX_ENTRIES", "1000"))
+
+# Caching
+# Optional shared cache tier (Redis); without it each worker only uses its local LRU
+REDIS_URL = os.getenv("REDIS_URL", "")
+CACHE_LOCAL_MAX_ENTRIES = int(os.getenv("CACHE_LOCAL_MAX_ENTRIES", "50000"))
+# Local entries are not invalidated across workers, so keep this short
+CACHE_LOCAL_TTL_SECONDS = float(os.getenv("CACHE_LOCAL_TTL_SECONDS", "30"))
+CACHE_SHARED_TTL_SECONDS = int(os.getenv("CACHE_SHARED_TTL_SECONDS", "3600"))
+# How long an invalidated key refuses fills: covers a reader that loaded the row before the write committed
+CACHE_TOMBSTONE_SECONDS = int(os.getenv("CACHE_TOMBSTONE_SECONDS", "10"))
+
+# User search (/users/search)
+# Lifetime of the in-memory prefix index used for prefix_only lookups on SQLite
+USER_SEARCH_INDEX_TTL_SECONDS = float(os.getenv("USER_SEARCH_INDEX_TTL_SECONDS", "300"))
+# Upper bound on name matches ranked per search (per name column and LIKE kind, see user_search.py)
+USER_SEARCH_MAX_CANDIDATES = int(os.getenv("USER_SEARCH_MAX_CANDIDATES", "1000"))
+
+# Counter maintenance (likes/comments/followers counts)
+# How often each worker folds pending counter_deltas into the *_count columns (0 disables)
+COUNTER_FOLD_INTERVAL_SECONDS = float(os.getenv("COUNTER_FOLD_INTERVAL_SECONDS", "2"))
+COUNTER_FOLD_BATCH_SIZE = int(os.getenv("COUNTER_FOLD_BATCH_SIZE", "10000"))
+# Rows recounted (and locked) per transaction by counters.reconcile()
+COUNTER_RECONCILE_BATCH_SIZE = int(os.getenv("COUNTER_RECONCILE_BATCH_SIZE", "1000"))
+
+# Authenticated principal cache
+# Seconds a resolved user row is reused by one worker before it is re-read from the shared tier
+PRINCIPAL_CACHE_TTL_SECONDS = float(os.getenv("PRINCIPAL_CACHE_TTL_SECONDS", "30"))
+PRINCIPAL_CACHE_MAX_ENTRIES = int(os.getenv("PRINCIPAL_CACHE_MAX_ENTRIES", "20000"))
+# Lifetime of a principal snapshot in the shared (Redis) tier; writes and counter folds invalidate it.
+# Both principal TTLs are capped at ACCESS_TOKEN_EXPIRE_MINUTES (see auth.py)
+PRINCIPAL_CACHE_SHARED_TTL_SECONDS = int(os.getenv("PRINCIPAL_CACHE_SHARED_TTL_SECONDS", "600"))
+# Embed the immutable internal user id in access tokens so read-only routes skip the user lookup
+JWT_EMBED_USER_ID = os.getenv("JWT_EMBED_USER_ID", "true").lower() == "true"
+
+# Password hashing
+# Processes in the dedicated bcrypt pool (0 = run in a thread, e.g. for local dev)
+HASH_WORKERS = int(os.getenv("HASH_WORKERS", "2"))
+# Hash/verify jobs allowed in flight before new logins are rejected with 503
+HASH_MAX_PENDING = int(os.getenv("HASH_MAX_PENDING", "64"))
+# bcrypt cost factor; existing hashes with a different cost are rehashed on login
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+
+# Back-office integrations (carrier webhooks, batch delivery confirmations)
+# Shared secret expected in the X-Api-Key header; empty disables the endpoints
+BACKOFFICE_API_KEY = os.getenv("BACKOFFICE_API_KEY", "")
+# Orders per UPDATE ... WHERE id IN (...) chunk in bulk status transitions
+ORDER_BULK_CHUNK_SIZE = int(os.getenv("ORDER_BULK_CHUNK_SIZE", "1000"))
+
+# Push notification outbox (see push_queue.py)
+# Delivery threads per API worker (0 disables delivery in this process)
+PUSH_WORKERS = int(os.getenv("PUSH_WORKERS", "2"))
+# Tokens per FCM batch call (FCM maximum is 500)
+PUSH_BATCH_SIZE = min(int(os.getenv("PUSH_BATCH_SIZE", "500")), 500)
+# Outbox rows claimed per worker iteration
+PUSH_CLAIM_SIZE = int(os.getenv("PUSH_CLAIM_SIZE", "2000"))
+PUSH_POLL_INTERVAL_SECONDS = float(os.getenv("PUSH_POLL_INTERVAL_SECONDS", "1"))
+# Claimed rows not finished within this lease are picked up again (crashed worker)
+PUSH_LEASE_SECONDS = int(os.getenv("PUSH_LEASE_SECONDS", "120"))
+PUSH_MAX_ATTEMPTS = int(os.getenv("PUSH_MAX_ATTEMPTS", "6"))
+# Exponential backoff between attempts: base * 2^(attempt-1), capped
+PUSH_RETRY_BASE_SECONDS = float(os.getenv("PUSH_RETRY_BASE_SECONDS", "5"))
+PUSH_RETRY_MAX_SECONDS = float(os.getenv("PUSH_RETRY_MAX_SECONDS", "900"))
+
+# Notification inbox
+# Seconds an unread count is served from the per-worker cache
+NOTIFICATION_UNREAD_CACHE_TTL_SECONDS = float(os.getenv("NOTIFICATION_UNREAD_CACHE_TTL_SECONDS", "10"))
+# Notifications older than this are moved to notifications_archive by archive_notifications.py
+NOTIFICATION_RETENTION_DAYS = int(os.getenv("NOTIFICATION_RETENTION_DAYS", "90"))
+NOTIFICATION_ARCHIVE_BATCH_SIZE = int(os.getenv("NOTIFICATION_ARCHIVE_BATCH_SIZE", "5000"))
+
+# New-post follower notifications (see fanout.py)
+# Fan-out threads per API worker (0 disables processing in this process)
+FANOUT_WORKERS = int(os.getenv("FANOUT_WORKERS", "1"))
+# Followers handled per INSERT ... SELECT chunk
+FANOUT_CHUNK_SIZE = int(os.getenv("FANOUT_CHUNK_SIZE", "5000"))
+# Audiences at least this large get one FCM topic message instead of per-token multicast
+FANOUT_TOPIC_THRESHOLD = int(os.getenv("FANOUT_TOPIC_THRESHOLD", "10000"))
+FANOUT_POLL_INTERVAL_SECONDS = float(os.getenv("FANOUT_POLL_INTERVAL_SECONDS", "1"))
+FANOUT_LEASE_SECONDS = int(os.getenv("FANOUT_LEASE_SECONDS", "300"))
+FANOUT_MAX_ATTEMPTS = int(os.getenv("FANOUT_MAX_ATTEMPTS", "5"))
+
+# Device tokens
+# Tokens not refreshed by the app for this long are deleted by maintain_device_tokens.py
+DEVICE_TOKEN_STALE_DAYS = int(os.getenv("DEVICE_TOKEN_STALE_DAYS", "270"))
+
+# Viewer relationship state (see viewer.py)
+# Each viewer's followed-user set is cached for this long (follow/unfollow invalidate it on every worker)
+VIEWER_FOLLOWING_CACHE_TTL_SECONDS = float(os.getenv("VIEWER_FOLLOWING_CACHE_TTL_SECONDS", "15"))
+# Number of viewers cached in each worker's local tier
+VIEWER_FOLLOWING_CACHE_ENTRIES = int(os.getenv("VIEWER_FOLLOWING_CACHE_ENTRIES", "1000"))
+# Viewers following more users than this are answered with IN queries instead of a cached set
+VIEWER_FOLLOWING_CACHE_MAX = int(os.getenv("VIEWER_FOLLOWING_CACHE_MAX", "1000"))
+
+# Async database layer (see async_database.py)
+# When true the hot routes (feed, posts, comments, follows, auth) run their queries on an
+# AsyncEngine (asyncpg / aiosqlite) on the event loop instead of in the threadpool
+USE_ASYNC_DB = os.getenv("USE_ASYNC_DB", "false").lower() == "true"
+# Optional explicit async URL; derived from DATABASE_URL when empty
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL", "")
+
+# Database connection pool (see db_pool.py; applies to the sync and async engines)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+# Seconds a request waits for a free connection before failing
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE_SECONDS = int(os.getenv("DB_POOL_RECYCLE_SECONDS", "3600"))
+# Reuse the most recently returned connection first, so surplus ones go idle and get recycled
+DB_POOL_USE_LIFO = os.getenv("DB_POOL_USE_LIFO", "true").lower() == "true"
+# Liveness check on checkout: "always", "idle" (only after DB_POOL_PING_IDLE_SECONDS in the pool) or "never"
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "idle").lower()
+DB_POOL_PING_IDLE_SECONDS = float(os.getenv("DB_POOL_PING_IDLE_SECONDS", "30"))
+# Behind PgBouncer in transaction mode: disable server-side prepared statements
+DB_PGBOUNCER = os.getenv("DB_PGBOUNCER", "false").lower() == "true"
+
+# Read replicas (see replicas.py)
+# Comma-separated replica URLs for read-only GET endpoints; empty sends every read to the primary
+DATABASE_REPLICA_URLS = [url.strip() for url in os.getenv("DATABASE_REPLICA_URLS", "").split(",") if url.strip()]
+# Replicas further behind than this (or failing their check) are skipped until they catch up
+REPLICA_MAX_LAG_SECONDS = float(os.getenv("REPLICA_MAX_LAG_SECONDS", "5"))
+REPLICA_LAG_CHECK_INTERVAL_SECONDS = float(os.getenv("REPLICA_LAG_CHECK_INTERVAL_SECONDS", "5"))
+# After a user's write (any non-GET request) their reads stay on the primary for this long
+READ_YOUR_WRITES_SECONDS = float(os.getenv("READ_YOUR_WRITES_SECONDS", "5"))
+
+# Schema migrations (see app/migrations, migrate.py)
+# Apply pending revisions when a worker boots; with false, boot fails until `python migrate.py` has run
+AUTO_MIGRATE = os.getenv("AUTO_MIGRATE", "true").lower() == "true"
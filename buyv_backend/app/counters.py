@@ -0,0 +1,298 @@
+"""
+Counter maintenance for the denormalized *_count columns.
+
+Write paths never read-modify-write a counter. They append a row to
+`counter_deltas` (an insert takes no lock on the hot post/user row), and a
+periodic folder coalesces pending deltas into one
+`UPDATE ... SET x = x + :delta` per touched row. The folder claims its batch
+with `DELETE ... RETURNING`, so several workers can fold concurrently without
+applying a delta twice.
+
+Profile statistics live in `user_stats` (one row per user, created on the
+first delta), so `/users/{uid}/stats` is a primary-key read. Comment like
+counts live in `comment_scores`, the key of the "top comments" ordering.
+
+`reconcile()` recomputes every counter from the source tables and is meant
+to run nightly (see reconcile_counters.py) to correct any drift. It runs
+alongside live traffic and the folder, so it never discards deltas.
+"""
+import logging
+import threading
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, Set, Tuple
+
+from sqlalchemy import bindparam, case, delete, func, insert, literal, select, update
+from sqlalchemy.orm import Session
+
+from .auth import invalidate_principal_ids
+from .config import COUNTER_FOLD_BATCH_SIZE, COUNTER_FOLD_INTERVAL_SECONDS, COUNTER_RECONCILE_BATCH_SIZE
+from .database import SessionLocal
+from .hydration import invalidate_post, resolve_uids
+from .models import Comment, CommentLike, CommentScore, CounterDelta, Follow, Post, PostBookmark, PostLike, User, UserStat
+from .upserts import insert_missing
+
+logger = logging.getLogger(__name__)
+
+COUNTER_FIELDS = {
+    "post": (Post, {"likes_count", "comments_count"}),
+    "user": (User, {"followers_count", "following_count", "reels_count"}),
+    "user_stats": (UserStat, {"products_count", "total_likes", "saved_posts_count"}),
+    "comment": (CommentScore, {"likes_count"}),
+}
+
+# Key column of entities not keyed by `id`
+ROW_KEYS = {"user_stats": "user_id", "comment": "comment_id"}
+
+# Entities whose rows are created on their first delta: entity -> parent model
+LAZY_ROWS = {"user_stats": User}
+
+
+def record(db: Session, entity: str, entity_id: int, field: str, delta: int = 1) -> None:
+    """Queue a counter change in the caller's transaction"""
+    _, fields = COUNTER_FIELDS[entity]
+    if field not in fields:
+        raise ValueError(f"Unknown counter {entity}.{field}")
+    db.add(CounterDelta(entity=entity, entity_id=entity_id, field=field, delta=delta))
+
+
+def record_each(db: Session, entity: str, id_column, field: str, delta: int, *where) -> int:
+    """Queue `delta` for every `id_column` value of the rows matching `where`, as one INSERT ... SELECT"""
+    _, fields = COUNTER_FIELDS[entity]
+    if field not in fields:
+        raise ValueError(f"Unknown counter {entity}.{field}")
+    rows = select(literal(entity), id_column, literal(field), literal(delta), literal(datetime.utcnow())).where(*where)
+    result = db.execute(
+        insert(CounterDelta).from_select(["entity", "entity_id", "field", "delta", "created_at"], rows)
+    )
+    return result.rowcount or 0
+
+
+def _claim_batch(db: Session, batch_size: int):
+    upper = db.execute(
+        select(CounterDelta.id).order_by(CounterDelta.id).offset(batch_size - 1).limit(1)
+    ).scalar()
+    if upper is None:
+        upper = db.execute(select(func.max(CounterDelta.id))).scalar()
+    if upper is None:
+        return []
+    claim = delete(CounterDelta).where(CounterDelta.id <= upper)
+    if db.get_bind().dialect.delete_returning:
+        return db.execute(
+            claim.returning(CounterDelta.entity, CounterDelta.entity_id, CounterDelta.field, CounterDelta.delta)
+        ).all()
+    # No DELETE ... RETURNING (MySQL): lock the batch first
+    rows = db.execute(
+        select(CounterDelta.entity, CounterDelta.entity_id, CounterDelta.field, CounterDelta.delta)
+        .where(CounterDelta.id <= upper)
+        .with_for_update()
+    ).all()
+    db.execute(claim)
+    return rows
+
+
+def fold(db: Session, batch_size: int = COUNTER_FOLD_BATCH_SIZE) -> Dict[str, Set[int]]:
+    """Apply one batch of pending deltas; returns the touched ids per entity"""
+    rows = _claim_batch(db, batch_size)
+    totals: Dict[Tuple[str, str], Dict[int, int]] = defaultdict(lambda: defaultdict(int))
+    for entity, entity_id, field, delta in rows:
+        totals[(entity, field)][entity_id] += delta
+
+    touched: Dict[str, Set[int]] = defaultdict(set)
+    conn = db.connection()
+    for (entity, field), per_row in totals.items():
+        model, _ = COUNTER_FIELDS[entity]
+        key = ROW_KEYS.get(entity, "id")
+        if entity in LAZY_ROWS:
+            parent = LAZY_ROWS[entity]
+            # Deltas may outlive their owner (account deleted before the fold)
+            alive = db.execute(select(parent.id).where(parent.id.in_(list(per_row)))).scalars().all()
+            insert_missing(db, model, key, [{key: eid} for eid in alive])
+        table = model.__table__
+        column = table.c[field]
+        new_value = func.coalesce(column, 0) + bindparam("d")
+        stmt = (
+            update(table)
+            .where(table.c[key] == bindparam("eid"))
+            .values({field: case((new_value < 0, 0), else_=new_value)})
+        )
+        params = [{"eid": eid, "d": d} for eid, d in per_row.items() if d]
+        if params:
+            conn.execute(stmt, params)
+        touched[entity].update(per_row)
+    db.commit()
+    return touched
+
+
+def _after_fold(db: Session, touched: Dict[str, Set[int]]) -> None:
+    """Drop cached cards and principals whose counters just changed"""
+    if touched.get("post"):
+        invalidate_post(*resolve_uids(db, touched["post"]).values())
+    if touched.get("user"):
+        invalidate_principal_ids(db, touched["user"])
+
+
+def fold_all(db: Session) -> int:
+    """Fold until no deltas are pending; returns the number of batches applied"""
+    batches = 0
+    while True:
+        touched = fold(db)
+        if not touched:
+            return batches
+        _after_fold(db, touched)
+        batches += 1
+
+
+# entity -> counter -> (column grouping the source rows by counter row id, extra conditions).
+# The number of matching source rows is the counter's true value.
+RECOUNTS = {
+    "post": {
+        "likes_count": (PostLike.post_id,),
+        "comments_count": (Comment.post_id,),
+    },
+    "user": {
+        "followers_count": (Follow.followed_id,),
+        "following_count": (Follow.follower_id,),
+        "reels_count": (Post.user_id, Post.type == "reel"),
+    },
+    "user_stats": {
+        "products_count": (Post.user_id, Post.type == "product"),
+        "total_likes": (Post.user_id, PostLike.post_id == Post.id),
+        "saved_posts_count": (PostBookmark.user_id,),
+    },
+    "comment": {"likes_count": (CommentLike.comment_id,)},
+}
+
+# Ids walked by reconcile(): the owner table, so missing lazy rows are found too
+RECONCILE_IDS = {"post": Post.id, "user": User.id, "user_stats": User.id, "comment": Comment.id}
+
+
+def _expected_counts(db: Session, entity: str, ids: list) -> Dict[int, Dict[str, int]]:
+    """Counter values for `ids` that give the true counts once their pending deltas are folded.
+
+    One statement, so the source rows and the pending deltas come from the same
+    snapshot: a like committed in between is either in both or in neither.
+    Ids whose owner row is gone are left out.
+    """
+    owner = RECONCILE_IDS[entity]
+    columns = []
+    for field, (column, *where) in RECOUNTS[entity].items():
+        true_count = select(func.count()).where(column == owner, *where).scalar_subquery()
+        pending = select(func.coalesce(func.sum(CounterDelta.delta), 0)).where(
+            CounterDelta.entity == entity, CounterDelta.entity_id == owner, CounterDelta.field == field,
+        ).scalar_subquery()
+        columns.append((true_count - pending).label(field))
+    return {
+        row[0]: dict(zip(RECOUNTS[entity], row[1:]))
+        for row in db.execute(select(owner, *columns).where(owner.in_(ids)))
+    }
+
+
+def _new_row_values(db: Session, entity: str, ids: list) -> Dict[int, dict]:
+    """Non-counter columns of counter rows created by reconcile()"""
+    if entity == "comment":
+        rows = db.execute(select(Comment.id, Comment.post_id).where(Comment.id.in_(ids)))
+        return {comment_id: {"post_id": post_id} for comment_id, post_id in rows}
+    return {entity_id: {} for entity_id in ids}
+
+
+def _reconcile_batch(db: Session, entity: str, ids: list) -> Set[int]:
+    """Correct one batch of counter rows; returns the ids that had drifted. The caller commits."""
+    model, _ = COUNTER_FIELDS[entity]
+    table = model.__table__
+    key = table.c[ROW_KEYS.get(entity, "id")]
+    fields = list(RECOUNTS[entity])
+    # The row locks hold off a concurrent fold of these rows until commit, so the
+    # deltas it has claimed still count as pending below (PostgreSQL / MySQL)
+    current = {
+        row[0]: dict(zip(fields, row[1:]))
+        for row in db.execute(
+            select(key, *[table.c[f] for f in fields]).where(key.in_(ids)).with_for_update()
+        )
+    }
+    expected = _expected_counts(db, entity, ids)
+
+    drifted = [
+        entity_id for entity_id, values in current.items()
+        if entity_id in expected and values != expected[entity_id]
+    ]
+    if drifted:
+        values = {f: bindparam(f"v_{f}") for f in fields}
+        if "updated_at" in table.c:
+            # Not a content change: keep onupdate from stamping the row
+            values["updated_at"] = table.c.updated_at
+        db.connection().execute(
+            update(table).where(key == bindparam("eid")).values(values),
+            [{"eid": eid, **{f"v_{f}": v for f, v in expected[eid].items()}} for eid in drifted],
+        )
+
+    # Lazy rows are only worth creating for non-zero counters; comment_scores needs a row per comment
+    missing = [
+        entity_id for entity_id in expected
+        if entity_id not in current and (entity not in LAZY_ROWS or any(expected[entity_id].values()))
+    ]
+    if missing:
+        extra = _new_row_values(db, entity, missing)
+        insert_missing(db, model, key.key, [
+            {key.key: eid, **extra[eid], **expected[eid]} for eid in missing if eid in extra
+        ])
+    return set(drifted) | set(missing)
+
+
+def reconcile(db: Session, batch_size: int = COUNTER_RECONCILE_BATCH_SIZE) -> Dict[str, int]:
+    """Recompute every counter from the source tables (drift correction); returns drifted rows per entity.
+
+    Walks each table in id batches, one short transaction per batch, and
+    writes only rows whose value differs. Pending deltas are left for the
+    folder: the value written is the true count minus what is still pending.
+    """
+    drifted: Dict[str, int] = {}
+    for entity, id_column in RECONCILE_IDS.items():
+        drifted[entity] = 0
+        last_id = 0
+        while True:
+            ids = db.execute(
+                select(id_column).where(id_column > last_id).order_by(id_column).limit(batch_size)
+            ).scalars().all()
+            if not ids:
+                break
+            changed = _reconcile_batch(db, entity, ids)
+            db.commit()
+            if changed:
+                _after_fold(db, {entity: changed})
+            drifted[entity] += len(changed)
+            last_id = ids[-1]
+    return drifted
+
+
+class _Folder:
+    def __init__(self):
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self) -> None:
+        if COUNTER_FOLD_INTERVAL_SECONDS <= 0 or self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="counter-folder", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def _run(self) -> None:
+        while not self._stop.wait(COUNTER_FOLD_INTERVAL_SECONDS):
+            db = SessionLocal()
+            try:
+                fold_all(db)
+            except Exception as e:
+                db.rollback()
+                logger.error(f"Counter fold failed: {e}")
+            finally:
+                db.close()
+
+
+folder = _Folder()
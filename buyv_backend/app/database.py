@@ -1,22 +1,38 @@
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker, DeclarativeBase
 from .config import DATABASE_URL
+from . import db_pool
 
-# Handle Railway/Render provided URLs which start with mysql://
-# We need to tell SQLAlchemy to use PyMySQL driver
-if DATABASE_URL.startswith("mysql://"):
-    DATABASE_URL = DATABASE_URL.replace("mysql://", "mysql+pymysql://")
-
-connect_args = {"check_same_thread": False} if DATABASE_URL.startswith("sqlite") else {}
-
-engine = create_engine(
-    DATABASE_URL,
-    pool_pre_ping=True,
-    pool_recycle=3600,
-    echo=False,
-    future=True,
-    connect_args=connect_args,
-)
+
+def normalize_url(url: str) -> str:
+    if url.startswith("postgres://"):
+        url = url.replace("postgres://", "postgresql://", 1)
+    # Handle Railway/Render provided URLs which start with mysql://
+    # We need to tell SQLAlchemy to use PyMySQL driver
+    if url.startswith("mysql://"):
+        url = url.replace("mysql://", "mysql+pymysql://")
+    return url
+
+
+def make_engine(url: str, name: str):
+    """Engine with the configured pool, reported under `name` in /metrics"""
+    pool_options = db_pool.pool_options(url)
+    connect_args = pool_options.pop("connect_args", {})
+    if url.startswith("sqlite"):
+        connect_args["check_same_thread"] = False
+    new_engine = create_engine(
+        url,
+        echo=False,
+        future=True,
+        connect_args=connect_args,
+        **pool_options,
+    )
+    db_pool.instrument(name, new_engine)
+    return new_engine
+
+
+DATABASE_URL = normalize_url(DATABASE_URL)
+engine = make_engine(DATABASE_URL, "primary")
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine, future=True)
 
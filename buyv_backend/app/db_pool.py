@@ -0,0 +1,244 @@
+"""
+Connection pool settings and telemetry shared by the sync and async engines.
+
+`pool_options(url)` turns the DB_POOL_* settings into create_engine kwargs and
+`instrument(name, engine)` attaches the telemetry listeners. `stats()` is what
+/metrics reports per engine: pool occupancy, how long checkouts waited for a
+connection (histogram), checkout timeouts and the age of open connections.
+
+Pre-ping strategies (DB_POOL_PRE_PING):
+- "always": SQLAlchemy's pool_pre_ping, one extra round trip per checkout
+- "idle": ping only connections that sat in the pool longer than
+  DB_POOL_PING_IDLE_SECONDS (a connection returned a moment ago is trusted)
+- "never": rely on pool_recycle alone; the first request to use a connection
+  the server has dropped fails
+"""
+import threading
+import time
+import uuid
+from typing import Dict
+
+from sqlalchemy import event, exc
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+
+from .config import (
+    DB_PGBOUNCER,
+    DB_MAX_OVERFLOW,
+    DB_POOL_PING_IDLE_SECONDS,
+    DB_POOL_PRE_PING,
+    DB_POOL_RECYCLE_SECONDS,
+    DB_POOL_SIZE,
+    DB_POOL_TIMEOUT,
+    DB_POOL_USE_LIFO,
+)
+
+# Upper bounds (ms) of the checkout wait histogram buckets
+WAIT_BUCKETS_MS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+
+class _Telemetry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.buckets = [0] * (len(WAIT_BUCKETS_MS) + 1)
+        self.checkouts = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+        self.timeouts = 0
+        self.connects = 0
+        self.pings = 0
+        self.ping_failures = 0
+        self._opened: Dict[int, float] = {}
+
+    def waited(self, seconds: float) -> None:
+        ms = seconds * 1000
+        index = next((i for i, bound in enumerate(WAIT_BUCKETS_MS) if ms <= bound), len(WAIT_BUCKETS_MS))
+        with self._lock:
+            self.buckets[index] += 1
+            self.checkouts += 1
+            self.wait_seconds += seconds
+            self.max_wait_seconds = max(self.max_wait_seconds, seconds)
+
+    def add(self, **counts: int) -> None:
+        with self._lock:
+            for name, value in counts.items():
+                setattr(self, name, getattr(self, name) + value)
+
+    def opened(self, dbapi_connection) -> None:
+        with self._lock:
+            self.connects += 1
+            self._opened[id(dbapi_connection)] = time.monotonic()
+
+    def closed(self, dbapi_connection) -> None:
+        with self._lock:
+            self._opened.pop(id(dbapi_connection), None)
+
+    def _quantile_ms(self, q: float):
+        """Upper bound of the bucket holding the q-th wait (None past the last bucket)"""
+        rank = q * self.checkouts
+        seen = 0
+        for bound, count in zip(WAIT_BUCKETS_MS, self.buckets):
+            seen += count
+            if seen >= rank:
+                return bound
+        return None
+
+    def snapshot(self) -> dict:
+        now = time.monotonic()
+        with self._lock:
+            ages = [now - opened for opened in self._opened.values()]
+            cumulative, histogram = 0, {}
+            for bound, count in zip(WAIT_BUCKETS_MS + ("+Inf",), self.buckets):
+                cumulative += count
+                histogram[str(bound)] = cumulative
+            return {
+                "checkouts": self.checkouts,
+                "timeouts": self.timeouts,
+                "wait_ms": {
+                    "avg": round(1000 * self.wait_seconds / self.checkouts, 2) if self.checkouts else 0.0,
+                    "max": round(1000 * self.max_wait_seconds, 2),
+                    "p50_le": self._quantile_ms(0.5) if self.checkouts else 0,
+                    "p99_le": self._quantile_ms(0.99) if self.checkouts else 0,
+                    "histogram": histogram,
+                },
+                "connects": self.connects,
+                "pings": self.pings,
+                "ping_failures": self.ping_failures,
+                "connection_age_seconds": {
+                    "open": len(ages),
+                    "avg": round(sum(ages) / len(ages), 1) if ages else 0.0,
+                    "max": round(max(ages), 1) if ages else 0.0,
+                },
+            }
+
+
+class _InstrumentedPool:
+    """Times `_do_get`: the wait for a pooled (or newly opened overflow) connection"""
+
+    telemetry: _Telemetry
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            record = super()._do_get()
+        except exc.TimeoutError:
+            self.telemetry.add(timeouts=1)
+            raise
+        self.telemetry.waited(time.perf_counter() - started)
+        return record
+
+    def recreate(self):
+        # engine.dispose() swaps in a recreated pool (listeners are carried over, attributes are not)
+        pool = super().recreate()
+        pool.telemetry = self.telemetry
+        return pool
+
+
+class InstrumentedQueuePool(_InstrumentedPool, QueuePool):
+    pass
+
+
+class InstrumentedAsyncQueuePool(_InstrumentedPool, AsyncAdaptedQueuePool):
+    pass
+
+# name -> engine; engine.dispose() replaces the pool, so it is looked up on each stats() call
+_engines: Dict[str, Engine] = {}
+
+
+def _keeps_dialect_pool(url: str, is_async: bool) -> bool:
+    """In-memory SQLite shares one connection; aiosqlite opens a thread per connection (NullPool)"""
+    if not url.startswith("sqlite"):
+        return False
+    return is_async or ":memory:" in url or url.rstrip("/").endswith(":")
+
+
+def _pgbouncer_connect_args(url: str) -> dict:
+    """Disable server-side prepared statements (PgBouncer transaction pooling)"""
+    scheme = url.partition("://")[0]
+    if scheme == "postgresql+asyncpg":
+        return {
+            "statement_cache_size": 0,
+            "prepared_statement_cache_size": 0,
+            # Unique names: PgBouncer may hand the next statement to another backend
+            "prepared_statement_name_func": lambda: f"__asyncpg_{uuid.uuid4()}__",
+        }
+    if scheme == "postgresql+psycopg":
+        return {"prepare_threshold": None}
+    # psycopg2 / pg8000 never prepare server-side
+    return {}
+
+
+def pool_options(url: str, is_async: bool = False) -> dict:
+    """create_engine / create_async_engine kwargs for the configured pool"""
+    if _keeps_dialect_pool(url, is_async):
+        return {}
+    options = {
+        "poolclass": InstrumentedAsyncQueuePool if is_async else InstrumentedQueuePool,
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE_SECONDS,
+        "pool_use_lifo": DB_POOL_USE_LIFO,
+        "pool_pre_ping": DB_POOL_PRE_PING == "always",
+    }
+    if DB_PGBOUNCER:
+        options["connect_args"] = _pgbouncer_connect_args(url)
+    return options
+
+
+def instrument(name: str, engine: Engine) -> None:
+    """Attach telemetry (and the "idle" pre-ping) to a sync engine's pool"""
+    pool = engine.pool
+    if not isinstance(pool, _InstrumentedPool):
+        return
+    telemetry = pool.telemetry = _Telemetry()
+    _engines[name] = engine
+
+    @event.listens_for(pool, "connect")
+    def _on_connect(dbapi_connection, connection_record):
+        telemetry.opened(dbapi_connection)
+
+    @event.listens_for(pool, "close")
+    def _on_close(dbapi_connection, connection_record):
+        telemetry.closed(dbapi_connection)
+
+    @event.listens_for(pool, "close_detached")
+    def _on_close_detached(dbapi_connection):
+        telemetry.closed(dbapi_connection)
+
+    if DB_POOL_PRE_PING != "idle":
+        return
+
+    @event.listens_for(pool, "checkin")
+    def _on_checkin(dbapi_connection, connection_record):
+        connection_record.info["checked_in_at"] = time.monotonic()
+
+    @event.listens_for(pool, "checkout")
+    def _on_checkout(dbapi_connection, connection_record, connection_proxy):
+        checked_in_at = connection_record.info.pop("checked_in_at", None)
+        if checked_in_at is None or time.monotonic() - checked_in_at < DB_POOL_PING_IDLE_SECONDS:
+            return
+        telemetry.add(pings=1)
+        try:
+            engine.dialect.do_ping(dbapi_connection)
+        except Exception as e:
+            telemetry.add(ping_failures=1)
+            # The pool discards this connection and retries the checkout with a fresh one
+            raise exc.DisconnectionError() from e
+
+
+def stats() -> dict:
+    out = {}
+    for name, engine in _engines.items():
+        pool = engine.pool
+        out[name] = {
+            "size": pool.size(),
+            "checked_in": pool.checkedin(),
+            "checked_out": pool.checkedout(),
+            # QueuePool counts from -pool_size until the base pool is full
+            "overflow": max(pool.overflow(), 0),
+            "max_overflow": DB_MAX_OVERFLOW,
+            "timeout_seconds": pool.timeout(),
+            **pool.telemetry.snapshot(),
+        }
+    return out
@@ -0,0 +1,139 @@
+"""
+Push device tokens.
+
+Every device registers its FCM token through `POST /users/me/fcm-token`;
+tokens live in `device_tokens` (one row per token, several per user).
+`users.fcm_token` is still written with the latest token for older code
+paths and is read as a fallback until maintain_device_tokens.py has
+backfilled it. Tokens FCM reports as unregistered are removed in one batch
+by `prune()`.
+"""
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional
+
+from sqlalchemy import delete, event, select, update
+from sqlalchemy.orm import Session
+
+from .auth import invalidate_principal
+from .config import DEVICE_TOKEN_STALE_DAYS
+from .models import DeviceToken, User
+from .upserts import delete_returning, insert_missing
+
+# Session.info key: uids whose cached principal holds a cleared users.fcm_token
+_STALE_PRINCIPALS = "devices_stale_principals"
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_stale_principals(session: Session) -> None:
+    uids = session.info.pop(_STALE_PRINCIPALS, None)
+    if uids:
+        invalidate_principal(*uids)
+
+
+def _clear_legacy_tokens(db: Session, tokens: List[str], *where) -> None:
+    """NULL users.fcm_token wherever it holds one of `tokens`; the principals are invalidated on commit"""
+    for start in range(0, len(tokens), 1000):
+        chunk = tokens[start:start + 1000]
+        uids = db.execute(select(User.uid).where(User.fcm_token.in_(chunk), *where)).scalars().all()
+        if not uids:
+            continue
+        db.execute(
+            update(User).where(User.fcm_token.in_(chunk), *where).values(fcm_token=None)
+            .execution_options(synchronize_session=False)
+        )
+        db.info.setdefault(_STALE_PRINCIPALS, set()).update(uids)
+
+
+def register(db: Session, user_id: int, token: str, platform: Optional[str] = None) -> bool:
+    """Attach `token` to `user_id` (moving it from another account if needed); the caller commits.
+
+    Returns True when the token was not yet registered for this user.
+    """
+    now = datetime.utcnow()
+    owner = db.execute(select(DeviceToken.user_id).where(DeviceToken.token == token)).scalar()
+    insert_missing(db, DeviceToken, "token", [{
+        "user_id": user_id, "token": token, "platform": platform, "last_seen": now, "created_at": now,
+    }])
+    values = {"user_id": user_id, "last_seen": now}
+    if platform:
+        values["platform"] = platform
+    db.execute(
+        update(DeviceToken).where(DeviceToken.token == token).values(values)
+        .execution_options(synchronize_session=False)
+    )
+    # A device that switched accounts must stop receiving the previous user's pushes
+    _clear_legacy_tokens(db, [token], User.id != user_id)
+    return owner != user_id
+
+
+def unregister(db: Session, user_id: int, token: str) -> int:
+    result = db.execute(delete(DeviceToken).where(DeviceToken.user_id == user_id, DeviceToken.token == token))
+    db.execute(
+        update(User).where(User.id == user_id, User.fcm_token == token).values(fcm_token=None)
+        .execution_options(synchronize_session=False)
+    )
+    return result.rowcount
+
+
+def tokens_by_user(db: Session, user_ids: Iterable[int]) -> Dict[int, List[str]]:
+    """Every known token per user in one query (plus the legacy users.fcm_token)"""
+    user_ids = list(set(user_ids))
+    out: Dict[int, List[str]] = {}
+    if not user_ids:
+        return out
+    rows = db.execute(
+        select(DeviceToken.user_id, DeviceToken.token).where(DeviceToken.user_id.in_(user_ids))
+        .union_all(
+            select(User.id, User.fcm_token).where(User.id.in_(user_ids), User.fcm_token.is_not(None))
+        )
+    ).all()
+    for user_id, token in rows:
+        tokens = out.setdefault(user_id, [])
+        if token not in tokens:
+            tokens.append(token)
+    return out
+
+
+def tokens_for(db: Session, user_ids: Iterable[int]) -> List[str]:
+    return list(dict.fromkeys(t for tokens in tokens_by_user(db, user_ids).values() for t in tokens))
+
+
+def prune(db: Session, tokens: Iterable[str]) -> int:
+    """Batch-delete dead tokens everywhere they are stored; commits. Returns the number of tokens"""
+    tokens = list(set(tokens))
+    if not tokens:
+        return 0
+    db.execute(delete(DeviceToken).where(DeviceToken.token.in_(tokens)))
+    _clear_legacy_tokens(db, tokens)
+    db.commit()
+    return len(tokens)
+
+
+def remove_user(db: Session, user_id: int) -> None:
+    db.execute(delete(DeviceToken).where(DeviceToken.user_id == user_id))
+
+
+def backfill(db: Session) -> int:
+    """Copy users.fcm_token values missing from device_tokens; returns rows considered"""
+    rows = db.execute(select(User.id, User.fcm_token).where(User.fcm_token.is_not(None))).all()
+    now = datetime.utcnow()
+    for start in range(0, len(rows), 1000):
+        insert_missing(db, DeviceToken, "token", [
+            {"user_id": user_id, "token": token, "last_seen": now, "created_at": now}
+            for user_id, token in rows[start:start + 1000]
+        ])
+        db.commit()
+    return len(rows)
+
+
+def prune_stale(db: Session, days: int = DEVICE_TOKEN_STALE_DAYS) -> int:
+    """Delete tokens the app has not refreshed for `days`; returns rows deleted.
+
+    The legacy users.fcm_token copies go too, or tokens_by_user() would keep
+    pushing to them and backfill() would copy them back.
+    """
+    cutoff = datetime.utcnow() - timedelta(days=days)
+    tokens = delete_returning(db, DeviceToken, DeviceToken.token, DeviceToken.last_seen < cutoff)
+    _clear_legacy_tokens(db, tokens)
+    db.commit()
+    return len(tokens)
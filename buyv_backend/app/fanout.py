@@ -0,0 +1,392 @@
+"""
+New-post notifications to followers.
+
+`create_post` only inserts a `fanout_jobs` row in its own transaction. Fan-out
+threads (FANOUT_WORKERS per API worker) then process each job in chunks of
+FANOUT_CHUNK_SIZE followers, walking `follows` by id:
+
+- notification rows are written with one `INSERT ... SELECT` per chunk and
+  unread counters bumped with one set-based UPDATE (see inbox.py);
+- audiences below FANOUT_TOPIC_THRESHOLD get pushes through the outbox
+  (push_queue coalesces them into 500-token multicast calls);
+- larger audiences get a single message on the FCM topic `creator_<uid>`.
+  Followers are subscribed to that topic incrementally, tracked by a
+  follows.id watermark in `creator_topics`; unfollows and token changes
+  update subscriptions in request background tasks.
+
+Each chunk commits with the job's `last_follow_id`, so a crashed job resumes
+where it stopped once its lease expires.
+"""
+import json
+import logging
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import List, Optional
+
+from sqlalchemy import delete, false, func, insert, literal, select, update
+from sqlalchemy.orm import Session
+
+from . import devices, inbox, push_queue
+from .config import (
+    FANOUT_CHUNK_SIZE,
+    FANOUT_LEASE_SECONDS,
+    FANOUT_MAX_ATTEMPTS,
+    FANOUT_POLL_INTERVAL_SECONDS,
+    FANOUT_TOPIC_THRESHOLD,
+    FANOUT_WORKERS,
+)
+from .database import SessionLocal
+from .firebase_service import NotificationType
+from .models import CreatorTopic, FanoutJob, Follow, Notification, Post, User
+from .upserts import insert_missing
+
+logger = logging.getLogger(__name__)
+
+# FCM accepts at most 1000 tokens per topic subscription call
+TOPIC_SUBSCRIBE_BATCH = 1000
+
+
+def topic_for(author_uid: str) -> str:
+    return f"creator_{author_uid}"
+
+
+class _Stats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.jobs_done = 0
+        self.jobs_failed = 0
+        self.notifications_written = 0
+        self.push_tokens_enqueued = 0
+        self.topic_messages = 0
+        self.topic_subscriptions = 0
+        self.busy_seconds = 0.0
+        self.last_job = None
+
+    def add(self, **counts) -> None:
+        with self._lock:
+            for name, value in counts.items():
+                setattr(self, name, getattr(self, name) + value)
+
+    def finish_job(self, recipients: int, seconds: float, mode: str) -> None:
+        with self._lock:
+            self.jobs_done += 1
+            self.last_job = {
+                "recipients": recipients,
+                "mode": mode,
+                "seconds": round(seconds, 2),
+                "recipients_per_second": round(recipients / seconds) if seconds > 0 else recipients,
+            }
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "jobs_done": self.jobs_done,
+                "jobs_failed": self.jobs_failed,
+                "notifications_written": self.notifications_written,
+                "push_tokens_enqueued": self.push_tokens_enqueued,
+                "topic_messages": self.topic_messages,
+                "topic_subscriptions": self.topic_subscriptions,
+                "notifications_per_second": (
+                    round(self.notifications_written / self.busy_seconds) if self.busy_seconds else 0
+                ),
+                "last_job": self.last_job,
+            }
+
+
+_stats = _Stats()
+
+
+def enqueue_post(db: Session, post: Post) -> None:
+    """Queue follower notifications for a flushed post in the caller's transaction; call wake() after commit"""
+    db.add(FanoutJob(post_id=post.id, author_id=post.user_id))
+
+
+def _message(post: Post, author: User) -> dict:
+    name = author.display_name or author.username
+    kind = {"reel": "reel", "photo": "photo", "product": "product"}.get(post.type, "post")
+    return {
+        "title": f"{name} posted a new {kind}",
+        "body": (post.caption or "")[:120] or "Tap to take a look",
+        "type": NotificationType.NEW_POST,
+        # Identical for every follower, so the outbox can coalesce the pushes
+        "data": {"post_id": post.uid, "author_id": author.uid},
+    }
+
+
+_claim_lock = threading.Lock()
+
+
+def _claim(db: Session) -> Optional[int]:
+    # SKIP LOCKED separates processes on PostgreSQL; the lock separates this process's threads
+    with _claim_lock:
+        return _claim_locked(db)
+
+
+def _claim_locked(db: Session) -> Optional[int]:
+    now = datetime.utcnow()
+    query = (
+        select(FanoutJob.id)
+        .where(FanoutJob.status.in_(["pending", "running"]), FanoutJob.next_attempt_at <= now)
+        .order_by(FanoutJob.id)
+        .limit(1)
+    )
+    if db.get_bind().dialect.name == "postgresql":
+        query = query.with_for_update(skip_locked=True)
+    job_id = db.execute(query).scalar()
+    if job_id is not None:
+        db.execute(
+            update(FanoutJob)
+            .where(FanoutJob.id == job_id)
+            .values(
+                status="running",
+                next_attempt_at=now + timedelta(seconds=FANOUT_LEASE_SECONDS),
+                started_at=func.coalesce(FanoutJob.started_at, now),
+            )
+        )
+    db.commit()
+    return job_id
+
+
+def _chunk_bounds(db: Session, author_id: int, after_id: int) -> Optional[int]:
+    """follows.id closing the next chunk of followers after `after_id`, None when done"""
+    base = select(Follow.id).where(Follow.followed_id == author_id, Follow.id > after_id)
+    upper = db.execute(base.order_by(Follow.id).offset(FANOUT_CHUNK_SIZE - 1).limit(1)).scalar()
+    if upper is None:
+        upper = db.execute(
+            select(func.max(Follow.id)).where(Follow.followed_id == author_id, Follow.id > after_id)
+        ).scalar()
+    return upper
+
+
+def _write_chunk(db: Session, job: FanoutJob, message: dict, upper: int) -> int:
+    in_chunk = (Follow.followed_id == job.author_id, Follow.id > job.last_follow_id, Follow.id <= upper)
+    now = datetime.utcnow()
+    payload = json.dumps(message["data"])
+    db.execute(
+        insert(Notification).from_select(
+            ["user_id", "title", "body", "type", "data", "is_read", "created_at"],
+            select(
+                Follow.follower_id,
+                literal(message["title"]),
+                literal(message["body"]),
+                literal(message["type"]),
+                literal(payload),
+                false(),
+                literal(now),
+            ).where(*in_chunk),
+        )
+    )
+    follower_ids = db.execute(select(Follow.follower_id).where(*in_chunk)).scalars().all()
+    inbox.increment_unread(db, follower_ids)
+    if job.mode == "multicast":
+        enqueued = push_queue.enqueue(
+            db,
+            devices.tokens_for(db, follower_ids),
+            title=message["title"],
+            body=message["body"],
+            data=message["data"],
+            notification_type=message["type"],
+        )
+        _stats.add(push_tokens_enqueued=enqueued)
+    _stats.add(notifications_written=len(follower_ids))
+    return len(follower_ids)
+
+
+def _sync_topic(db: Session, author: User) -> None:
+    """Subscribe followers added since the last sync to the creator's topic"""
+    insert_missing(db, CreatorTopic, "author_id", [{"author_id": author.id}])
+    topic = db.get(CreatorTopic, author.id)
+    transport = push_queue.get_transport()
+    topic_name = topic_for(author.uid)
+    while True:
+        rows = db.execute(
+            select(Follow.id, Follow.follower_id)
+            .where(Follow.followed_id == author.id, Follow.id > topic.subscribed_through_follow_id)
+            .order_by(Follow.id)
+            .limit(TOPIC_SUBSCRIBE_BATCH)
+        ).all()
+        if not rows:
+            break
+        tokens = devices.tokens_for(db, [r.follower_id for r in rows])
+        # Followers may have several devices; FCM accepts 1000 tokens per call
+        for start in range(0, len(tokens), TOPIC_SUBSCRIBE_BATCH):
+            batch = tokens[start:start + TOPIC_SUBSCRIBE_BATCH]
+            _stats.add(topic_subscriptions=transport.subscribe(batch, topic_name))
+        topic.subscribed_through_follow_id = rows[-1].id
+        db.commit()
+
+
+def process_job(db: Session, job_id: int) -> None:
+    started = time.perf_counter()
+    job = db.get(FanoutJob, job_id)
+    post = db.get(Post, job.post_id)
+    author = db.get(User, job.author_id)
+    if post is None or author is None:
+        # Post or author deleted before the fan-out ran
+        job.status = "done"
+        job.finished_at = datetime.utcnow()
+        db.commit()
+        return
+    if job.mode is None:
+        job.mode = "topic" if (author.followers_count or 0) >= FANOUT_TOPIC_THRESHOLD else "multicast"
+    message = _message(post, author)
+
+    while True:
+        upper = _chunk_bounds(db, job.author_id, job.last_follow_id)
+        if upper is None:
+            break
+        job.recipients += _write_chunk(db, job, message, upper)
+        job.last_follow_id = upper
+        job.next_attempt_at = datetime.utcnow() + timedelta(seconds=FANOUT_LEASE_SECONDS)
+        db.commit()
+
+    if job.mode == "topic" and push_queue.get_transport().available():
+        _sync_topic(db, author)
+        if push_queue.get_transport().send_topic(
+            topic_for(author.uid), message["title"], message["body"], message["data"], message["type"]
+        ):
+            _stats.add(topic_messages=1)
+        else:
+            raise RuntimeError(f"Topic send to {topic_for(author.uid)} failed")
+    else:
+        push_queue.wake()
+
+    job.status = "done"
+    job.finished_at = datetime.utcnow()
+    db.commit()
+    elapsed = time.perf_counter() - started
+    _stats.add(busy_seconds=elapsed)
+    _stats.finish_job(job.recipients, elapsed, job.mode)
+
+
+def _fail(db: Session, job_id: int, error: Exception) -> None:
+    db.rollback()
+    job = db.get(FanoutJob, job_id)
+    job.attempts += 1
+    job.last_error = str(error)[:1000]
+    if job.attempts >= FANOUT_MAX_ATTEMPTS:
+        job.status = "failed"
+        _stats.add(jobs_failed=1)
+    else:
+        job.status = "pending"
+        job.next_attempt_at = datetime.utcnow() + timedelta(seconds=30 * 2 ** (job.attempts - 1))
+    db.commit()
+
+
+def process_once(db: Session) -> bool:
+    """Claim and run one job; returns False when nothing was due"""
+    job_id = _claim(db)
+    if job_id is None:
+        return False
+    try:
+        process_job(db, job_id)
+    except Exception as e:
+        logger.error(f"Fan-out job {job_id} failed: {e}")
+        _fail(db, job_id, e)
+    return True
+
+
+def drain(db: Session) -> int:
+    """Run every due job (tests / scripts); returns the number of jobs run"""
+    jobs = 0
+    while process_once(db):
+        jobs += 1
+    return jobs
+
+
+def _topics_followed(db: Session, user_id: int) -> List[str]:
+    rows = db.execute(
+        select(User.uid)
+        .join(Follow, Follow.followed_id == User.id)
+        .join(CreatorTopic, CreatorTopic.author_id == User.id)
+        .where(Follow.follower_id == user_id, Follow.id <= CreatorTopic.subscribed_through_follow_id)
+    ).all()
+    return [topic_for(uid) for (uid,) in rows]
+
+
+def sync_token_topics(user_id: int, token: str) -> None:
+    """Background task after an FCM token change: subscribe it to the topics of followed large creators"""
+    db = SessionLocal()
+    try:
+        transport = push_queue.get_transport()
+        if not transport.available():
+            return
+        for topic in _topics_followed(db, user_id):
+            _stats.add(topic_subscriptions=transport.subscribe([token], topic))
+    except Exception as e:
+        logger.error(f"Topic subscription sync failed for user {user_id}: {e}")
+    finally:
+        db.close()
+
+
+def unsubscribe_follower(tokens: List[str], author_uid: str) -> None:
+    """Background task after an unfollow of a topic-mode creator (all of the follower's devices)"""
+    try:
+        transport = push_queue.get_transport()
+        if transport.available():
+            transport.unsubscribe(tokens, topic_for(author_uid))
+    except Exception as e:
+        logger.error(f"Topic unsubscribe from {topic_for(author_uid)} failed: {e}")
+
+
+def has_topic(db: Session, author_id: int) -> bool:
+    return db.get(CreatorTopic, author_id) is not None
+
+
+def remove_creator(db: Session, author_id: int) -> None:
+    db.execute(delete(CreatorTopic).where(CreatorTopic.author_id == author_id))
+
+
+class _Worker:
+    def __init__(self):
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._threads: List[threading.Thread] = []
+
+    def start(self) -> None:
+        if FANOUT_WORKERS <= 0 or self._threads:
+            return
+        self._stop.clear()
+        for i in range(FANOUT_WORKERS):
+            thread = threading.Thread(target=self._run, name=f"fanout-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._wake.set()
+        for thread in self._threads:
+            thread.join(timeout=5)
+        self._threads = []
+
+    def wake(self) -> None:
+        self._wake.set()
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            ran = False
+            db = SessionLocal()
+            try:
+                ran = process_once(db)
+            except Exception as e:
+                db.rollback()
+                logger.error(f"Fan-out worker error: {e}")
+            finally:
+                db.close()
+            if not ran:
+                self._wake.wait(FANOUT_POLL_INTERVAL_SECONDS)
+                self._wake.clear()
+
+
+worker = _Worker()
+
+
+def wake() -> None:
+    worker.wake()
+
+
+def stats() -> dict:
+    out = _stats.snapshot()
+    out["workers"] = FANOUT_WORKERS
+    return out
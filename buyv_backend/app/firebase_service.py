@@ -224,6 +224,61 @@ class FirebaseService:
                 'invalid_tokens': [],
             }
     
+    @classmethod
+    def send_each(
+        cls,
+        tokens: List[str],
+        title: str,
+        body: str,
+        data: Optional[dict] = None,
+        notification_type: str = "general"
+    ) -> List[Optional[Exception]]:
+        """
+        Send one notification to up to 500 devices in a single FCM batch call
+        
+        Unlike send_multicast, errors are not swallowed: transport-level failures
+        raise, and per-token failures are returned so the caller can retry or prune.
+        
+        Returns:
+            list: one entry per token, None on success or the FCM exception
+        """
+        notification_data = {k: str(v) for k, v in (data or {}).items()}
+        notification_data['type'] = notification_type
+        notification_data['click_action'] = 'FLUTTER_NOTIFICATION_CLICK'
+        
+        message = messaging.MulticastMessage(
+            notification=messaging.Notification(
+                title=title,
+                body=body,
+            ),
+            data=notification_data,
+            tokens=tokens,
+            android=messaging.AndroidConfig(
+                priority='high',
+                notification=messaging.AndroidNotification(
+                    channel_id='high_importance_channel',
+                    sound='default',
+                    color='#FF6F00',
+                    icon='ic_notification',
+                ),
+            ),
+            apns=messaging.APNSConfig(
+                headers={
+                    'apns-priority': '10',
+                },
+                payload=messaging.APNSPayload(
+                    aps=messaging.Aps(
+                        sound='default',
+                        badge=1,
+                        content_available=True,
+                    ),
+                ),
+            ),
+        )
+        
+        response = messaging.send_each_for_multicast(message)
+        return [None if resp.success else resp.exception for resp in response.responses]
+    
     @classmethod
     def send_to_topic(
         cls,
@@ -308,3 +363,4 @@ class NotificationType:
     MESSAGE = "message"
     GENERAL = "general"
     PROMOTION = "promotion"
+    NEW_POST = "new_post"
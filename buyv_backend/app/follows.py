@@ -1,92 +1,192 @@
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Query
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select
 from sqlalchemy.orm import Session
-from .database import get_db
+from typing import Optional
+import json
+from .database import get_db, SessionLocal
+from .async_database import DbRunner, get_db_runner
+from .replicas import get_read_db, get_read_db_runner
 from .models import User, Follow
-from .auth import get_current_user
+from .auth import Principal, get_current_principal, get_current_user, get_current_writer
+from .pagination import keyset_before, next_cursor_for
+from .schemas import UserCard
+from . import actions, viewer
+
+# Rows per query when streaming a full follower/following export
+EXPORT_BATCH_SIZE = 1000
 
 router = APIRouter(prefix="/follows", tags=["follows"])
 
 
 @router.post("/{target_uid}")
-def follow_user(target_uid: str, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+async def follow_user(target_uid: str, db: DbRunner = Depends(get_db_runner), current_user: Principal = Depends(get_current_writer)):
+    changed = await db.run(_follow, target_uid, current_user.id)
+    return {"status": "followed" if changed else "already_following"}
+
+
+def _target(db: Session, target_uid: str, user_id: int, verb: str) -> User:
     target = db.query(User).filter(User.uid == target_uid).first()
     if not target:
         raise HTTPException(status_code=404, detail="Target user not found")
-    if target.id == current_user.id:
-        raise HTTPException(status_code=400, detail="Cannot follow yourself")
+    if target.id == user_id:
+        raise HTTPException(status_code=400, detail=f"Cannot {verb} yourself")
+    return target
 
-    existing = db.query(Follow).filter(Follow.follower_id == current_user.id, Follow.followed_id == target.id).first()
-    if existing:
-        return {"status": "already_following"}
 
-    follow = Follow(follower_id=current_user.id, followed_id=target.id)
-    db.add(follow)
-    # update counters
-    current_user.following_count = (current_user.following_count or 0) + 1
-    target.followers_count = (target.followers_count or 0) + 1
-    db.commit()
-    return {"status": "followed"}
+def _follow(db: Session, target_uid: str, user_id: int) -> set:
+    target = _target(db, target_uid, user_id, "follow")
+    # Idempotent insert; counters and the timeline backfill only run for a new follow
+    with actions.rejecting_missing_rows(db, user_id, "Target user not found"):
+        changed = actions.add_follows(db, user_id, [target])
+        db.commit()
+    # Here rather than in the handler: the shared cache tier must not block the event loop
+    viewer.invalidate_following(user_id)
+    return changed
 
 
 @router.delete("/{target_uid}")
-def unfollow_user(target_uid: str, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
-    target = db.query(User).filter(User.uid == target_uid).first()
-    if not target:
-        raise HTTPException(status_code=404, detail="Target user not found")
-    if target.id == current_user.id:
-        raise HTTPException(status_code=400, detail="Cannot unfollow yourself")
-
-    existing = db.query(Follow).filter(Follow.follower_id == current_user.id, Follow.followed_id == target.id).first()
-    if not existing:
+async def unfollow_user(
+    target_uid: str,
+    background_tasks: BackgroundTasks,
+    db: DbRunner = Depends(get_db_runner),
+    current_user: Principal = Depends(get_current_writer),
+):
+    changed = await db.run(_unfollow, target_uid, current_user.id, background_tasks)
+    if not changed:
         return {"status": "not_following"}
-
-    db.delete(existing)
-    # update counters
-    current_user.following_count = max((current_user.following_count or 0) - 1, 0)
-    target.followers_count = max((target.followers_count or 0) - 1, 0)
-    db.commit()
     return {"status": "unfollowed"}
 
 
+def _unfollow(db: Session, target_uid: str, user_id: int, background_tasks: BackgroundTasks) -> set:
+    target = _target(db, target_uid, user_id, "unfollow")
+    target_ref = (target.id, target.uid)
+    with actions.rejecting_missing_rows(db, user_id, "Target user not found"):
+        changed = actions.remove_follows(db, user_id, [target])
+        if changed:
+            db.commit()
+        actions.schedule_topic_unsubscribe(db, background_tasks, user_id, [target_ref])
+    if changed:
+        viewer.invalidate_following(user_id)
+    return changed
+
+
 @router.get("/is_following/{target_uid}")
-def is_following(target_uid: str, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
-    target = db.query(User).filter(User.uid == target_uid).first()
-    if not target:
+async def is_following(target_uid: str, db: DbRunner = Depends(get_db_runner), current_user: Principal = Depends(get_current_principal)):
+    return {"isFollowing": await db.run(_is_following, target_uid, current_user.id)}
+
+
+def _is_following(db: Session, target_uid: str, user_id: int) -> bool:
+    if not db.query(User.id).filter(User.uid == target_uid).first():
         raise HTTPException(status_code=404, detail="Target user not found")
-    existing = db.query(Follow).filter(Follow.follower_id == current_user.id, Follow.followed_id == target.id).first()
-    return {"isFollowing": existing is not None}
+    return target_uid in viewer.followed_uids(db, user_id, [target_uid])
+
+
+def _follow_page_query(user_id: int, direction: str, cursor: Optional[str], limit: int):
+    """One join over follows/users: the listed users as compact cards, newest follow first"""
+    if direction == "followers":
+        own_col, other_col = Follow.followed_id, Follow.follower_id
+    else:
+        own_col, other_col = Follow.follower_id, Follow.followed_id
+    stmt = (
+        select(
+            Follow.id,
+            Follow.created_at,
+            User.uid,
+            User.username,
+            User.profile_image_url,
+            User.is_verified,
+        )
+        .join(User, User.id == other_col)
+        .where(own_col == user_id)
+        .order_by(Follow.created_at.desc(), Follow.id.desc())
+        .limit(limit)
+    )
+    if cursor:
+        stmt = stmt.where(keyset_before(Follow.created_at, Follow.id, cursor))
+    return stmt
 
 
-@router.get("/{uid}/followers")
-def get_followers(uid: str, db: Session = Depends(get_db)):
+def _card(row) -> dict:
+    return UserCard(
+        uid=row.uid,
+        username=row.username,
+        profile_image_url=row.profile_image_url,
+        is_verified=bool(row.is_verified),
+    ).model_dump(by_alias=True)
+
+
+def _list_follows(db: Session, uid: str, direction: str, limit: int, cursor: Optional[str]) -> dict:
     user = db.query(User).filter(User.uid == uid).first()
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
-    rows = db.query(Follow).filter(Follow.followed_id == user.id).all()
-    follower_uids = []
-    for row in rows:
-        follower = db.query(User).filter(User.id == row.follower_id).first()
-        if follower:
-            follower_uids.append(follower.uid)
-    return {"followers": follower_uids}
+    rows = db.execute(_follow_page_query(user.id, direction, cursor, limit)).all()
+    return {
+        # uid list kept for older app builds
+        direction: [row.uid for row in rows],
+        "users": [_card(row) for row in rows],
+        "nextCursor": next_cursor_for(rows, limit),
+    }
+
+
+def _export_follows(user_id: int, direction: str):
+    """NDJSON stream of user cards, read in keyset batches on a dedicated session"""
+    db = SessionLocal()
+    try:
+        cursor = None
+        while True:
+            rows = db.execute(_follow_page_query(user_id, direction, cursor, EXPORT_BATCH_SIZE)).all()
+            for row in rows:
+                yield json.dumps(_card(row)) + "\n"
+            cursor = next_cursor_for(rows, EXPORT_BATCH_SIZE)
+            if not cursor:
+                break
+    finally:
+        db.close()
+
+
+def _export_response(uid: str, direction: str, current_user: User) -> StreamingResponse:
+    if uid != current_user.uid:
+        raise HTTPException(status_code=403, detail="Not allowed to export another user's list")
+    return StreamingResponse(
+        _export_follows(current_user.id, direction),
+        media_type="application/x-ndjson",
+        headers={"Content-Disposition": f'attachment; filename="{direction}-{uid}.ndjson"'},
+    )
+
+
+@router.get("/{uid}/followers")
+async def get_followers(
+    uid: str,
+    limit: int = Query(default=50, ge=1, le=200),
+    cursor: Optional[str] = Query(default=None),
+    db: DbRunner = Depends(get_read_db_runner),
+):
+    return await db.run(_list_follows, uid, "followers", limit, cursor)
 
 
 @router.get("/{uid}/following")
-def get_following(uid: str, db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.uid == uid).first()
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
-    rows = db.query(Follow).filter(Follow.follower_id == user.id).all()
-    following_uids = []
-    for row in rows:
-        followed = db.query(User).filter(User.id == row.followed_id).first()
-        if followed:
-            following_uids.append(followed.uid)
-    return {"following": following_uids}
+async def get_following(
+    uid: str,
+    limit: int = Query(default=50, ge=1, le=200),
+    cursor: Optional[str] = Query(default=None),
+    db: DbRunner = Depends(get_read_db_runner),
+):
+    return await db.run(_list_follows, uid, "following", limit, cursor)
+
+
+@router.get("/{uid}/followers/export")
+def export_followers(uid: str, current_user: User = Depends(get_current_user)):
+    return _export_response(uid, "followers", current_user)
+
+
+@router.get("/{uid}/following/export")
+def export_following(uid: str, current_user: User = Depends(get_current_user)):
+    return _export_response(uid, "following", current_user)
 
 
 @router.get("/{uid}/counts")
-def get_counts(uid: str, db: Session = Depends(get_db)):
+def get_counts(uid: str, db: Session = Depends(get_read_db)):
     user = db.query(User).filter(User.uid == uid).first()
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
@@ -0,0 +1,180 @@
+"""
+Bounded worker pool for bcrypt hashing / verification.
+
+A bcrypt call burns ~250 ms of CPU. Running it inline in request handlers
+starves Starlette's shared threadpool during login storms, so every
+hash/verify is submitted to a dedicated process pool (HASH_WORKERS
+processes). At most HASH_MAX_PENDING jobs may be queued or running; beyond
+that new requests get a 503 immediately instead of piling up, so a storm
+only degrades login latency.
+
+A worker process that dies (OOM kill, crash) breaks the whole
+ProcessPoolExecutor; the pool is then replaced and the job retried once.
+"""
+import asyncio
+import logging
+import multiprocessing
+import threading
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from fastapi import HTTPException
+from passlib.context import CryptContext
+
+from .config import BCRYPT_ROUNDS, HASH_MAX_PENDING, HASH_WORKERS
+
+logger = logging.getLogger(__name__)
+
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
+
+
+# Executed inside the pool workers: must stay module-level so they can be pickled
+def _hash(password: str) -> str:
+    return pwd_context.hash(password)
+
+
+def _verify(password: str, password_hash: str) -> bool:
+    return pwd_context.verify(password, password_hash)
+
+
+def _timed(fn, *args):
+    """Result of fn(*args) and the seconds it took, measured in the worker (queue wait excluded)"""
+    started = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - started
+
+
+class _HashPool:
+    def __init__(self):
+        self._executor: Executor | None = None
+        self._lock = threading.Lock()
+        self.pending = 0
+        self.completed = 0
+        self.rejected = 0
+        self.busy_seconds = 0.0
+        self.latency_seconds = 0.0
+        self.restarts = 0
+
+    def _get_executor(self) -> Executor:
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    if HASH_WORKERS > 0:
+                        # spawn: the API process runs threads, which fork does not copy safely
+                        self._executor = ProcessPoolExecutor(
+                            max_workers=HASH_WORKERS, mp_context=multiprocessing.get_context("spawn")
+                        )
+                    else:
+                        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="hash")
+        return self._executor
+
+    def _discard(self, executor: Executor) -> None:
+        """Drop a broken executor; the next submit builds a new one"""
+        with self._lock:
+            if self._executor is not executor:
+                return  # another request already replaced it
+            self._executor = None
+            self.restarts += 1
+        logger.warning("Hash worker pool broken (a worker process died), starting a new one")
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def _acquire(self) -> None:
+        with self._lock:
+            if self.pending >= HASH_MAX_PENDING:
+                self.rejected += 1
+                raise self._unavailable()
+            self.pending += 1
+
+    def _release(self, started: float, work_seconds: float | None) -> None:
+        with self._lock:
+            self.pending -= 1
+            if work_seconds is not None:
+                self.completed += 1
+                self.busy_seconds += work_seconds
+                self.latency_seconds += time.perf_counter() - started
+
+    @staticmethod
+    def _unavailable() -> HTTPException:
+        return HTTPException(
+            status_code=503,
+            detail="Authentication is busy, please retry shortly",
+            headers={"Retry-After": "1"},
+        )
+
+    async def run(self, fn, *args):
+        self._acquire()
+        started, work_seconds = time.perf_counter(), None
+        try:
+            for _ in range(2):
+                executor = self._get_executor()
+                try:
+                    result, work_seconds = await asyncio.wrap_future(executor.submit(_timed, fn, *args))
+                    return result
+                except BrokenProcessPool:
+                    self._discard(executor)
+            raise self._unavailable()
+        finally:
+            self._release(started, work_seconds)
+
+    def run_blocking(self, fn, *args):
+        """For sync handlers: same pool and back-pressure, waits on the calling thread"""
+        self._acquire()
+        started, work_seconds = time.perf_counter(), None
+        try:
+            for _ in range(2):
+                executor = self._get_executor()
+                try:
+                    result, work_seconds = executor.submit(_timed, fn, *args).result()
+                    return result
+                except BrokenProcessPool:
+                    self._discard(executor)
+            raise self._unavailable()
+        finally:
+            self._release(started, work_seconds)
+
+    def stats(self) -> dict:
+        return {
+            "workers": HASH_WORKERS,
+            "queue_depth": self.pending,
+            "max_pending": HASH_MAX_PENDING,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "restarts": self.restarts,
+            # Hashing time in the worker, and end to end including the queue wait
+            "avg_ms": round(1000 * self.busy_seconds / self.completed, 1) if self.completed else 0.0,
+            "avg_latency_ms": round(1000 * self.latency_seconds / self.completed, 1) if self.completed else 0.0,
+        }
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+_pool = _HashPool()
+
+
+async def hash_password(password: str) -> str:
+    return await _pool.run(_hash, password)
+
+
+async def verify_password(password: str, password_hash: str) -> bool:
+    return await _pool.run(_verify, password, password_hash)
+
+
+def verify_password_blocking(password: str, password_hash: str) -> bool:
+    return _pool.run_blocking(_verify, password, password_hash)
+
+
+def needs_update(password_hash: str) -> bool:
+    """True when the stored hash uses another scheme or cost factor than BCRYPT_ROUNDS"""
+    return pwd_context.needs_update(password_hash)
+
+
+def stats() -> dict:
+    return _pool.stats()
+
+
+def shutdown() -> None:
+    _pool.shutdown()
@@ -0,0 +1,177 @@
+"""
+Post / author hydration for listing endpoints.
+
+Post bodies and author cards change rarely, so they are cached in
+`cache.TwoTierCache` (post cards keyed by post uid, author cards keyed by
+user id) and only the per-viewer `is_liked` / `is_bookmarked` bits are
+queried on every request. Write paths call `invalidate_post` /
+`invalidate_user` after committing. Cards read from a lagging replica are
+served but not cached (see `replicas.may_cache_reads`).
+"""
+from typing import Dict, Iterable, List, Optional
+
+from sqlalchemy.orm import Session
+
+from .cache import LRUCache, TwoTierCache
+from .models import Post, PostBookmark, PostLike, User
+from .replicas import may_cache_reads
+from .schemas import PostOut
+
+post_cards = TwoTierCache("post")
+author_cards = TwoTierCache("user")
+# posts.id -> posts.uid never changes, so this map is never invalidated
+_post_uids = LRUCache(ttl_seconds=24 * 3600)
+
+
+def post_card(row: Post) -> dict:
+    return {
+        "id": row.id,
+        "uid": row.uid,
+        "user_id": row.user_id,
+        "type": row.type,
+        "media_url": row.media_url,
+        "caption": row.caption,
+        "likes_count": row.likes_count or 0,
+        "comments_count": row.comments_count or 0,
+        "created_at": row.created_at,
+        "updated_at": row.updated_at,
+    }
+
+
+def author_card(user: User) -> dict:
+    return {
+        "id": user.id,
+        "uid": user.uid,
+        "username": user.username,
+        "display_name": user.display_name,
+        "profile_image_url": user.profile_image_url,
+        "is_verified": bool(user.is_verified),
+    }
+
+
+def prime_post(row: Post) -> None:
+    _post_uids.set(row.id, row.uid)
+    post_cards.set_many({row.uid: post_card(row)})
+
+
+def invalidate_post(*uids: str) -> None:
+    post_cards.invalidate(*uids)
+
+
+def invalidate_user(*user_ids: int) -> None:
+    author_cards.invalidate(*user_ids)
+
+
+def resolve_uids(db: Session, post_ids: Iterable[int]) -> Dict[int, str]:
+    out: Dict[int, str] = {}
+    missing = []
+    for post_id in post_ids:
+        uid = _post_uids.get(post_id)
+        if uid is None:
+            missing.append(post_id)
+        else:
+            out[post_id] = uid
+    if missing:
+        for post_id, uid in db.query(Post.id, Post.uid).filter(Post.id.in_(missing)).all():
+            _post_uids.set(post_id, uid)
+            out[post_id] = uid
+    return out
+
+
+def load_post_cards(db: Session, uids: Iterable[str]) -> Dict[str, dict]:
+    uids = list(dict.fromkeys(uids))
+    cards = post_cards.get_many(uids)
+    missing = [uid for uid in uids if uid not in cards]
+    if missing:
+        fresh = {row.uid: post_card(row) for row in db.query(Post).filter(Post.uid.in_(missing)).all()}
+        if may_cache_reads(db):
+            post_cards.set_many(fresh)
+        for card in fresh.values():
+            _post_uids.set(card["id"], card["uid"])
+        cards.update(fresh)
+    return cards
+
+
+def load_author_cards(db: Session, user_ids: Iterable[int]) -> Dict[int, dict]:
+    user_ids = list(dict.fromkeys(user_ids))
+    cards = author_cards.get_many(user_ids)
+    missing = [uid for uid in user_ids if uid not in cards]
+    if missing:
+        fresh = {u.id: author_card(u) for u in db.query(User).filter(User.id.in_(missing)).all()}
+        if may_cache_reads(db):
+            author_cards.set_many(fresh)
+        cards.update(fresh)
+    return cards
+
+
+def build_post_out(card: dict, author: dict, liked: bool = False, bookmarked: bool = False) -> PostOut:
+    return PostOut(
+        id=card["uid"],
+        user_id=author["uid"],
+        username=author["username"],
+        display_name=author["display_name"],
+        user_profile_image=author["profile_image_url"],
+        is_user_verified=author["is_verified"],
+        type=card["type"],
+        video_url=card["media_url"],
+        caption=card["caption"],
+        likes_count=card["likes_count"],
+        comments_count=card["comments_count"],
+        shares_count=0,   # Placeholder
+        views_count=0,    # Placeholder
+        created_at=card["created_at"],
+        updated_at=card["updated_at"],
+        is_liked=liked,
+        is_bookmarked=bookmarked,
+    )
+
+
+def hydrate_post_uids(
+    db: Session,
+    uids: List[str],
+    viewer_id: Optional[int] = None,
+    all_liked: bool = False,
+    all_bookmarked: bool = False,
+) -> List[PostOut]:
+    """PostOut list in `uids` order; unknown posts and posts without an author are skipped"""
+    if not uids:
+        return []
+    cards = load_post_cards(db, uids)
+    authors = load_author_cards(db, [card["user_id"] for card in cards.values()])
+
+    post_ids = [card["id"] for card in cards.values()]
+    liked_ids = set()
+    bookmarked_ids = set()
+    if viewer_id is not None and post_ids:
+        if not all_liked:
+            liked_ids = {
+                pid for (pid,) in db.query(PostLike.post_id)
+                .filter(PostLike.user_id == viewer_id, PostLike.post_id.in_(post_ids)).all()
+            }
+        if not all_bookmarked:
+            bookmarked_ids = {
+                pid for (pid,) in db.query(PostBookmark.post_id)
+                .filter(PostBookmark.user_id == viewer_id, PostBookmark.post_id.in_(post_ids)).all()
+            }
+
+    out: List[PostOut] = []
+    for uid in uids:
+        card = cards.get(uid)
+        if card is None:
+            continue
+        author = authors.get(card["user_id"])
+        if author is None:
+            continue
+        out.append(build_post_out(
+            card,
+            author,
+            liked=all_liked or card["id"] in liked_ids,
+            bookmarked=all_bookmarked or card["id"] in bookmarked_ids,
+        ))
+    return out
+
+
+def hydrate_posts(db: Session, post_ids: List[int], **kwargs) -> List[PostOut]:
+    """Same as hydrate_post_uids, starting from posts.id values"""
+    uid_map = resolve_uids(db, post_ids)
+    return hydrate_post_uids(db, [uid_map[pid] for pid in post_ids if pid in uid_map], **kwargs)
@@ -0,0 +1,185 @@
+"""
+Notification inbox: unread counts and archival.
+
+`notification_unread` keeps one unread counter per user, adjusted with
+relative `SET unread_count = unread_count + :delta` updates in the same
+transaction as the notification insert / mark-read, so the badge endpoint
+is a primary-key read (additionally cached per worker for a few seconds).
+Cached counts are dropped once the transaction that changed them commits;
+dropping them earlier would let a read in between cache the old count again.
+
+`archive()` moves notifications older than NOTIFICATION_RETENTION_DAYS to
+`notifications_archive` in batches; `reconcile_unread()` recomputes the
+counters from `notifications` in locked batches next to live traffic. Both
+run from archive_notifications.py.
+"""
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import Dict, Iterable
+
+from sqlalchemy import bindparam, case, delete, event, func, insert, select, update
+from sqlalchemy.orm import Session
+
+from .cache import LRUCache
+from .config import (
+    COUNTER_RECONCILE_BATCH_SIZE,
+    NOTIFICATION_ARCHIVE_BATCH_SIZE,
+    NOTIFICATION_RETENTION_DAYS,
+    NOTIFICATION_UNREAD_CACHE_TTL_SECONDS,
+)
+from .models import Notification, NotificationArchive, NotificationUnread, User
+from .upserts import insert_missing
+
+_unread_cache = LRUCache(ttl_seconds=NOTIFICATION_UNREAD_CACHE_TTL_SECONDS)
+
+# Session.info key: user ids whose cached count is dropped when the session commits
+_STALE_COUNTS = "inbox_stale_unread"
+
+
+def _invalidate_on_commit(db: Session, user_ids: Iterable[int]) -> None:
+    db.info.setdefault(_STALE_COUNTS, set()).update(user_ids)
+
+
+@event.listens_for(Session, "after_commit")
+def _drop_stale_counts(session: Session) -> None:
+    for user_id in session.info.pop(_STALE_COUNTS, ()):
+        _unread_cache.delete(user_id)
+
+
+def adjust_unread(db: Session, deltas: Dict[int, int]) -> None:
+    """Apply per-user unread deltas in the caller's transaction (clamped at 0)"""
+    deltas = {user_id: d for user_id, d in deltas.items() if d}
+    if not deltas:
+        return
+    insert_missing(db, NotificationUnread, "user_id", [{"user_id": user_id} for user_id in deltas])
+    table = NotificationUnread.__table__
+    new_value = table.c.unread_count + bindparam("d")
+    stmt = (
+        update(table)
+        .where(table.c.user_id == bindparam("b_user_id"))
+        .values(unread_count=case((new_value < 0, 0), else_=new_value))
+    )
+    db.connection().execute(stmt, [{"b_user_id": user_id, "d": d} for user_id, d in deltas.items()])
+    _invalidate_on_commit(db, deltas)
+
+
+def record_new(db: Session, user_ids: Iterable[int]) -> None:
+    """Count freshly inserted (unread) notifications, one entry per notification"""
+    adjust_unread(db, Counter(user_ids))
+
+
+def increment_unread(db: Session, user_ids: Iterable[int]) -> None:
+    """+1 for each user in `user_ids` (distinct), as a single set-based UPDATE"""
+    user_ids = list(set(user_ids))
+    if not user_ids:
+        return
+    insert_missing(db, NotificationUnread, "user_id", [{"user_id": user_id} for user_id in user_ids])
+    db.execute(
+        update(NotificationUnread)
+        .where(NotificationUnread.user_id.in_(user_ids))
+        .values(unread_count=NotificationUnread.unread_count + 1)
+        .execution_options(synchronize_session=False)
+    )
+    _invalidate_on_commit(db, user_ids)
+
+
+def unread_count(db: Session, user_id: int) -> int:
+    cached = _unread_cache.get(user_id)
+    if cached is not None:
+        return cached
+    count = db.execute(
+        select(NotificationUnread.unread_count).where(NotificationUnread.user_id == user_id)
+    ).scalar() or 0
+    _unread_cache.set(user_id, count)
+    return count
+
+
+def mark_read(db: Session, user_id: int, *conditions) -> int:
+    """Mark the user's unread notifications matching `conditions` read with one UPDATE; returns rows changed"""
+    result = db.execute(
+        update(Notification)
+        .where(Notification.user_id == user_id, Notification.is_read.is_(False), *conditions)
+        .values(is_read=True)
+        .execution_options(synchronize_session=False)
+    )
+    adjust_unread(db, {user_id: -result.rowcount})
+    return result.rowcount
+
+
+def remove_user(db: Session, user_id: int) -> None:
+    db.execute(delete(NotificationUnread).where(NotificationUnread.user_id == user_id))
+    _invalidate_on_commit(db, [user_id])
+
+
+def archive(db: Session, retention_days: int = NOTIFICATION_RETENTION_DAYS,
+            batch_size: int = NOTIFICATION_ARCHIVE_BATCH_SIZE) -> int:
+    """Move notifications older than `retention_days` to notifications_archive; returns rows moved"""
+    cutoff = datetime.utcnow() - timedelta(days=retention_days)
+    columns = ["id", "user_id", "title", "body", "type", "data", "is_read", "created_at"]
+    moved = 0
+    while True:
+        rows = db.execute(
+            select(Notification.id, Notification.user_id, Notification.is_read)
+            .where(Notification.created_at < cutoff)
+            .order_by(Notification.id)
+            .limit(batch_size)
+        ).all()
+        if not rows:
+            return moved
+        ids = [r.id for r in rows]
+        db.execute(
+            insert(NotificationArchive).from_select(
+                columns,
+                select(*[getattr(Notification, c) for c in columns]).where(Notification.id.in_(ids)),
+            )
+        )
+        db.execute(delete(Notification).where(Notification.id.in_(ids)))
+        # Archived unread notifications no longer count towards the badge
+        adjust_unread(db, {k: -v for k, v in Counter(r.user_id for r in rows if not r.is_read).items()})
+        db.commit()
+        moved += len(ids)
+
+
+def _reconcile_batch(db: Session, user_ids: list) -> int:
+    """Correct the unread counters of `user_ids`; returns how many had drifted. The caller commits."""
+    # Locking the counter rows first waits out any transaction that has already
+    # bumped them; one that has only inserted its notifications so far bumps
+    # the counter after this batch commits and is not counted below
+    current = dict(db.execute(
+        select(NotificationUnread.user_id, NotificationUnread.unread_count)
+        .where(NotificationUnread.user_id.in_(user_ids))
+        .with_for_update()
+    ).all())
+    expected = dict(db.execute(
+        select(Notification.user_id, func.count(Notification.id))
+        .where(Notification.user_id.in_(user_ids), Notification.is_read.is_(False))
+        .group_by(Notification.user_id)
+    ).all())
+    drifted = [user_id for user_id, count in current.items() if count != expected.get(user_id, 0)]
+    if drifted:
+        table = NotificationUnread.__table__
+        db.connection().execute(
+            update(table).where(table.c.user_id == bindparam("b_user_id")).values(unread_count=bindparam("count")),
+            [{"b_user_id": user_id, "count": expected.get(user_id, 0)} for user_id in drifted],
+        )
+    missing = [user_id for user_id in expected if user_id not in current]
+    insert_missing(db, NotificationUnread, "user_id", [
+        {"user_id": user_id, "unread_count": expected[user_id]} for user_id in missing
+    ])
+    _invalidate_on_commit(db, drifted + missing)
+    return len(drifted) + len(missing)
+
+
+def reconcile_unread(db: Session, batch_size: int = COUNTER_RECONCILE_BATCH_SIZE) -> int:
+    """Recompute the unread counters from `notifications` (drift correction); returns counters corrected"""
+    corrected = 0
+    last_id = 0
+    while True:
+        user_ids = db.execute(
+            select(User.id).where(User.id > last_id).order_by(User.id).limit(batch_size)
+        ).scalars().all()
+        if not user_ids:
+            return corrected
+        corrected += _reconcile_batch(db, user_ids)
+        db.commit()
+        last_id = user_ids[-1]
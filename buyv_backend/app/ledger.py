@@ -0,0 +1,161 @@
+"""
+Promoter commission ledger.
+
+`promoter_balances` holds pending / paid / canceled totals (amount and count)
+per promoter uid, so balance screens are a primary-key read instead of a scan
+of `commissions`. Every write that creates commissions or changes their
+status goes through `record_created` / `transition` / `move` in the same
+transaction as the commission rows themselves; balances are updated with relative
+`SET x = x + :delta` statements, never read-modify-write.
+
+`rebuild()` recomputes all balances from `commissions` (see
+rebuild_promoter_balances.py).
+"""
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, Iterable, Optional, Tuple
+
+from sqlalchemy import bindparam, case, delete, func, insert, select, update
+from sqlalchemy.orm import Session
+
+from .models import Commission, PromoterBalance, User
+from .upserts import insert_missing
+
+BUCKETS = ("pending", "paid", "canceled")
+
+
+def bucket(status: Optional[str]) -> str:
+    """Ledger bucket for a commission status; anything not paid/canceled is pending"""
+    status = (status or "").lower()
+    if status == "paid":
+        return "paid"
+    if status in ("canceled", "cancelled"):
+        return "canceled"
+    return "pending"
+
+
+def bucket_sql(status_col):
+    """SQL form of bucket()"""
+    status = func.lower(status_col)
+    return case(
+        (status == "paid", "paid"),
+        (status.in_(["canceled", "cancelled"]), "canceled"),
+        else_="pending",
+    )
+
+
+def _ensure_rows(db: Session, uids: Iterable[str]) -> None:
+    insert_missing(db, PromoterBalance, "promoter_uid", [{"promoter_uid": uid} for uid in set(uids)])
+
+
+def _apply(db: Session, deltas: Dict[str, Dict[str, list]]) -> None:
+    deltas = {uid: per_bucket for uid, per_bucket in deltas.items() if uid}
+    if not deltas:
+        return
+    _ensure_rows(db, deltas.keys())
+    table = PromoterBalance.__table__
+    values = {"updated_at": datetime.utcnow()}
+    for name in BUCKETS:
+        values[f"{name}_amount"] = table.c[f"{name}_amount"] + bindparam(f"d_{name}_amount")
+        values[f"{name}_count"] = table.c[f"{name}_count"] + bindparam(f"d_{name}_count")
+    stmt = update(table).where(table.c.promoter_uid == bindparam("b_uid")).values(values)
+    params = []
+    for uid, per_bucket in deltas.items():
+        row = {"b_uid": uid}
+        for name in BUCKETS:
+            amount, count = per_bucket.get(name, (0.0, 0))
+            row[f"d_{name}_amount"] = amount
+            row[f"d_{name}_count"] = count
+        params.append(row)
+    db.connection().execute(stmt, params)
+
+
+def _new_deltas():
+    return defaultdict(lambda: defaultdict(lambda: [0.0, 0]))
+
+
+def record_created(db: Session, commissions: Iterable[Commission]) -> None:
+    """Add freshly created commissions to their promoters' balances"""
+    deltas = _new_deltas()
+    for row in commissions:
+        entry = deltas[row.user_uid][bucket(row.status)]
+        entry[0] += row.commission_amount or 0.0
+        entry[1] += 1
+    _apply(db, deltas)
+
+
+def transition(db: Session, commissions: Iterable[Commission], status: str) -> int:
+    """Set `status` on loaded commission rows and move their amounts between buckets.
+
+    Returns the number of rows whose ledger bucket changed. The caller commits.
+    """
+    now = datetime.utcnow()
+    target = bucket(status)
+    by_previous = defaultdict(list)
+    for row in commissions:
+        previous = bucket(row.status)
+        row.status = status
+        row.updated_at = now
+        if target == "paid":
+            row.paid_at = now
+        if previous != target:
+            by_previous[previous].append((row.user_uid, row.commission_amount))
+    for previous, rows in by_previous.items():
+        move(db, rows, previous, target)
+    return sum(len(rows) for rows in by_previous.values())
+
+
+def move(db: Session, rows: Iterable[Tuple[Optional[str], float]], previous: str, target: str) -> None:
+    """Move (promoter_uid, amount) pairs from bucket `previous` to bucket `target`"""
+    if previous == target:
+        return
+    deltas = _new_deltas()
+    for promoter_uid, amount in rows:
+        amount = amount or 0.0
+        deltas[promoter_uid][previous][0] -= amount
+        deltas[promoter_uid][previous][1] -= 1
+        deltas[promoter_uid][target][0] += amount
+        deltas[promoter_uid][target][1] += 1
+    _apply(db, deltas)
+
+
+def get_balance(db: Session, promoter_uid: str) -> Optional[PromoterBalance]:
+    return db.get(PromoterBalance, promoter_uid)
+
+
+def remove_promoter(db: Session, promoter_uid: str) -> None:
+    db.execute(delete(PromoterBalance).where(PromoterBalance.promoter_uid == promoter_uid))
+
+
+def backfill_user_uids(db: Session) -> int:
+    """Older rows may only carry user_id: fill in the uid the listing and balances key on. The caller commits."""
+    result = db.execute(
+        update(Commission)
+        .where(Commission.user_uid.is_(None), Commission.user_id.is_not(None))
+        .values(user_uid=select(User.uid).where(User.id == Commission.user_id).scalar_subquery())
+        .execution_options(synchronize_session=False)
+    )
+    return result.rowcount or 0
+
+
+def rebuild(db: Session) -> int:
+    """Recompute every balance from `commissions`; returns the number of promoters"""
+    backfill_user_uids(db)
+    db.execute(delete(PromoterBalance))
+    status = bucket_sql(Commission.status)
+    columns = {}
+    for name in BUCKETS:
+        columns[f"{name}_amount"] = func.coalesce(
+            func.sum(case((status == name, Commission.commission_amount), else_=0.0)), 0.0
+        )
+        columns[f"{name}_count"] = func.coalesce(func.sum(case((status == name, 1), else_=0)), 0)
+    query = (
+        select(Commission.user_uid, *[expr.label(name) for name, expr in columns.items()], func.now())
+        .where(Commission.user_uid.is_not(None))
+        .group_by(Commission.user_uid)
+    )
+    result = db.execute(
+        insert(PromoterBalance).from_select(["promoter_uid", *columns.keys(), "updated_at"], query)
+    )
+    db.commit()
+    return result.rowcount
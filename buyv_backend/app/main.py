@@ -1,6 +1,6 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from .database import engine, Base
+from .database import engine
 from .auth import router as auth_router
 from .users import router as users_router
 from .follows import router as follows_router
@@ -12,15 +12,26 @@ from .comments import router as comments_router
 from .payments import router as payments_router
 from .cleanup import router as cleanup_router
 from .admin import router as admin_router
+from .viewer import router as viewer_router
+from .actions import router as actions_router
 from .firebase_service import FirebaseService
+from .pagination import NEXT_CURSOR_HEADER
+from .counters import folder as counter_folder
+from . import async_database, cache, db_pool, fanout, hashing, push_queue, replicas
+from .search import init_search_backend
+from .user_search import init_user_search
+from . import migrations
 import logging
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Create tables if not exist
-Base.metadata.create_all(bind=engine)
+# Schema is owned by app/migrations: this reads schema_migrations and applies
+# pending revisions only when AUTO_MIGRATE is on (see migrate.py)
+migrations.check(engine)
+init_search_backend(engine)
+init_user_search(engine)
 
 # Initialize Firebase on startup (will skip if credentials not found)
 try:
@@ -53,12 +64,49 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[NEXT_CURSOR_HEADER],
 )
 
+if replicas.replicas:
+    # Keeps a user's reads on the primary for a few seconds after they write
+    app.add_middleware(replicas.ReadYourWritesMiddleware)
+
+@app.on_event("startup")
+def start_background_workers():
+    counter_folder.start()
+    push_queue.dispatcher.start()
+    fanout.worker.start()
+    replicas.monitor.start()
+    cache.listener.start()
+
+@app.on_event("shutdown")
+def stop_background_workers():
+    cache.listener.stop()
+    replicas.monitor.stop()
+    counter_folder.stop()
+    fanout.worker.stop()
+    push_queue.dispatcher.stop()
+    hashing.shutdown()
+
+@app.on_event("shutdown")
+async def close_async_engine():
+    await async_database.dispose()
+    await replicas.dispose()
+
 @app.get("/health")
 def health():
     return {"status": "ok"}
 
+@app.get("/metrics")
+def metrics():
+    return {
+        "hashing": hashing.stats(),
+        "push": push_queue.stats(),
+        "fanout": fanout.stats(),
+        "db_pool": db_pool.stats(),
+        "read_replicas": replicas.stats(),
+    }
+
 app.include_router(auth_router)
 app.include_router(users_router)
 app.include_router(follows_router)
@@ -69,4 +117,6 @@ app.include_router(posts_router)
 app.include_router(comments_router)
 app.include_router(payments_router)
 app.include_router(cleanup_router)
-app.include_router(admin_router)
\ No newline at end of file
+app.include_router(admin_router)
+app.include_router(viewer_router)
+app.include_router(actions_router)
\ No newline at end of file
@@ -0,0 +1,114 @@
+"""
+Versioned schema migrations.
+
+Each revision is a module in this package exposing `revision`, `description`
+and `upgrade(engine)`, listed in REVISIONS in order. Applied revisions are
+recorded in `schema_migrations`. Revisions must be idempotent: the baseline
+builds fresh databases from the current models, so a later revision may find
+its work already done.
+
+`python migrate.py` applies pending revisions (deploy release step). On boot
+`check()` only reads `schema_migrations`, no schema reflection; pending
+revisions are applied when AUTO_MIGRATE is on, otherwise the worker refuses
+to start against an outdated schema.
+"""
+import logging
+from contextlib import contextmanager
+from datetime import datetime
+from typing import List
+
+from sqlalchemy import Column, DateTime, MetaData, String, Table, inspect, select, text
+from sqlalchemy.engine import Engine
+
+from ..config import AUTO_MIGRATE
+from . import r0001_baseline, r0002_indexes, r0003_fanout_mode, r0004_commission_user_uid, r0005_derived_backfill
+
+logger = logging.getLogger(__name__)
+
+REVISIONS = [
+    r0001_baseline,
+    r0002_indexes,
+    r0003_fanout_mode,
+    r0004_commission_user_uid,
+    r0005_derived_backfill,
+]
+
+# Kept off Base.metadata so create_all never touches it
+schema_migrations = Table(
+    "schema_migrations",
+    MetaData(),
+    Column("version", String(32), primary_key=True),
+    Column("description", String(255), nullable=False),
+    Column("applied_at", DateTime, nullable=False),
+)
+
+# Serialises concurrent upgrades (several workers booting at once)
+_LOCK_KEY = 724011
+_LOCK_NAME = "buyv_schema_migrations"
+
+
+@contextmanager
+def _migration_lock(engine: Engine):
+    dialect = engine.dialect.name
+    if dialect not in ("postgresql", "mysql"):
+        yield
+        return
+    # Autocommit: an idle open transaction here would stall CREATE INDEX CONCURRENTLY
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        if dialect == "postgresql":
+            conn.execute(text("SELECT pg_advisory_lock(:key)"), {"key": _LOCK_KEY})
+        else:
+            conn.execute(text("SELECT GET_LOCK(:name, -1)"), {"name": _LOCK_NAME})
+        try:
+            yield
+        finally:
+            if dialect == "postgresql":
+                conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": _LOCK_KEY})
+            else:
+                conn.execute(text("SELECT RELEASE_LOCK(:name)"), {"name": _LOCK_NAME})
+
+
+def applied(engine: Engine) -> set:
+    if not inspect(engine).has_table(schema_migrations.name):
+        return set()
+    with engine.connect() as conn:
+        return set(conn.execute(select(schema_migrations.c.version)).scalars())
+
+
+def pending(engine: Engine) -> List[str]:
+    done = applied(engine)
+    return [module.revision for module in REVISIONS if module.revision not in done]
+
+
+def upgrade(engine: Engine) -> List[str]:
+    """Apply pending revisions in order; returns the versions applied"""
+    ran = []
+    with _migration_lock(engine):
+        schema_migrations.create(bind=engine, checkfirst=True)
+        # Re-read under the lock: another worker may have finished meanwhile
+        done = applied(engine)
+        for module in REVISIONS:
+            if module.revision in done:
+                continue
+            logger.info(f"Applying migration {module.revision}: {module.description}")
+            module.upgrade(engine)
+            with engine.begin() as conn:
+                conn.execute(schema_migrations.insert().values(
+                    version=module.revision,
+                    description=module.description,
+                    applied_at=datetime.utcnow(),
+                ))
+            ran.append(module.revision)
+    return ran
+
+
+def check(engine: Engine) -> None:
+    """Boot-time schema check (see module docstring)"""
+    missing = pending(engine)
+    if not missing:
+        return
+    if not AUTO_MIGRATE:
+        raise RuntimeError(
+            f"Database schema is behind (pending migrations: {', '.join(missing)}); run `python migrate.py`"
+        )
+    upgrade(engine)
@@ -0,0 +1,47 @@
+"""DDL helpers for revisions: every operation is idempotent and avoids long table locks"""
+from typing import Sequence
+
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Engine
+
+
+def create_index(engine: Engine, name: str, table: str, columns: Sequence[str], unique: bool = False) -> None:
+    """Create an index without blocking writes (PostgreSQL CONCURRENTLY, MySQL online DDL)"""
+    kind = "UNIQUE INDEX" if unique else "INDEX"
+    cols = ", ".join(columns)
+    dialect = engine.dialect.name
+    if dialect == "postgresql":
+        # CONCURRENTLY can't run inside a transaction block
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            valid = conn.execute(text(
+                "SELECT i.indisvalid FROM pg_class c JOIN pg_index i ON i.indexrelid = c.oid WHERE c.relname = :name"
+            ), {"name": name}).scalar()
+            if valid:
+                return
+            if valid is False:
+                # Left INVALID by an interrupted concurrent build
+                conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
+            conn.execute(text(f"CREATE {kind} CONCURRENTLY IF NOT EXISTS {name} ON {table} ({cols})"))
+    elif dialect == "mysql":
+        with engine.begin() as conn:
+            exists = conn.execute(text(
+                "SELECT 1 FROM information_schema.statistics "
+                "WHERE table_schema = DATABASE() AND table_name = :table AND index_name = :name LIMIT 1"
+            ), {"table": table, "name": name}).first()
+            if not exists:
+                conn.execute(text(f"CREATE {kind} {name} ON {table} ({cols}) ALGORITHM=INPLACE LOCK=NONE"))
+    else:
+        with engine.begin() as conn:
+            conn.execute(text(f"CREATE {kind} IF NOT EXISTS {name} ON {table} ({cols})"))
+
+
+def add_column(engine: Engine, table: str, name: str, ddl: str) -> None:
+    """`ALTER TABLE ... ADD COLUMN` unless the column exists; `ddl` is the type and constraints.
+
+    Give new NOT NULL columns a constant DEFAULT so PostgreSQL (11+) and MySQL
+    (8.0+, INSTANT) add them without rewriting the table.
+    """
+    if name in {column["name"] for column in inspect(engine).get_columns(table)}:
+        return
+    with engine.begin() as conn:
+        conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {name} {ddl}"))
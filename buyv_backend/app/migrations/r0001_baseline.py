@@ -0,0 +1,17 @@
+"""Tables from the models plus the search structures that used to be created on every boot"""
+from sqlalchemy.engine import Engine
+
+revision = "0001"
+description = "baseline schema"
+
+
+def upgrade(engine: Engine) -> None:
+    from ..database import Base
+    from .. import models  # noqa: F401  (registers the tables on Base.metadata)
+    from ..search import ensure_search_index
+    from ..user_search import ensure_user_search_index
+
+    # Existing databases keep their tables; fresh ones get the current models
+    Base.metadata.create_all(bind=engine)
+    ensure_search_index(engine)
+    ensure_user_search_index(engine)
@@ -0,0 +1,42 @@
+"""
+Indexes declared in the models after their tables existed (create_all only
+indexes new tables), plus the missing foreign-key indexes on post_likes,
+post_bookmarks, comments and comment_likes. No-op on fresh databases.
+"""
+from sqlalchemy.engine import Engine
+
+from .ops import create_index
+
+revision = "0002"
+description = "keyset and foreign-key indexes"
+
+INDEXES = [
+    ("ix_posts_created_at_id", "posts", ["created_at", "id"]),
+    ("ix_posts_user_created", "posts", ["user_id", "created_at", "id"]),
+    ("ix_comments_post_created", "comments", ["post_id", "created_at", "id"]),
+    ("ix_comments_user_id", "comments", ["user_id"]),
+    ("ix_post_likes_user_created", "post_likes", ["user_id", "created_at", "id"]),
+    ("ix_post_bookmarks_user_created", "post_bookmarks", ["user_id", "created_at", "id"]),
+    ("ix_comment_likes_user_id", "comment_likes", ["user_id"]),
+    ("ix_comment_scores_post_likes", "comment_scores", ["post_id", "likes_count", "comment_id"]),
+    ("ix_follows_followed_created", "follows", ["followed_id", "created_at", "id"]),
+    ("ix_follows_follower_created", "follows", ["follower_id", "created_at", "id"]),
+    ("ix_notifications_user_created", "notifications", ["user_id", "created_at", "id"]),
+    ("ix_notifications_archive_user_created", "notifications_archive", ["user_id", "created_at"]),
+    ("ix_outbox_status_next_attempt", "notification_outbox", ["status", "next_attempt_at", "id"]),
+    ("ix_fanout_jobs_status_next", "fanout_jobs", ["status", "next_attempt_at", "id"]),
+    ("ix_device_tokens_user_id", "device_tokens", ["user_id"]),
+    ("ix_device_tokens_last_seen", "device_tokens", ["last_seen"]),
+    ("ix_timeline_user_created", "timeline_entries", ["user_id", "created_at", "post_id"]),
+    ("ix_timeline_user_author", "timeline_entries", ["user_id", "author_id"]),
+    ("ix_timeline_post_id", "timeline_entries", ["post_id"]),
+    ("ix_orders_user_created", "orders", ["user_id", "created_at", "id"]),
+    ("ix_order_items_order_id", "order_items", ["order_id"]),
+    ("ix_commissions_order_id", "commissions", ["order_id"]),
+    ("ix_commissions_user_uid_created", "commissions", ["user_uid", "created_at", "id"]),
+]
+
+
+def upgrade(engine: Engine) -> None:
+    for name, table, columns in INDEXES:
+        create_index(engine, name, table, columns)
@@ -0,0 +1,21 @@
+"""
+Sticky per-author fan-out mode (see timeline.py). Authors already above
+TIMELINE_CELEBRITY_THRESHOLD were never fanned out, so they start in "pull".
+"""
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+
+from ..config import TIMELINE_CELEBRITY_THRESHOLD
+from .ops import add_column
+
+revision = "0003"
+description = "users.fanout_mode"
+
+
+def upgrade(engine: Engine) -> None:
+    add_column(engine, "users", "fanout_mode", "VARCHAR(8) DEFAULT 'push' NOT NULL")
+    with engine.begin() as conn:
+        conn.execute(
+            text("UPDATE users SET fanout_mode = 'pull' WHERE followers_count >= :threshold AND fanout_mode <> 'pull'"),
+            {"threshold": TIMELINE_CELEBRITY_THRESHOLD},
+        )
@@ -0,0 +1,20 @@
+"""
+Commissions written before `user_uid` existed only carry `user_id`, so the
+promoter listing (which filters on `user_uid`) never showed them and, unless
+rebuild_promoter_balances.py had been run, their amounts were missing from
+`promoter_balances`. Backfill the uid, then recompute the balances.
+"""
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+revision = "0004"
+description = "commissions.user_uid backfill"
+
+
+def upgrade(engine: Engine) -> None:
+    from .. import ledger
+
+    with Session(bind=engine) as db:
+        if ledger.backfill_user_uids(db):
+            ledger.rebuild(db)
+        db.commit()
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, Text, ForeignKey, UniqueConstraint, Float
+from sqlalchemy import Column, Integer, String, Boolean, DateTime, Text, ForeignKey, UniqueConstraint, Float, Index
 from sqlalchemy.orm import relationship, Mapped, mapped_column
 from datetime import datetime
 import uuid
@@ -19,6 +19,8 @@ class User(Base):
     following_count: Mapped[int] = mapped_column(Integer, default=0)
     reels_count: Mapped[int] = mapped_column(Integer, default=0)
     is_verified: Mapped[bool] = mapped_column(Boolean, default=False)
+    # "push" (fanned out on write) or "pull" (merged at read time); sticky, see timeline.py
+    fanout_mode: Mapped[str] = mapped_column(String(8), default="push", server_default="push", nullable=False)
     created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
     updated_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
@@ -30,6 +32,10 @@ class User(Base):
 
 class Notification(Base):
     __tablename__ = "notifications"
+    __table_args__ = (
+        # Inbox listing, keyset-paginated on (created_at, id)
+        Index('ix_notifications_user_created', 'user_id', 'created_at', 'id'),
+    )
     id: Mapped[int] = mapped_column(Integer, primary_key=True, index=True)
     user_id: Mapped[int] = mapped_column(Integer, ForeignKey("users.id"), nullable=False)
     title: Mapped[str] = mapped_column(String(255), nullable=False)
@@ -50,6 +56,9 @@ class Follow(Base):
 
     __table_args__ = (
         UniqueConstraint('follower_id', 'followed_id', name='uq_follow_pair'),
+        # Keyset-paginated follower / following listings
+        Index('ix_follows_followed_created', 'followed_id', 'created_at', 'id'),
+        Index('ix_follows_follower_created', 'follower_id', 'created_at', 'id'),
     )
 
     follower = relationship("User", foreign_keys=[follower_id])
@@ -58,6 +67,10 @@ class Follow(Base):
 
 class Order(Base):
     __tablename__ = "orders"
+    __table_args__ = (
+        # Per-buyer listing, keyset-paginated on (created_at, id)
+        Index('ix_orders_user_created', 'user_id', 'created_at', 'id'),
+    )
     id: Mapped[int] = mapped_column(Integer, primary_key=True, index=True)
     order_number: Mapped[str] = mapped_column(String(50), unique=True, index=True)
     user_id: Mapped[int] = mapped_column(Integer, ForeignKey("users.id"), nullable=False)
@@ -83,7 +96,7 @@ class Order(Base):
 class OrderItem(Base):
     __tablename__ = "order_items"
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
-    order_id: Mapped[int] = mapped_column(Integer, ForeignKey("orders.id"), nullable=False)
+    order_id: Mapped[int] = mapped_column(Integer, ForeignKey("orders.id"), nullable=False, index=True)
     product_id: Mapped[str] = mapped_column(String(100))
     product_name: Mapped[str] = mapped_column(String(255))
     product_image: Mapped[str] = mapped_column(String(512))
@@ -101,6 +114,11 @@ class OrderItem(Base):
 
 class Commission(Base):
     __tablename__ = "commissions"
+    __table_args__ = (
+        # Promoter listing, keyset-paginated on (created_at, id)
+        Index('ix_commissions_user_uid_created', 'user_uid', 'created_at', 'id'),
+        Index('ix_commissions_order_id', 'order_id'),
+    )
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
     user_id: Mapped[int | None] = mapped_column(Integer, ForeignKey("users.id"), nullable=True)
     user_uid: Mapped[str | None] = mapped_column(String(36), nullable=True)  # promoter UID
@@ -135,6 +153,13 @@ class Post(Base):
     created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
     updated_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
+    __table_args__ = (
+        # Keyset pagination for the feed: ORDER BY created_at DESC, id DESC
+        Index('ix_posts_created_at_id', 'created_at', 'id'),
+        # Per-author listings and read-time merge of celebrity posts into timelines
+        Index('ix_posts_user_created', 'user_id', 'created_at', 'id'),
+    )
+
     user = relationship("User")
     likes = relationship("PostLike", back_populates="post", cascade="all, delete-orphan")
     comments = relationship("Comment", back_populates="post", cascade="all, delete-orphan")
@@ -149,6 +174,8 @@ class PostLike(Base):
 
     __table_args__ = (
         UniqueConstraint('post_id', 'user_id', name='uq_post_like'),
+        # A user's liked posts, newest first (the unique key leads with post_id)
+        Index('ix_post_likes_user_created', 'user_id', 'created_at', 'id'),
     )
 
     post = relationship("Post", back_populates="likes")
@@ -164,6 +191,7 @@ class PostBookmark(Base):
 
     __table_args__ = (
         UniqueConstraint('post_id', 'user_id', name='uq_post_bookmark'),
+        Index('ix_post_bookmarks_user_created', 'user_id', 'created_at', 'id'),
     )
 
     post = relationship("Post")
@@ -179,5 +207,176 @@ class Comment(Base):
     created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
     updated_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
+    __table_args__ = (
+        # Keyset pagination of a post's thread: ORDER BY created_at DESC, id DESC
+        Index('ix_comments_post_created', 'post_id', 'created_at', 'id'),
+        Index('ix_comments_user_id', 'user_id'),
+    )
+
     user = relationship("User")
-    post = relationship("Post", back_populates="comments")
\ No newline at end of file
+    post = relationship("Post", back_populates="comments")
+
+
+class TimelineEntry(Base):
+    """Fan-out-on-write home timeline: one row per (follower inbox, post)"""
+    __tablename__ = "timeline_entries"
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    user_id: Mapped[int] = mapped_column(Integer, ForeignKey("users.id"), nullable=False)  # inbox owner
+    post_id: Mapped[int] = mapped_column(Integer, ForeignKey("posts.id"), nullable=False)
+    author_id: Mapped[int] = mapped_column(Integer, ForeignKey("users.id"), nullable=False)
+    created_at: Mapped[datetime] = mapped_column(DateTime, nullable=False)  # copy of posts.created_at
+
+    __table_args__ = (
+        UniqueConstraint('user_id', 'post_id', name='uq_timeline_entry'),
+        Index('ix_timeline_user_created', 'user_id', 'created_at', 'post_id'),
+        Index('ix_timeline_user_author', 'user_id', 'author_id'),
+        Index('ix_timeline_post_id', 'post_id'),
+    )
+
+
+class CounterDelta(Base):
+    """Append-only counter increments, folded into the denormalized *_count columns by counters.fold()"""
+    __tablename__ = "counter_deltas"
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    entity: Mapped[str] = mapped_column(String(20), nullable=False)  # 'post' | 'user' | 'user_stats' | 'comment'
+    entity_id: Mapped[int] = mapped_column(Integer, nullable=False)
+    field: Mapped[str] = mapped_column(String(50), nullable=False)
+    delta: Mapped[int] = mapped_column(Integer, nullable=False)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+
+
+class PromoterBalance(Base):
+    """Materialized commission totals per promoter, maintained by ledger.py"""
+    __tablename__ = "promoter_balances"
+    promoter_uid: Mapped[str] = mapped_column(String(36), primary_key=True)
+    pending_amount: Mapped[float] = mapped_column(Float, default=0.0, nullable=False)
+    paid_amount: Mapped[float] = mapped_column(Float, default=0.0, nullable=False)
+    canceled_amount: Mapped[float] = mapped_column(Float, default=0.0, nullable=False)
+    pending_count: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
+    paid_count: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
+    canceled_count: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
+    updated_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+class NotificationOutbox(Base):
+    """One pending push per device token, delivered by push_queue workers"""
+    __tablename__ = "notification_outbox"
+    __table_args__ = (
+        Index('ix_outbox_status_next_attempt', 'status', 'next_attempt_at', 'id'),
+    )
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    token: Mapped[str] = mapped_column(String(512), nullable=False)
+    title: Mapped[str] = mapped_column(String(255), nullable=False)
+    body: Mapped[str] = mapped_column(Text, nullable=False)
+    type: Mapped[str] = mapped_column(String(100), nullable=False)
+    data: Mapped[str | None] = mapped_column(Text, nullable=True)  # JSON string
+    notification_id: Mapped[int | None] = mapped_column(Integer, nullable=True)
+    status: Mapped[str] = mapped_column(String(20), default="pending", nullable=False)  # 'pending' | 'sending' | 'failed'
+    attempts: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
+    next_attempt_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, nullable=False)
+    last_error: Mapped[str | None] = mapped_column(Text, nullable=True)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+
+
+class NotificationUnread(Base):
+    """Per-user unread notification count, maintained incrementally by inbox.py"""
+    __tablename__ = "notification_unread"
+    user_id: Mapped[int] = mapped_column(Integer, ForeignKey("users.id"), primary_key=True)
+    unread_count: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
+
+
+class NotificationArchive(Base):
+    """Notifications past NOTIFICATION_RETENTION_DAYS, moved out of the hot table"""
+    __tablename__ = "notifications_archive"
+    __table_args__ = (
+        Index('ix_notifications_archive_user_created', 'user_id', 'created_at'),
+    )
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)  # original notifications.id
+    user_id: Mapped[int] = mapped_column(Integer, nullable=False)
+    title: Mapped[str] = mapped_column(String(255), nullable=False)
+    body: Mapped[str] = mapped_column(Text, nullable=False)
+    type: Mapped[str] = mapped_column(String(100), nullable=False)
+    data: Mapped[str | None] = mapped_column(Text, nullable=True)
+    is_read: Mapped[bool] = mapped_column(Boolean, default=False)
+    created_at: Mapped[datetime] = mapped_column(DateTime)
+    archived_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+
+
+class FanoutJob(Base):
+    """Follower notification fan-out for one new post, processed in chunks by fanout.py"""
+    __tablename__ = "fanout_jobs"
+    __table_args__ = (
+        Index('ix_fanout_jobs_status_next', 'status', 'next_attempt_at', 'id'),
+    )
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    post_id: Mapped[int] = mapped_column(Integer, nullable=False)
+    author_id: Mapped[int] = mapped_column(Integer, nullable=False)
+    status: Mapped[str] = mapped_column(String(20), default="pending", nullable=False)  # 'pending' | 'running' | 'done' | 'failed'
+    mode: Mapped[str | None] = mapped_column(String(20), nullable=True)  # 'multicast' | 'topic'
+    # follows.id of the last follower processed: a restarted job resumes after it
+    last_follow_id: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
+    recipients: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
+    attempts: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
+    last_error: Mapped[str | None] = mapped_column(Text, nullable=True)
+    next_attempt_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, nullable=False)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    started_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
+    finished_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
+
+
+class CreatorTopic(Base):
+    """FCM topic `creator_<uid>` of a large creator; followers are subscribed up to a follows.id watermark"""
+    __tablename__ = "creator_topics"
+    author_id: Mapped[int] = mapped_column(Integer, ForeignKey("users.id"), primary_key=True)
+    subscribed_through_follow_id: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
+    updated_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+class DeviceToken(Base):
+    """One FCM registration token per device; a user may have several"""
+    __tablename__ = "device_tokens"
+    __table_args__ = (
+        Index('ix_device_tokens_user_id', 'user_id'),
+        Index('ix_device_tokens_last_seen', 'last_seen'),
+    )
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    user_id: Mapped[int] = mapped_column(Integer, ForeignKey("users.id"), nullable=False)
+    token: Mapped[str] = mapped_column(String(512), unique=True, nullable=False)
+    platform: Mapped[str | None] = mapped_column(String(20), nullable=True)  # 'android' | 'ios' | 'web'
+    last_seen: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, nullable=False)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+
+
+class UserStat(Base):
+    """Materialized profile statistics, maintained through counters.record(db, "user_stats", ...)"""
+    __tablename__ = "user_stats"
+    user_id: Mapped[int] = mapped_column(Integer, ForeignKey("users.id"), primary_key=True)
+    products_count: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
+    total_likes: Mapped[int] = mapped_column(Integer, default=0, nullable=False)  # likes on the user's posts
+    saved_posts_count: Mapped[int] = mapped_column(Integer, default=0, nullable=False)  # posts the user bookmarked
+
+
+class CommentLike(Base):
+    __tablename__ = "comment_likes"
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    comment_id: Mapped[int] = mapped_column(Integer, ForeignKey("comments.id"), nullable=False)
+    user_id: Mapped[int] = mapped_column(Integer, ForeignKey("users.id"), nullable=False)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        UniqueConstraint('comment_id', 'user_id', name='uq_comment_like'),
+        Index('ix_comment_likes_user_id', 'user_id'),
+    )
+
+
+class CommentScore(Base):
+    """Precomputed "top comments" key per comment, maintained through counters.record(db, "comment", ...)"""
+    __tablename__ = "comment_scores"
+    comment_id: Mapped[int] = mapped_column(Integer, ForeignKey("comments.id"), primary_key=True)
+    post_id: Mapped[int] = mapped_column(Integer, ForeignKey("posts.id"), nullable=False)
+    likes_count: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
+
+    __table_args__ = (
+        # "top" ordering of a post's thread: ORDER BY likes_count DESC, comment_id DESC
+        Index('ix_comment_scores_post_likes', 'post_id', 'likes_count', 'comment_id'),
+    )
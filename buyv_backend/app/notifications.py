@@ -1,25 +1,28 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
 from sqlalchemy.orm import Session
+from typing import Optional
 from .database import get_db
 from .models import User, Notification
-from .auth import get_current_user
-from .schemas import NotificationCreate, NotificationOut
-from .firebase_service import FirebaseService, NotificationType
+from .auth import Principal, get_current_principal, get_current_user
+from .pagination import keyset_at_or_before, keyset_before, next_cursor_for, set_next_cursor
+from .schemas import CountResponse, MarkReadRequest, NotificationCreate, NotificationOut
+from . import devices, inbox, push_queue
 import json
-import logging
 
-logger = logging.getLogger(__name__)
 router = APIRouter(prefix="/notifications", tags=["notifications"])
 
+DEFAULT_PAGE_SIZE = 50
+
 
 @router.post("/", response_model=NotificationOut)
 def create_notification(payload: NotificationCreate, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
     """
     Create a notification for a target user.
-    Also sends a push notification if the user has an FCM token registered.
+    A push for each of the user's devices is queued in the outbox and
+    delivered by the push_queue workers (one multicast), not inside the request.
     """
     # Create notification for the target user by uid provided, defaulting to current user
-    target_uid = payload.userId or current_user.uid
+    target_uid = payload.user_id or current_user.uid
     target = db.query(User).filter(User.uid == target_uid).first()
     if not target:
         raise HTTPException(status_code=404, detail="User not found")
@@ -34,26 +37,26 @@ def create_notification(payload: NotificationCreate, db: Session = Depends(get_d
         data=json.dumps(payload.data or {}),
     )
     db.add(notif)
+    db.flush()
+    inbox.record_new(db, [target.id])
+    
+    # Queue the push in the same transaction as the notification row
+    tokens = devices.tokens_for(db, [target.id])
+    if tokens:
+        notification_data = dict(payload.data or {})
+        notification_data['notification_id'] = str(notif.id)
+        push_queue.enqueue(
+            db,
+            tokens,
+            title=payload.title,
+            body=payload.body,
+            data=notification_data,
+            notification_type=payload.type,
+            notification_id=notif.id,
+        )
     db.commit()
     db.refresh(notif)
-    
-    # Send push notification if user has FCM token
-    if target.fcm_token:
-        try:
-            notification_data = payload.data or {}
-            notification_data['notification_id'] = str(notif.id)
-            
-            FirebaseService.send_notification(
-                token=target.fcm_token,
-                title=payload.title,
-                body=payload.body,
-                data=notification_data,
-                notification_type=payload.type
-            )
-            logger.info(f"Push notification sent to user {target.uid}")
-        except Exception as e:
-            logger.error(f"Failed to send push notification: {e}")
-            # Don't fail the request if push notification fails
+    push_queue.wake()
     
     return NotificationOut(
         id=notif.id,
@@ -68,29 +71,71 @@ def create_notification(payload: NotificationCreate, db: Session = Depends(get_d
     )
 
 
+def _notification_out(row: Notification, user_uid: str) -> NotificationOut:
+    return NotificationOut(
+        id=row.id,
+        userId=user_uid,
+        title=row.title,
+        body=row.body,
+        type=row.type,
+        # Parse JSON string from DB
+        data=(json.loads(row.data) if row.data else {}),
+        isRead=row.is_read,
+        createdAt=row.created_at,
+    )
+
+
 @router.get("/me", response_model=list[NotificationOut])
-def list_my_notifications(db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
-    rows = db.query(Notification).filter(Notification.user_id == current_user.id).order_by(Notification.created_at.desc()).all()
-    return [
-        NotificationOut(
-            id=row.id,
-            userId=current_user.uid,
-            title=row.title,
-            body=row.body,
-            type=row.type,
-            # Parse JSON string from DB
-            data=(json.loads(row.data) if row.data else {}),
-            isRead=row.is_read,
-            createdAt=row.created_at,
-        ) for row in rows
-    ]
+def list_my_notifications(
+    response: Response,
+    unread_only: bool = Query(default=False),
+    limit: int = Query(default=DEFAULT_PAGE_SIZE, ge=1, le=200),
+    cursor: Optional[str] = Query(default=None, description="Opaque cursor from the X-Next-Cursor header"),
+    db: Session = Depends(get_db),
+    current_user: Principal = Depends(get_current_principal),
+):
+    """Newest first, one page at a time: callers that send no `limit` get the latest DEFAULT_PAGE_SIZE"""
+    # Served by ix_notifications_user_created (user_id, created_at, id)
+    query = db.query(Notification).filter(Notification.user_id == current_user.id)
+    if unread_only:
+        query = query.filter(Notification.is_read.is_(False))
+    if cursor:
+        query = query.filter(keyset_before(Notification.created_at, Notification.id, cursor))
+    rows = query.order_by(Notification.created_at.desc(), Notification.id.desc()).limit(limit).all()
+    set_next_cursor(response, next_cursor_for(rows, limit))
+    return [_notification_out(row, current_user.uid) for row in rows]
+
+
+@router.get("/me/unread-count", response_model=CountResponse)
+def my_unread_count(db: Session = Depends(get_db), current_user: Principal = Depends(get_current_principal)):
+    """Badge count from notification_unread (primary-key read, briefly cached)"""
+    return CountResponse(count=inbox.unread_count(db, current_user.id))
+
+
+@router.post("/me/read-all")
+def mark_all_as_read(
+    payload: MarkReadRequest | None = None,
+    db: Session = Depends(get_db),
+    current_user: Principal = Depends(get_current_principal),
+):
+    """Mark every notification up to `upToId` / `cursor` (or all) read with a single UPDATE"""
+    conditions = []
+    if payload and payload.up_to_id is not None:
+        conditions.append(Notification.id <= payload.up_to_id)
+    if payload and payload.cursor:
+        conditions.append(keyset_at_or_before(Notification.created_at, Notification.id, payload.cursor))
+    updated = inbox.mark_read(db, current_user.id, *conditions)
+    db.commit()
+    return {"status": "ok", "updated": updated}
 
 
 @router.post("/{notification_id}/read")
-def mark_as_read(notification_id: int, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
-    notif = db.query(Notification).filter(Notification.id == notification_id, Notification.user_id == current_user.id).first()
-    if not notif:
-        raise HTTPException(status_code=404, detail="Notification not found")
-    notif.is_read = True
+def mark_as_read(notification_id: int, db: Session = Depends(get_db), current_user: Principal = Depends(get_current_principal)):
+    if not inbox.mark_read(db, current_user.id, Notification.id == notification_id):
+        exists = db.query(Notification.id).filter(
+            Notification.id == notification_id, Notification.user_id == current_user.id
+        ).first()
+        if not exists:
+            raise HTTPException(status_code=404, detail="Notification not found")
     db.commit()
-    return {"status": "ok"}
\ No newline at end of file
+    return {"status": "ok"}
@@ -1,15 +1,24 @@
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
+from sqlalchemy import func, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session, selectinload
 from datetime import datetime
+from typing import Optional
 import json
+import secrets
 
 from .database import get_db
 from .models import User, Order, OrderItem, Commission
-from .auth import get_current_user
+from .auth import get_current_user, require_backoffice_key
+from .config import ORDER_BULK_CHUNK_SIZE
+from . import commission_states, ledger
+from .pagination import keyset_before, next_cursor_for, set_next_cursor
 from .schemas import (
     OrderCreate,
     OrderOut,
     OrderItemOut,
+    OrderSummaryOut,
+    BulkOrderStatusUpdate,
     StatusUpdate,
     TrackingUpdate,
     Address,
@@ -17,12 +26,44 @@ from .schemas import (
 
 router = APIRouter(prefix="/orders", tags=["orders"])
 
+DEFAULT_PAGE_SIZE = 50
+# Server-generated order numbers are retried this many times on a (very unlikely) collision
+ORDER_NUMBER_ATTEMPTS = 3
+# Promoter commission on promoted items; kept as a variable for future dynamic rates
+COMMISSION_RATE = 0.01
+
 
 def _generate_order_number() -> str:
+    # The old suffix was derived from the timestamp itself, so two checkouts in
+    # the same millisecond collided; the suffix is now random.
     ts = int(datetime.utcnow().timestamp() * 1000)
-    rand = ts % 10000
-    return f"ORD{ts}{rand}"
-
+    rand = secrets.randbelow(1_000_000)
+    return f"ORD{ts}{rand:06d}"
+
+
+def _order_number_taken(db: Session, order_number: str) -> bool:
+    return db.query(Order.id).filter(Order.order_number == order_number).first() is not None
+
+
+def _insert_order(db: Session, order: Order, generated_number: bool) -> None:
+    """Flush the order and its items; a taken order number is 409 (client) or regenerated (server)"""
+    for attempt in range(ORDER_NUMBER_ATTEMPTS):
+        try:
+            # Savepoint: a failed insert leaves the request transaction usable
+            with db.begin_nested():
+                db.add(order)
+                # One flush: the order row, then all items in a batched INSERT (ids needed below)
+                db.flush()
+            return
+        except IntegrityError:
+            # Anything but a duplicate order number (e.g. a foreign key) is a server error
+            if not _order_number_taken(db, order.order_number):
+                raise
+            if not generated_number:
+                raise HTTPException(status_code=409, detail="Order number already exists")
+            if attempt + 1 == ORDER_NUMBER_ATTEMPTS:
+                raise
+            order.order_number = _generate_order_number()
 
 
 def _map_order_item_out(item: OrderItem) -> dict:
@@ -45,7 +86,8 @@ def _map_order_item_out(item: OrderItem) -> dict:
     }
 
 
-def _map_order_out(order: Order, db: Session) -> dict:
+def _map_order_out(order: Order) -> dict:
+    """Expects `order.items` to be loaded already (selectinload) when mapping lists"""
     try:
         shipping_addr_dict = json.loads(order.shipping_address) if order.shipping_address else None
         # Align keys if stored differently in DB vs Schema alias expectations
@@ -60,7 +102,6 @@ def _map_order_out(order: Order, db: Session) -> dict:
     except Exception:
         shipping_addr_dict = None
 
-    user = db.query(User).filter(User.id == order.user_id).first()
     # order.user_id is int. Schema OrderOut.user_id is int. OrderOut.promoter_uid is string.
 
     return {
@@ -104,6 +145,8 @@ def create_order(
         json.dumps(payload.shipping_address.model_dump(by_alias=True)) if payload.shipping_address else None
     )
 
+    # Order, items and commissions are written in a single transaction:
+    # a request dying midway leaves nothing behind.
     order = Order(
         order_number=order_number,
         user_id=current_user.id,
@@ -119,15 +162,8 @@ def create_order(
         notes=payload.notes,
         promoter_uid=payload.promoter_id,
     )
-    db.add(order)
-    db.commit()
-    db.refresh(order)
-
-    # Add items
-    for item in payload.items:
-        attributes_json = json.dumps(item.attributes or {})
-        oi = OrderItem(
-            order_id=order.id,
+    order.items = [
+        OrderItem(
             product_id=item.product_id,
             product_name=item.product_name,
             product_image=item.product_image,
@@ -135,56 +171,122 @@ def create_order(
             quantity=item.quantity,
             size=item.size,
             color=item.color,
-            attributes=attributes_json,
+            attributes=json.dumps(item.attributes or {}),
             is_promoted_product=item.is_promoted_product,
             promoter_uid=item.promoter_id or payload.promoter_id,
         )
-        db.add(oi)
-    db.commit()
-    db.refresh(order)
-
-    # Generate commissions for promoted items
-    for item in order.items:
-        if item.is_promoted_product and item.promoter_uid:
-            promoter = db.query(User).filter(User.uid == item.promoter_uid).first()
-            rate = 0.01
-            amount = round(item.price * item.quantity * rate, 2)
-            commission = Commission(
-                user_id=promoter.id if promoter else None,
-                user_uid=item.promoter_uid,
-                order_id=order.id,
-                order_item_id=item.id,
-                product_id=item.product_id,
-                product_name=item.product_name,
-                product_price=item.price,
-                commission_rate=rate,
-                commission_amount=amount,
-                status="pending",
-                metadata_json=json.dumps({
-                    "orderId": str(order.id),
-                    "orderNumber": order.order_number,
-                    "orderItemId": str(item.id),
-                }),
-            )
-            db.add(commission)
+        for item in payload.items
+    ]
+    _insert_order(db, order, generated_number=not payload.order_number)
+
+    # Generate commissions for promoted items; all promoters resolved in one IN query
+    promoted = [item for item in order.items if item.is_promoted_product and item.promoter_uid]
+    promoter_ids = {}
+    if promoted:
+        promoter_ids = dict(
+            db.query(User.uid, User.id)
+            .filter(User.uid.in_({item.promoter_uid for item in promoted}))
+            .all()
+        )
+    commissions = [
+        Commission(
+            user_id=promoter_ids.get(item.promoter_uid),
+            user_uid=item.promoter_uid,
+            order_id=order.id,
+            order_item_id=item.id,
+            product_id=item.product_id,
+            product_name=item.product_name,
+            product_price=item.price,
+            commission_rate=COMMISSION_RATE,
+            commission_amount=round(item.price * item.quantity * COMMISSION_RATE, 2),
+            status="pending",
+            metadata_json=json.dumps({
+                "orderId": str(order.id),
+                "orderNumber": order.order_number,
+                "orderItemId": str(item.id),
+            }),
+        )
+        for item in promoted
+    ]
+    db.add_all(commissions)
+    ledger.record_created(db, commissions)
+    # Map before committing: every value is already known, no reload needed afterwards
+    out = _map_order_out(order)
     db.commit()
-    db.refresh(order)
-
-    return _map_order_out(order, db)
+    return out
+
+
+def _list_orders(
+    db: Session,
+    response: Response,
+    user_id: int,
+    status: Optional[str],
+    limit: Optional[int],
+    cursor: Optional[str],
+) -> list[dict]:
+    """Orders + items in two queries (orders page, then one IN query for their items)"""
+    query = (
+        db.query(Order)
+        .options(selectinload(Order.items))
+        .filter(Order.user_id == user_id)
+    )
+    if status:
+        query = query.filter(Order.status == status)
+    if cursor:
+        query = query.filter(keyset_before(Order.created_at, Order.id, cursor))
+        limit = limit or DEFAULT_PAGE_SIZE
+    query = query.order_by(Order.created_at.desc(), Order.id.desc())
+    if limit is None:
+        # Legacy contract: no limit/cursor returns the full history
+        rows = query.all()
+    else:
+        rows = query.limit(limit).all()
+        set_next_cursor(response, next_cursor_for(rows, limit))
+    return [_map_order_out(row) for row in rows]
 
 
 @router.get("/me", response_model=list[OrderOut])
 def list_my_orders(
+    response: Response,
+    limit: Optional[int] = Query(default=None, ge=1, le=200),
+    cursor: Optional[str] = Query(default=None, description="Opaque cursor from the X-Next-Cursor header"),
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user),
 ):
-    rows = (
-        db.query(Order)
-        .filter(Order.user_id == current_user.id)
-        .order_by(Order.created_at.desc())
-        .all()
+    return _list_orders(db, response, current_user.id, None, limit, cursor)
+
+
+@router.get("/me/summary", response_model=list[OrderSummaryOut])
+def list_my_order_summaries(
+    response: Response,
+    status: Optional[str] = Query(default=None),
+    limit: int = Query(default=DEFAULT_PAGE_SIZE, ge=1, le=200),
+    cursor: Optional[str] = Query(default=None, description="Opaque cursor from the X-Next-Cursor header"),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+):
+    """Order history without items / address JSON: one query, no JSON parsing"""
+    item_count = (
+        select(func.count(OrderItem.id))
+        .where(OrderItem.order_id == Order.id)
+        .scalar_subquery()
     )
-    return [_map_order_out(row, db) for row in rows]
+    query = db.query(
+        Order.id,
+        Order.order_number,
+        Order.status,
+        Order.total,
+        Order.created_at,
+        Order.tracking_number,
+        item_count.label("item_count"),
+    ).filter(Order.user_id == current_user.id)
+    if status:
+        query = query.filter(Order.status == status)
+    if cursor:
+        query = query.filter(keyset_before(Order.created_at, Order.id, cursor))
+    rows = query.order_by(Order.created_at.desc(), Order.id.desc()).limit(limit).all()
+    set_next_cursor(response, next_cursor_for(rows, limit))
+    return [OrderSummaryOut.model_validate(row._mapping) for row in rows]
 
 
 @router.get("/{order_id}", response_model=OrderOut)
@@ -195,27 +297,40 @@ def get_order(
 ):
     order = (
         db.query(Order)
+        .options(selectinload(Order.items))
         .filter(Order.id == order_id, Order.user_id == current_user.id)
         .first()
     )
     if not order:
         raise HTTPException(status_code=404, detail="Order not found")
-    return _map_order_out(order, db)
+    return _map_order_out(order)
 
 
 @router.get("/me/by_status", response_model=list[OrderOut])
 def list_my_orders_by_status(
     status: str,
+    response: Response,
+    limit: Optional[int] = Query(default=None, ge=1, le=200),
+    cursor: Optional[str] = Query(default=None, description="Opaque cursor from the X-Next-Cursor header"),
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user),
 ):
-    rows = (
-        db.query(Order)
-        .filter(Order.user_id == current_user.id, Order.status == status)
-        .order_by(Order.created_at.desc())
-        .all()
-    )
-    return [_map_order_out(row, db) for row in rows]
+    return _list_orders(db, response, current_user.id, status, limit, cursor)
+
+
+@router.post("/bulk/status", dependencies=[Depends(require_backoffice_key)])
+def bulk_update_status(payload: BulkOrderStatusUpdate, db: Session = Depends(get_db)):
+    """Back-office / carrier webhook: set the status of many orders in one transaction"""
+    order_ids = set(payload.order_ids)
+    numbers = list(set(payload.order_numbers))
+    for start in range(0, len(numbers), ORDER_BULK_CHUNK_SIZE):
+        chunk = numbers[start:start + ORDER_BULK_CHUNK_SIZE]
+        order_ids.update(oid for (oid,) in db.query(Order.id).filter(Order.order_number.in_(chunk)).all())
+    if not order_ids:
+        raise HTTPException(status_code=404, detail="No matching orders")
+    updated = commission_states.set_order_status(db, order_ids, payload.status)
+    db.commit()
+    return {"status": "ok", "ordersUpdated": updated["orders"], "commissionsUpdated": updated["commissions"]}
 
 
 @router.patch("/{order_id}/status")
@@ -236,26 +351,14 @@ def update_status(
     order.status = payload.status
     order.updated_at = datetime.utcnow()
     db.add(order)
+
+    # Update commission status based on order status, in the same transaction
+    # as the order and the promoter balances (see commission_states.py)
+    target = commission_states.target_for_order_status(payload.status)
+    if target:
+        commission_states.transition_orders(db, [order.id], target)
     db.commit()
 
-    # Update commission status based on order status
-    if payload.status.lower() == "delivered":
-        commissions = db.query(Commission).filter(Commission.order_id == order.id).all()
-        for c in commissions:
-            c.status = "paid"
-            c.paid_at = datetime.utcnow()
-            c.updated_at = datetime.utcnow()
-            db.add(c)
-        db.commit()
-    elif payload.status.lower() == "canceled":
-        commissions = db.query(Commission).filter(Commission.order_id == order.id).all()
-        for c in commissions:
-            c.status = "canceled"
-            c.updated_at = datetime.utcnow()
-            db.add(c)
-        db.commit()
-
-    db.refresh(order)
     return {"status": "ok"}
 
 
@@ -276,13 +379,7 @@ def cancel_order(
     order.status = "canceled"
     order.updated_at = datetime.utcnow()
     db.add(order)
-    db.commit()
-
-    commissions = db.query(Commission).filter(Commission.order_id == order.id).all()
-    for c in commissions:
-        c.status = "canceled"
-        c.updated_at = datetime.utcnow()
-        db.add(c)
+    commission_states.transition_orders(db, [order.id], "canceled")
     db.commit()
 
     return {"status": "ok"}
@@ -0,0 +1,72 @@
+"""
+Keyset (cursor) pagination helpers.
+
+A cursor is an opaque, URL-safe token wrapping the sort key of the last row
+of a page, e.g. (created_at, id). The next page is fetched with a
+`WHERE (created_at, id) < (:ts, :id)` predicate instead of OFFSET, so page N
+costs the same as page 1 as long as the sort columns are indexed.
+"""
+import base64
+import json
+from datetime import datetime
+from typing import Optional, Tuple
+
+from fastapi import HTTPException, Response
+from sqlalchemy import and_, or_
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+def encode_cursor(created_at: datetime, row_id: int) -> str:
+    raw = json.dumps([created_at.isoformat(), row_id], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        ts, row_id = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        return datetime.fromisoformat(ts), int(row_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def keyset_before(created_col, id_col, cursor: str):
+    """Filter for rows strictly after `cursor` in (created_at DESC, id DESC) order"""
+    ts, row_id = decode_cursor(cursor)
+    return or_(created_col < ts, and_(created_col == ts, id_col < row_id))
+
+
+def keyset_at_or_before(created_col, id_col, cursor: str):
+    """Filter for the row at `cursor` and every row after it in (created_at DESC, id DESC) order"""
+    ts, row_id = decode_cursor(cursor)
+    return or_(created_col < ts, and_(created_col == ts, id_col <= row_id))
+
+
+def encode_score_cursor(score: int, row_id: int) -> str:
+    raw = json.dumps([score, row_id], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def keyset_below(score_col, id_col, cursor: str):
+    """Filter for rows strictly after `cursor` in (score DESC, id DESC) order"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        score, row_id = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        score, row_id = int(score), int(row_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return or_(score_col < score, and_(score_col == score, id_col < row_id))
+
+
+def next_cursor_for(rows: list, limit: int, created_attr: str = "created_at", id_attr: str = "id") -> Optional[str]:
+    """Cursor pointing past the last row, or None when the page was not full"""
+    if len(rows) < limit:
+        return None
+    last = rows[-1]
+    return encode_cursor(getattr(last, created_attr), getattr(last, id_attr))
+
+
+def set_next_cursor(response: Response, cursor: Optional[str]) -> None:
+    if cursor:
+        response.headers[NEXT_CURSOR_HEADER] = cursor
@@ -1,12 +1,18 @@
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
+from sqlalchemy import func
 from sqlalchemy.orm import Session
 from typing import List, Optional
 from datetime import datetime
 
 from .database import get_db
-from .models import User, Post, PostLike, PostBookmark
-from .auth import get_current_user, get_current_user_optional
+from .async_database import DbRunner, get_db_runner
+from .replicas import get_read_db, get_read_db_runner
+from .models import Comment, User, Post, PostLike, PostBookmark
+from .auth import Principal, get_current_principal, get_current_user, get_current_user_optional, get_current_writer
 from .schemas import PostOut, CountResponse, PostCreate
+from .pagination import keyset_before, next_cursor_for, set_next_cursor
+from . import actions, comments, counters, fanout, search, timeline, viewer
+from .hydration import hydrate_post_uids, hydrate_posts, invalidate_post, prime_post
 
 router = APIRouter(prefix="/posts", tags=["posts"])
 
@@ -56,80 +62,84 @@ def create_post(
         likes_count=0,
     )
     db.add(row)
-    # Update counters for reels
+    # Update counters for reels / products
     if post_type == "reel":
-        current_user.reels_count = (current_user.reels_count or 0) + 1
+        counters.record(db, "user", current_user.id, "reels_count", 1)
+    elif post_type == "product":
+        counters.record(db, "user_stats", current_user.id, "products_count", 1)
+    db.flush()
+    timeline.fan_out_post(db, row, current_user)
+    search.index_post(db, row)
+    # Follower notifications are written in the background (see fanout.py)
+    fanout.enqueue_post(db, row)
     db.commit()
     db.refresh(row)
+    prime_post(row)
+    fanout.wake()
     return _map_post_out(row, current_user, liked=False)
 
 
 @router.get("/feed", response_model=List[PostOut])
-def get_feed(
+async def get_feed(
+    response: Response,
     limit: int = Query(default=20, ge=1, le=100),
     offset: int = Query(default=0, ge=0),
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user),
+    cursor: Optional[str] = Query(default=None, description="Opaque cursor from the X-Next-Cursor header"),
+    following: bool = Query(default=False, description="Home timeline of followed accounts instead of the global feed"),
+    db: DbRunner = Depends(get_read_db_runner),
+    current_user: Principal = Depends(get_current_principal),
 ):
-    # Global feed for now
-    rows = (
-        db.query(Post)
-        .order_by(Post.created_at.desc())
-        .offset(offset)
-        .limit(limit)
-        .all()
-    )
-    
-    if not rows:
-        return []
-
-    # Fetch authors
-    user_ids = list({p.user_id for p in rows})
-    users = db.query(User).filter(User.id.in_(user_ids)).all()
-    user_map = {u.id: u for u in users}
-
-    # Fetch my likes and bookmarks
-    post_ids = [r.id for r in rows]
-    my_likes = db.query(PostLike).filter(PostLike.user_id == current_user.id, PostLike.post_id.in_(post_ids)).all()
-    liked_post_ids = {l.post_id for l in my_likes}
-
-    my_bookmarks = db.query(PostBookmark).filter(PostBookmark.user_id == current_user.id, PostBookmark.post_id.in_(post_ids)).all()
-    bookmarked_post_ids = {b.post_id for b in my_bookmarks}
-
-    out = []
-    for r in rows:
-        author = user_map.get(r.user_id)
-        if author:
-            is_liked = r.id in liked_post_ids
-            is_bookmarked = r.id in bookmarked_post_ids
-            out.append(_map_post_out(r, author, liked=is_liked, bookmarked=is_bookmarked))
-    
-    return out
+    return await db.run(_feed, response, current_user.id, limit, offset, cursor, following)
+
+
+def _feed(db: Session, response: Response, viewer_id: int, limit: int, offset: int,
+          cursor: Optional[str], following: bool) -> List[PostOut]:
+    if following:
+        # Precomputed inbox (see timeline.py), always cursor-paginated
+        post_ids, next_cursor = timeline.read_timeline(db, viewer_id, limit, cursor)
+        set_next_cursor(response, next_cursor)
+        return hydrate_posts(db, post_ids, viewer_id=viewer_id)
+
+    # Global feed: only the sort keys are read here, bodies come from the hydration cache
+    query = db.query(Post.id, Post.uid, Post.created_at).order_by(Post.created_at.desc(), Post.id.desc())
+    if cursor:
+        # Keyset mode: seek past the cursor via ix_posts_created_at_id, offset is ignored
+        query = query.filter(keyset_before(Post.created_at, Post.id, cursor))
+    else:
+        # Legacy limit/offset contract for older app builds
+        query = query.offset(offset)
+    rows = query.limit(limit).all()
+    set_next_cursor(response, next_cursor_for(rows, limit))
+    return hydrate_post_uids(db, [r.uid for r in rows], viewer_id=viewer_id)
+
+
+@router.get("/search", response_model=List[PostOut])
+def search_posts(
+    q: str = Query(..., min_length=1, description="Search query"),
+    type: Optional[str] = Query(default=None, description="Filter by post type: reel, product, photo"),
+    limit: int = Query(default=20, ge=1, le=100),
+    offset: int = Query(default=0, ge=0),
+    db: Session = Depends(get_read_db),
+    current_user: Optional[User] = Depends(get_current_user_optional),
+):
+    """Search posts by caption with pagination (full-text, ranked, prefix matching)"""
+    if type not in {"reel", "product", "photo"}:
+        type = None
+    uids = search.search_post_uids(db, q, type, limit, offset)
+    return hydrate_post_uids(db, uids, viewer_id=current_user.id if current_user else None)
 
 
 @router.get("/{post_uid}", response_model=PostOut)
-def get_post(
+async def get_post(
     post_uid: str,
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user),
+    db: DbRunner = Depends(get_read_db_runner),
+    current_user: Principal = Depends(get_current_principal),
 ):
     """Get a single post by its UID"""
-    post = db.query(Post).filter(Post.uid == post_uid).first()
-    if not post:
+    out = await db.run(hydrate_post_uids, [post_uid], viewer_id=current_user.id)
+    if not out:
         raise HTTPException(status_code=404, detail="Post not found")
-    
-    # Get the author
-    author = db.query(User).filter(User.id == post.user_id).first()
-    if not author:
-        raise HTTPException(status_code=404, detail="Post author not found")
-    
-    # Check if current user liked this post
-    liked = db.query(PostLike).filter(
-        PostLike.user_id == current_user.id,
-        PostLike.post_id == post.id
-    ).first() is not None
-    
-    return _map_post_out(post, author, liked=liked)
+    return out[0]
 
 
 @router.get("/user/{uid}", response_model=List[PostOut])
@@ -138,12 +148,12 @@ def list_user_posts(
     type: Optional[str] = Query(default=None),
     limit: int = Query(default=20, ge=1, le=100),
     offset: int = Query(default=0, ge=0),
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_read_db),
 ):
     user = db.query(User).filter(User.uid == uid).first()
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
-    q = db.query(Post).filter(Post.user_id == user.id)
+    q = db.query(Post.uid).filter(Post.user_id == user.id)
     if type:
         q = q.filter(Post.type == type)
     rows = (
@@ -152,7 +162,7 @@ def list_user_posts(
         .limit(limit)
         .all()
     )
-    return [_map_post_out(row, user) for row in rows]
+    return hydrate_post_uids(db, [r.uid for r in rows])
 
 
 @router.get("/user/{uid}/liked", response_model=List[PostOut])
@@ -166,43 +176,22 @@ def list_user_liked_posts(
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     like_rows = (
-        db.query(PostLike)
+        db.query(PostLike.post_id)
         .filter(PostLike.user_id == user.id)
         .order_by(PostLike.created_at.desc())
         .offset(offset)
         .limit(limit)
         .all()
     )
-    post_ids = [r.post_id for r in like_rows]
-    if not post_ids:
-        return []
-    posts = db.query(Post).filter(Post.id.in_(post_ids)).all()
     # Preserve order according to like_rows
-    post_map = {p.id: p for p in posts}
-    
-    # We need to fetch users for these posts if they belong to others.
-    # Optimization: Fetch all authors.
-    author_ids = list({p.user_id for p in posts})
-    authors = db.query(User).filter(User.id.in_(author_ids)).all()
-    author_map = {a.id: a for a in authors}
-
-    out: List[PostOut] = []
-    for lr in like_rows:
-        p = post_map.get(lr.post_id)
-        if p is None:
-            continue
-        author = author_map.get(p.user_id)
-        if author:
-            item = _map_post_out(p, author, liked=True)
-            out.append(item)
-    return out
+    return hydrate_posts(db, [r.post_id for r in like_rows], all_liked=True)
 
 
 @router.get("/user/{uid}/count", response_model=CountResponse)
 def count_user_posts(
     uid: str,
     type: Optional[str] = Query(default=None),
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_read_db),
 ):
     user = db.query(User).filter(User.uid == uid).first()
     if not user:
@@ -220,7 +209,7 @@ def list_user_bookmarked_posts(
     limit: int = Query(default=20, ge=1, le=100),
     offset: int = Query(default=0, ge=0),
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_principal),
 ):
     user = db.query(User).filter(User.uid == uid).first()
     if not user:
@@ -232,213 +221,92 @@ def list_user_bookmarked_posts(
         raise HTTPException(status_code=403, detail="Not allowed to view other users' bookmarks")
 
     bookmark_rows = (
-        db.query(PostBookmark)
+        db.query(PostBookmark.post_id)
         .filter(PostBookmark.user_id == user.id)
         .order_by(PostBookmark.created_at.desc())
         .offset(offset)
         .limit(limit)
         .all()
     )
-    post_ids = [r.post_id for r in bookmark_rows]
-    if not post_ids:
-        return []
-    
-    posts = db.query(Post).filter(Post.id.in_(post_ids)).all()
-    post_map = {p.id: p for p in posts}
-    
-    # Fetch authors
-    author_ids = list({p.user_id for p in posts})
-    authors = db.query(User).filter(User.id.in_(author_ids)).all()
-    author_map = {a.id: a for a in authors}
-
-    # Fetch likes status for these posts for the current user
-    my_likes = db.query(PostLike).filter(
-        PostLike.user_id == current_user.id, 
-        PostLike.post_id.in_(post_ids)
-    ).all()
-    liked_post_ids = {l.post_id for l in my_likes}
-
-    out: List[PostOut] = []
-    for br in bookmark_rows:
-        p = post_map.get(br.post_id)
-        if p is None:
-            continue
-        author = author_map.get(p.user_id)
-        if author:
-            is_liked = p.id in liked_post_ids
-            # Note: is_bookmarked is implicitly true since we are in the bookmarked list
-            item = _map_post_out(p, author, liked=is_liked, bookmarked=True)
-            out.append(item)
-    return out
+    # is_bookmarked is implicitly true since we are in the bookmarked list
+    return hydrate_posts(
+        db, [r.post_id for r in bookmark_rows], viewer_id=current_user.id, all_bookmarked=True
+    )
 
 
-@router.get("/search", response_model=List[PostOut])
-def search_posts(
-    q: str = Query(..., min_length=1, description="Search query"),
-    type: Optional[str] = Query(default=None, description="Filter by post type: reel, product, photo"),
-    limit: int = Query(default=20, ge=1, le=100),
-    offset: int = Query(default=0, ge=0),
-    db: Session = Depends(get_db),
-    current_user: Optional[User] = Depends(get_current_user_optional),
-):
-    """Search posts by caption with pagination"""
-    search_pattern = f"%{q}%"
-    
-    # Base query
-    query = db.query(Post).filter(Post.caption.ilike(search_pattern))
-    
-    # Filter by type if provided
-    if type and type in {"reel", "product", "photo"}:
-        query = query.filter(Post.type == type)
-    
-    # Apply pagination
-    rows = (
-        query.order_by(Post.created_at.desc())
-        .offset(offset)
-        .limit(limit)
-        .all()
-    )
-    
-    if not rows:
-        return []
-    
-    # Fetch authors
-    user_ids = list({p.user_id for p in rows})
-    users = db.query(User).filter(User.id.in_(user_ids)).all()
-    user_map = {u.id: u for u in users}
-    
-    # Fetch likes if user is authenticated
-    liked_post_ids = set()
-    if current_user:
-        post_ids = [r.id for r in rows]
-        my_likes = db.query(PostLike).filter(
-            PostLike.user_id == current_user.id,
-            PostLike.post_id.in_(post_ids)
-        ).all()
-        liked_post_ids = {l.post_id for l in my_likes}
-    
-    # Map to output
-    out = []
-    for r in rows:
-        author = user_map.get(r.user_id)
-        if author:
-            is_liked = r.id in liked_post_ids
-            out.append(_map_post_out(r, author, liked=is_liked))
-    
-    return out
+def _write(db: Session, writer, post_uid: str, user_id: int):
+    """Apply one idempotent write from actions.py to a post; returns the changed post ids"""
+    post = db.query(Post.id, Post.user_id).filter(Post.uid == post_uid).first()
+    if not post:
+        raise HTTPException(status_code=404, detail="Post not found")
+    with actions.rejecting_missing_rows(db, user_id, "Post not found"):
+        changed = writer(db, user_id, [post])
+        db.commit()
+    return changed
 
 
 @router.post("/{post_uid}/like")
-def like_post(
+async def like_post(
     post_uid: str,
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user),
+    db: DbRunner = Depends(get_db_runner),
+    current_user: Principal = Depends(get_current_writer),
 ):
-    post = db.query(Post).filter(Post.uid == post_uid).first()
-    if not post:
-        raise HTTPException(status_code=404, detail="Post not found")
-    existing = db.query(PostLike).filter(PostLike.post_id == post.id, PostLike.user_id == current_user.id).first()
-    if existing:
-        return {"status": "already_liked"}
-    like = PostLike(post_id=post.id, user_id=current_user.id)
-    db.add(like)
-    post.likes_count = (post.likes_count or 0) + 1
-    db.commit()
-    return {"status": "liked"}
+    changed = await db.run(_write, actions.add_likes, post_uid, current_user.id)
+    return {"status": "liked" if changed else "already_liked"}
 
 
 @router.delete("/{post_uid}/like")
-def unlike_post(
+async def unlike_post(
     post_uid: str,
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user),
+    db: DbRunner = Depends(get_db_runner),
+    current_user: Principal = Depends(get_current_writer),
 ):
-    post = db.query(Post).filter(Post.uid == post_uid).first()
-    if not post:
-        raise HTTPException(status_code=404, detail="Post not found")
-    existing = db.query(PostLike).filter(PostLike.post_id == post.id, PostLike.user_id == current_user.id).first()
-    if not existing:
-        return {"status": "not_liked"}
-    db.delete(existing)
-    post.likes_count = max(0, (post.likes_count or 0) - 1)
-    db.commit()
-    return {"status": "unliked"}
+    changed = await db.run(_write, actions.remove_likes, post_uid, current_user.id)
+    return {"status": "unliked" if changed else "not_liked"}
 
 
 @router.get("/{post_uid}/is_liked")
-def is_post_liked(
+async def is_post_liked(
     post_uid: str,
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user),
+    db: DbRunner = Depends(get_db_runner),
+    current_user: Principal = Depends(get_current_principal),
 ):
-    post = db.query(Post).filter(Post.uid == post_uid).first()
-    if not post:
+    state = (await db.run(viewer.post_states, current_user.id, [post_uid])).get(post_uid)
+    if state is None:
         raise HTTPException(status_code=404, detail="Post not found")
-    existing = db.query(PostLike).filter(PostLike.post_id == post.id, PostLike.user_id == current_user.id).first()
-    return {"isLiked": existing is not None}
+    return {"isLiked": state.is_liked}
 
 
 @router.post("/{post_uid}/bookmark")
-def bookmark_post(
+async def bookmark_post(
     post_uid: str,
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user),
+    db: DbRunner = Depends(get_db_runner),
+    current_user: Principal = Depends(get_current_writer),
 ):
-    post = db.query(Post).filter(Post.uid == post_uid).first()
-    if not post:
-        raise HTTPException(status_code=404, detail="Post not found")
-    
-    existing = db.query(PostBookmark).filter(
-        PostBookmark.post_id == post.id,
-        PostBookmark.user_id == current_user.id
-    ).first()
-    
-    if existing:
-        return {"status": "already_bookmarked"}
-    
-    bookmark = PostBookmark(post_id=post.id, user_id=current_user.id)
-    db.add(bookmark)
-    db.commit()
-    return {"status": "bookmarked"}
+    changed = await db.run(_write, actions.add_bookmarks, post_uid, current_user.id)
+    return {"status": "bookmarked" if changed else "already_bookmarked"}
 
 
 @router.delete("/{post_uid}/bookmark")
-def unbookmark_post(
+async def unbookmark_post(
     post_uid: str,
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user),
+    db: DbRunner = Depends(get_db_runner),
+    current_user: Principal = Depends(get_current_writer),
 ):
-    post = db.query(Post).filter(Post.uid == post_uid).first()
-    if not post:
-        raise HTTPException(status_code=404, detail="Post not found")
-    
-    existing = db.query(PostBookmark).filter(
-        PostBookmark.post_id == post.id,
-        PostBookmark.user_id == current_user.id
-    ).first()
-    
-    if not existing:
-        return {"status": "not_bookmarked"}
-    
-    db.delete(existing)
-    db.commit()
-    return {"status": "unbookmarked"}
+    changed = await db.run(_write, actions.remove_bookmarks, post_uid, current_user.id)
+    return {"status": "unbookmarked" if changed else "not_bookmarked"}
 
 
 @router.get("/{post_uid}/is_bookmarked")
-def is_post_bookmarked(
+async def is_post_bookmarked(
     post_uid: str,
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user),
+    db: DbRunner = Depends(get_db_runner),
+    current_user: Principal = Depends(get_current_principal),
 ):
-    post = db.query(Post).filter(Post.uid == post_uid).first()
-    if not post:
+    state = (await db.run(viewer.post_states, current_user.id, [post_uid])).get(post_uid)
+    if state is None:
         raise HTTPException(status_code=404, detail="Post not found")
-    existing = db.query(PostBookmark).filter(
-        PostBookmark.post_id == post.id,
-        PostBookmark.user_id == current_user.id
-    ).first()
-    return {"isBookmarked": existing is not None}
+    return {"isBookmarked": state.is_bookmarked}
 
 
 @router.delete("/{post_uid}")
@@ -453,8 +321,23 @@ def delete_post(
     if post.user_id != current_user.id:
         raise HTTPException(status_code=403, detail="Not allowed")
     post_type = post.type
+    timeline.remove_post(db, post.id)
+    search.unindex_posts(db, post.id)
+    # The post's likes go with it (cascade); bookmarks are removed here
+    likes = db.query(func.count(PostLike.id)).filter(PostLike.post_id == post.id).scalar()
+    # One INSERT ... SELECT of -1 deltas, however many users saved the post
+    counters.record_each(
+        db, "user_stats", PostBookmark.user_id, "saved_posts_count", -1, PostBookmark.post_id == post.id
+    )
+    db.query(PostBookmark).filter(PostBookmark.post_id == post.id).delete(synchronize_session=False)
+    comments.remove_comments(db, Comment.post_id == post.id)
     db.delete(post)
     if post_type == "reel":
-        current_user.reels_count = max(0, (current_user.reels_count or 0) - 1)
+        counters.record(db, "user", current_user.id, "reels_count", -1)
+    elif post_type == "product":
+        counters.record(db, "user_stats", current_user.id, "products_count", -1)
+    if likes:
+        counters.record(db, "user_stats", current_user.id, "total_likes", -likes)
     db.commit()
+    invalidate_post(post_uid)
     return {"status": "deleted"}
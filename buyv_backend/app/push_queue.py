@@ -0,0 +1,400 @@
+"""
+Outbound push notification queue.
+
+Request handlers never talk to FCM. They call `enqueue()`, which writes one
+`notification_outbox` row per device token in the caller's transaction, and
+`wake()` after committing. Background delivery threads (PUSH_WORKERS per API
+worker):
+
+- claim due rows with a lease (FOR UPDATE SKIP LOCKED on PostgreSQL), so
+  several processes can deliver concurrently and rows of a crashed worker
+  are retried once the lease expires;
+- coalesce identical messages into FCM batch calls of up to PUSH_BATCH_SIZE
+  (500) tokens;
+- delete delivered rows, retry transient failures with exponential backoff
+  up to PUSH_MAX_ATTEMPTS, and prune tokens FCM reports as unregistered
+  (one batch delete through `devices.prune`).
+
+The FCM call goes through a transport object; `FakeFcmTransport` records
+batches in memory for tests (`set_transport(FakeFcmTransport())`).
+"""
+import json
+import logging
+import random
+import threading
+from collections import defaultdict
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Set
+
+from sqlalchemy import delete, or_, select, update
+from sqlalchemy.orm import Session
+
+from . import devices
+from .config import (
+    PUSH_BATCH_SIZE,
+    PUSH_CLAIM_SIZE,
+    PUSH_LEASE_SECONDS,
+    PUSH_MAX_ATTEMPTS,
+    PUSH_POLL_INTERVAL_SECONDS,
+    PUSH_RETRY_BASE_SECONDS,
+    PUSH_RETRY_MAX_SECONDS,
+    PUSH_WORKERS,
+)
+from .database import SessionLocal
+from .firebase_service import FirebaseService
+from .models import NotificationOutbox
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class BatchResult:
+    delivered: List[str] = field(default_factory=list)
+    # Tokens FCM reports as no longer registered: pruned, never retried
+    invalid: List[str] = field(default_factory=list)
+    # Transient failures: retried with backoff
+    failed: Dict[str, str] = field(default_factory=dict)
+
+
+class FirebaseTransport:
+    """Delivers through the Firebase Admin SDK (send_each_for_multicast)"""
+
+    def available(self) -> bool:
+        if not FirebaseService.is_initialized():
+            FirebaseService.initialize()
+        return FirebaseService.is_initialized()
+
+    def send(self, tokens: List[str], title: str, body: str, data: dict, notification_type: str) -> BatchResult:
+        from firebase_admin import messaging
+
+        result = BatchResult()
+        errors = FirebaseService.send_each(tokens, title, body, data, notification_type)
+        for token, error in zip(tokens, errors):
+            if error is None:
+                result.delivered.append(token)
+            elif isinstance(error, (messaging.UnregisteredError, messaging.SenderIdMismatchError)):
+                result.invalid.append(token)
+            else:
+                result.failed[token] = str(error)
+        return result
+
+
+    def send_topic(self, topic: str, title: str, body: str, data: dict, notification_type: str) -> bool:
+        return FirebaseService.send_to_topic(topic, title, body, data, notification_type)
+
+    def subscribe(self, tokens: List[str], topic: str) -> int:
+        """Returns how many tokens were subscribed"""
+        from firebase_admin import messaging
+
+        return messaging.subscribe_to_topic(tokens, topic).success_count
+
+    def unsubscribe(self, tokens: List[str], topic: str) -> int:
+        from firebase_admin import messaging
+
+        return messaging.unsubscribe_from_topic(tokens, topic).success_count
+
+
+class FakeFcmTransport:
+    """In-memory transport for tests: records every batch instead of calling FCM"""
+
+    def __init__(self, invalid_tokens: Iterable[str] = (), fail_tokens: Iterable[str] = ()):
+        self.batches: List[dict] = []
+        self.invalid_tokens: Set[str] = set(invalid_tokens)
+        self.fail_tokens: Set[str] = set(fail_tokens)
+        self.topic_messages: List[dict] = []
+        self.topics: Dict[str, Set[str]] = {}
+
+    def available(self) -> bool:
+        return True
+
+    def send(self, tokens: List[str], title: str, body: str, data: dict, notification_type: str) -> BatchResult:
+        self.batches.append({
+            "tokens": list(tokens), "title": title, "body": body, "data": data, "type": notification_type,
+        })
+        result = BatchResult()
+        for token in tokens:
+            if token in self.invalid_tokens:
+                result.invalid.append(token)
+            elif token in self.fail_tokens:
+                result.failed[token] = "fake transient failure"
+            else:
+                result.delivered.append(token)
+        return result
+
+    def send_topic(self, topic: str, title: str, body: str, data: dict, notification_type: str) -> bool:
+        self.topic_messages.append({"topic": topic, "title": title, "body": body, "data": data, "type": notification_type})
+        return True
+
+    def subscribe(self, tokens: List[str], topic: str) -> int:
+        self.topics.setdefault(topic, set()).update(tokens)
+        return len(tokens)
+
+    def unsubscribe(self, tokens: List[str], topic: str) -> int:
+        self.topics.setdefault(topic, set()).difference_update(tokens)
+        return len(tokens)
+
+    @property
+    def sent_tokens(self) -> List[str]:
+        return [t for batch in self.batches for t in batch["tokens"] if t not in self.invalid_tokens | self.fail_tokens]
+
+
+_transport = FirebaseTransport()
+
+
+def set_transport(transport) -> None:
+    global _transport
+    _transport = transport
+
+
+def get_transport():
+    return _transport
+
+
+class _Stats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.enqueued = 0
+        self.delivered = 0
+        self.retried = 0
+        self.failed = 0
+        self.pruned_tokens = 0
+        self.skipped = 0
+        self.batches = 0
+
+    def add(self, **counts: int) -> None:
+        with self._lock:
+            for name, value in counts.items():
+                setattr(self, name, getattr(self, name) + value)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "enqueued": self.enqueued,
+                "delivered": self.delivered,
+                "retried": self.retried,
+                "failed": self.failed,
+                "pruned_tokens": self.pruned_tokens,
+                "skipped": self.skipped,
+                "batches": self.batches,
+            }
+
+
+_stats = _Stats()
+
+
+def enqueue(
+    db: Session,
+    tokens: Iterable[Optional[str]],
+    title: str,
+    body: str,
+    data: Optional[dict] = None,
+    notification_type: str = "general",
+    notification_id: Optional[int] = None,
+) -> int:
+    """Queue one push per token in the caller's transaction; call wake() after commit"""
+    tokens = list(dict.fromkeys(t for t in tokens if t))
+    if not tokens:
+        return 0
+    payload = json.dumps(data or {})
+    db.add_all([
+        NotificationOutbox(
+            token=token,
+            title=title,
+            body=body,
+            type=notification_type,
+            data=payload,
+            notification_id=notification_id,
+        )
+        for token in tokens
+    ])
+    _stats.add(enqueued=len(tokens))
+    return len(tokens)
+
+
+_claim_lock = threading.Lock()
+
+
+def _claim(db: Session, limit: int) -> list:
+    # SKIP LOCKED separates processes on PostgreSQL; the lock separates this process's threads
+    with _claim_lock:
+        return _claim_locked(db, limit)
+
+
+def _claim_locked(db: Session, limit: int) -> list:
+    now = datetime.utcnow()
+    # Plain column rows: they stay readable after the commit below
+    query = (
+        select(
+            NotificationOutbox.id,
+            NotificationOutbox.token,
+            NotificationOutbox.title,
+            NotificationOutbox.body,
+            NotificationOutbox.type,
+            NotificationOutbox.data,
+            NotificationOutbox.attempts,
+        )
+        .where(
+            or_(NotificationOutbox.status == "pending", NotificationOutbox.status == "sending"),
+            NotificationOutbox.next_attempt_at <= now,
+        )
+        .order_by(NotificationOutbox.id)
+        .limit(limit)
+    )
+    if db.get_bind().dialect.name == "postgresql":
+        query = query.with_for_update(skip_locked=True)
+    rows = db.execute(query).all()
+    if rows:
+        # Lease: another worker may take these rows again only after it expires
+        db.execute(
+            update(NotificationOutbox)
+            .where(NotificationOutbox.id.in_([r.id for r in rows]))
+            .values(status="sending", next_attempt_at=now + timedelta(seconds=PUSH_LEASE_SECONDS))
+            .execution_options(synchronize_session=False)
+        )
+    db.commit()
+    return rows
+
+
+def _backoff(attempt: int) -> float:
+    delay = min(PUSH_RETRY_BASE_SECONDS * (2 ** (attempt - 1)), PUSH_RETRY_MAX_SECONDS)
+    return delay * random.uniform(0.8, 1.2)
+
+
+def _prune_tokens(db: Session, tokens: List[str]) -> None:
+    _stats.add(pruned_tokens=devices.prune(db, tokens))
+
+
+def _deliver(db: Session, rows: list) -> None:
+    transport = _transport
+    if not transport.available():
+        # Push is not configured (e.g. no Firebase credentials): drop, as the inline sender did
+        db.execute(delete(NotificationOutbox).where(NotificationOutbox.id.in_([r.id for r in rows])))
+        db.commit()
+        _stats.add(skipped=len(rows))
+        return
+
+    groups: Dict[tuple, list] = defaultdict(list)
+    for row in rows:
+        groups[(row.title, row.body, row.type, row.data)].append(row)
+
+    done_ids: List[int] = []
+    invalid_tokens: List[str] = []
+    retry: List[tuple] = []
+    for (title, body, notification_type, payload), group in groups.items():
+        data = json.loads(payload) if payload else {}
+        for start in range(0, len(group), PUSH_BATCH_SIZE):
+            batch = group[start:start + PUSH_BATCH_SIZE]
+            try:
+                result = transport.send([r.token for r in batch], title, body, data, notification_type)
+            except Exception as e:
+                result = BatchResult(failed={r.token: str(e) for r in batch})
+            _stats.add(batches=1, delivered=len(result.delivered))
+            invalid = set(result.invalid)
+            invalid_tokens.extend(invalid)
+            for row in batch:
+                if row.token in result.failed:
+                    retry.append((row, result.failed[row.token]))
+                else:
+                    done_ids.append(row.id)
+
+    now = datetime.utcnow()
+    if done_ids:
+        db.execute(delete(NotificationOutbox).where(NotificationOutbox.id.in_(done_ids)))
+    for row, error in retry:
+        attempts = row.attempts + 1
+        if attempts >= PUSH_MAX_ATTEMPTS:
+            values = {"status": "failed", "attempts": attempts, "last_error": error[:1000]}
+            _stats.add(failed=1)
+        else:
+            values = {
+                "status": "pending",
+                "attempts": attempts,
+                "last_error": error[:1000],
+                "next_attempt_at": now + timedelta(seconds=_backoff(attempts)),
+            }
+            _stats.add(retried=1)
+        db.execute(
+            update(NotificationOutbox).where(NotificationOutbox.id == row.id).values(values)
+            .execution_options(synchronize_session=False)
+        )
+    db.commit()
+    if invalid_tokens:
+        _prune_tokens(db, invalid_tokens)
+
+
+def process_once(db: Session, limit: int = PUSH_CLAIM_SIZE) -> int:
+    """Claim and deliver one batch of due rows; returns the number of rows handled"""
+    rows = _claim(db, limit)
+    if rows:
+        _deliver(db, rows)
+    return len(rows)
+
+
+def drain(db: Session) -> int:
+    """Deliver until nothing is due (tests / scripts); returns rows handled"""
+    total = 0
+    while True:
+        handled = process_once(db)
+        if not handled:
+            return total
+        total += handled
+
+
+def pending_count(db: Session) -> int:
+    return db.query(NotificationOutbox).filter(NotificationOutbox.status != "failed").count()
+
+
+class _Dispatcher:
+    def __init__(self):
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._threads: List[threading.Thread] = []
+
+    def start(self) -> None:
+        if PUSH_WORKERS <= 0 or self._threads:
+            return
+        self._stop.clear()
+        for i in range(PUSH_WORKERS):
+            thread = threading.Thread(target=self._run, name=f"push-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._wake.set()
+        for thread in self._threads:
+            thread.join(timeout=5)
+        self._threads = []
+
+    def wake(self) -> None:
+        self._wake.set()
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            handled = 0
+            db = SessionLocal()
+            try:
+                handled = process_once(db)
+            except Exception as e:
+                db.rollback()
+                logger.error(f"Push delivery failed: {e}")
+            finally:
+                db.close()
+            if not handled:
+                self._wake.wait(PUSH_POLL_INTERVAL_SECONDS)
+                self._wake.clear()
+
+
+dispatcher = _Dispatcher()
+
+
+def wake() -> None:
+    """Nudge the delivery threads after committing enqueued rows"""
+    dispatcher.wake()
+
+
+def stats() -> dict:
+    out = _stats.snapshot()
+    out["workers"] = PUSH_WORKERS
+    return out
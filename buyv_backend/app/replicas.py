@@ -0,0 +1,294 @@
+"""
+Read-replica routing for read-only GET endpoints.
+
+`get_read_db` / `get_read_db_runner` replace `get_db` / `get_db_runner` on
+routes that never write. Each request gets a session on a random healthy
+replica from DATABASE_REPLICA_URLS, or on the primary when:
+
+- no replica is configured, or none passed its last lag check (`monitor`
+  measures every REPLICA_LAG_CHECK_INTERVAL_SECONDS; a replica more than
+  REPLICA_MAX_LAG_SECONDS behind, or unreachable, is skipped), or
+- the caller wrote recently: `ReadYourWritesMiddleware` marks the bearer's
+  user for READ_YOUR_WRITES_SECONDS after any non-GET request. The mark lives
+  in a TwoTierCache, so it is shared by all workers when REDIS_URL is set.
+
+A replica session carries the replica's measured lag in `Session.info`.
+`may_cache_reads(db)` is False while it is behind: rows read there may
+predate an invalidation the other workers already applied, so hydration
+serves them without writing them back to the caches.
+
+Lag is measured on PostgreSQL (WAL replay timestamp) and MySQL
+(Seconds_Behind_Source); other databases (SQLite in dev) only get a
+reachability check.
+"""
+import logging
+import math
+import random
+import threading
+import time
+from typing import AsyncIterator, List, Optional
+
+from fastapi import Request
+from fastapi.concurrency import run_in_threadpool
+from jose import JWTError, jwt
+from sqlalchemy import text
+from sqlalchemy.orm import Session, sessionmaker
+from starlette.datastructures import Headers
+
+from .async_database import DbRunner, async_url, make_async_engine, make_async_sessionmaker, open_runner
+from .cache import TwoTierCache, get_shared_backend
+from .config import (
+    DATABASE_REPLICA_URLS,
+    READ_YOUR_WRITES_SECONDS,
+    REPLICA_LAG_CHECK_INTERVAL_SECONDS,
+    REPLICA_MAX_LAG_SECONDS,
+    USE_ASYNC_DB,
+)
+from .database import SessionLocal, make_engine, normalize_url
+from . import async_database
+
+logger = logging.getLogger(__name__)
+
+SAFE_METHODS = {"GET", "HEAD", "OPTIONS"}
+# POST endpoints that only read; they don't make the caller sticky
+READ_ONLY_PATHS = {"/viewer/state"}
+
+# Session.info key: lag (seconds) of the replica the session reads from
+REPLICA_LAG = "replica_lag"
+
+_PG_LAG_SQL = text(
+    "SELECT CASE WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+    "ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) END"
+)
+
+
+class _Replica:
+    def __init__(self, index: int, url: str):
+        self.name = f"replica{index}"
+        url = normalize_url(url)
+        self.engine = make_engine(url, self.name)
+        self.SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=self.engine, future=True)
+        self.AsyncSessionLocal = None
+        if USE_ASYNC_DB:
+            self.async_engine = make_async_engine(async_url(url), f"{self.name}_async")
+            self.AsyncSessionLocal = make_async_sessionmaker(self.async_engine)
+        # Seconds behind the primary; None until the first successful check
+        self.lag: Optional[float] = None
+        self.checked_at: Optional[float] = None
+        self.error: Optional[str] = None
+        self.reads = 0
+
+    @property
+    def healthy(self) -> bool:
+        return self.lag is not None and self.lag <= REPLICA_MAX_LAG_SECONDS
+
+    def measure_lag(self) -> float:
+        with self.engine.connect() as conn:
+            dialect = self.engine.dialect.name
+            if dialect == "postgresql":
+                return float(conn.execute(_PG_LAG_SQL).scalar() or 0)
+            if dialect == "mysql":
+                status = conn.execute(text("SHOW REPLICA STATUS")).mappings().first()
+                if status is None:
+                    return 0.0
+                behind = status.get("Seconds_Behind_Source")
+                if behind is None:
+                    raise RuntimeError("replication threads are stopped")
+                return float(behind)
+            conn.execute(text("SELECT 1"))
+            return 0.0
+
+    def check(self) -> None:
+        was_healthy = self.healthy
+        try:
+            self.lag, self.error = self.measure_lag(), None
+        except Exception as e:
+            self.lag, self.error = None, str(e)
+        self.checked_at = time.time()
+        if was_healthy and not self.healthy:
+            logger.warning(f"Read replica {self.name} disabled (lag={self.lag}, error={self.error})")
+        elif self.healthy and not was_healthy:
+            logger.info(f"Read replica {self.name} enabled (lag={self.lag:.1f}s)")
+
+
+replicas: List[_Replica] = [_Replica(i + 1, url) for i, url in enumerate(DATABASE_REPLICA_URLS)]
+
+
+class _Routing:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.replica = 0
+        self.sticky = 0
+        self.fallback = 0
+
+    def add(self, name: str, replica: Optional["_Replica"] = None) -> None:
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+            if replica is not None:
+                replica.reads += 1
+
+
+_routing = _Routing()
+
+# Users who wrote within the last READ_YOUR_WRITES_SECONDS (value is unused)
+_recent_writers = TwoTierCache(
+    "recent_writer",
+    max_entries=10000,
+    local_ttl=READ_YOUR_WRITES_SECONDS,
+    shared_ttl=max(1, math.ceil(READ_YOUR_WRITES_SECONDS)),
+)
+
+
+def writer_key(authorization: Optional[str]) -> Optional[str]:
+    """User uid from a bearer token; not verified, a forged token can only send reads to the primary"""
+    if not authorization or not authorization.lower().startswith("bearer "):
+        return None
+    try:
+        return jwt.get_unverified_claims(authorization[7:]).get("sub")
+    except JWTError:
+        return None
+
+
+def mark_writer(key: str) -> None:
+    # Each write restarts the window
+    _recent_writers.set_many({key: {"at": time.time()}}, overwrite=True)
+
+
+def wrote_recently(key: Optional[str]) -> bool:
+    return key is not None and bool(_recent_writers.get_many([key]))
+
+
+async def _off_loop(fn, *args):
+    # The shared tier is a blocking Redis call; the local tier is not worth a thread hop
+    if get_shared_backend() is None:
+        return fn(*args)
+    return await run_in_threadpool(fn, *args)
+
+
+def choose(sticky: bool) -> Optional[_Replica]:
+    """Replica for this read, or None for the primary"""
+    if not replicas:
+        return None
+    if sticky:
+        _routing.add("sticky")
+        return None
+    healthy = [replica for replica in replicas if replica.healthy]
+    if not healthy:
+        _routing.add("fallback")
+        return None
+    replica = random.choice(healthy)
+    _routing.add("replica", replica)
+    return replica
+
+
+def may_cache_reads(db: Session) -> bool:
+    """Whether rows read through `db` may be written to the caches (primary, or a replica with no lag)"""
+    return not db.info.get(REPLICA_LAG)
+
+
+# Dependency for FastAPI (read-only sync routes)
+def get_read_db(request: Request):
+    sticky = bool(replicas) and wrote_recently(writer_key(request.headers.get("authorization")))
+    replica = choose(sticky)
+    db = (replica.SessionLocal if replica else SessionLocal)()
+    if replica:
+        db.info[REPLICA_LAG] = replica.lag
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+# Dependency for FastAPI (read-only async routes)
+async def get_read_db_runner(request: Request) -> AsyncIterator[DbRunner]:
+    sticky = bool(replicas) and await _off_loop(wrote_recently, writer_key(request.headers.get("authorization")))
+    replica = choose(sticky)
+    if replica:
+        factories = replica.SessionLocal, replica.AsyncSessionLocal
+    else:
+        factories = SessionLocal, async_database.AsyncSessionLocal
+    async with open_runner(*factories) as runner:
+        if replica:
+            # AsyncSession.info is its sync session's, which run_sync hands to callers
+            runner.session.info[REPLICA_LAG] = replica.lag
+        yield runner
+
+
+class ReadYourWritesMiddleware:
+    """Marks the caller of a non-GET request as a recent writer once the response starts"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] in SAFE_METHODS or scope["path"] in READ_ONLY_PATHS:
+            await self.app(scope, receive, send)
+            return
+        key = writer_key(Headers(scope=scope).get("authorization"))
+        if key is None:
+            await self.app(scope, receive, send)
+            return
+
+        async def send_marking(message):
+            # Handlers commit before responding, so the write is visible on the primary by now
+            if message["type"] == "http.response.start":
+                await _off_loop(mark_writer, key)
+            await send(message)
+
+        await self.app(scope, receive, send_marking)
+
+
+class _Monitor:
+    def __init__(self):
+        self._stop = threading.Event()
+        self._thread = None
+
+    def check_all(self) -> None:
+        for replica in replicas:
+            replica.check()
+
+    def start(self) -> None:
+        if not replicas or self._thread is not None:
+            return
+        # First check before serving, so reads use replicas right away
+        self.check_all()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="replica-monitor", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def _run(self) -> None:
+        while not self._stop.wait(REPLICA_LAG_CHECK_INTERVAL_SECONDS):
+            self.check_all()
+
+
+monitor = _Monitor()
+
+
+async def dispose() -> None:
+    for replica in replicas:
+        replica.engine.dispose()
+        if replica.AsyncSessionLocal is not None:
+            await replica.async_engine.dispose()
+
+
+def stats() -> dict:
+    now = time.time()
+    return {
+        "reads": {"replica": _routing.replica, "sticky": _routing.sticky, "fallback": _routing.fallback},
+        "replicas": {
+            replica.name: {
+                "healthy": replica.healthy,
+                "lag_seconds": replica.lag,
+                "checked_ago_seconds": round(now - replica.checked_at, 1) if replica.checked_at else None,
+                "error": replica.error,
+                "reads": replica.reads,
+            }
+            for replica in replicas
+        },
+    }
@@ -64,6 +64,13 @@ class UserUpdate(CamelModel):
     interests: Optional[List[str]] = None
     settings: Optional[dict] = None
 
+class UserCard(CamelModel):
+    """Compact user entry for large listings (followers, following)"""
+    uid: str
+    username: str
+    profile_image_url: Optional[str] = None
+    is_verified: bool = False
+
 class UserStats(CamelModel):
     followers_count: int
     following_count: int
@@ -103,6 +110,11 @@ class NotificationOut(CamelModel):
     is_read: bool
     created_at: datetime
 
+class MarkReadRequest(CamelModel):
+    """Mark read everything up to (and including) a notification id or an inbox cursor; empty = all"""
+    up_to_id: Optional[int] = None
+    cursor: Optional[str] = None
+
 # -------------------- Orders & Commissions --------------------
 
 class OrderItemCreate(CamelModel):
@@ -187,9 +199,24 @@ class OrderOut(CamelModel):
     notes: Optional[str] = ""
     promoter_uid: Optional[str] = Field(default=None, alias="promoterId")
 
+class OrderSummaryOut(CamelModel):
+    """Order list row without items / address, for history screens"""
+    id: int
+    order_number: str
+    status: str
+    total: float
+    item_count: int
+    created_at: datetime
+    tracking_number: Optional[str] = None
+
 class StatusUpdate(CamelModel):
     status: str
 
+class BulkOrderStatusUpdate(CamelModel):
+    status: str
+    order_ids: List[int] = Field(default_factory=list, max_length=10000)
+    order_numbers: List[str] = Field(default_factory=list, max_length=10000)
+
 class TrackingUpdate(CamelModel):
     tracking_number: str
 
@@ -209,6 +236,14 @@ class CommissionOut(CamelModel):
     paid_at: Optional[datetime] = None
     metadata: Optional[dict] = None
 
+class CommissionSummaryOut(CamelModel):
+    pending_amount: float = 0.0
+    paid_amount: float = 0.0
+    canceled_amount: float = 0.0
+    pending_count: int = 0
+    paid_count: int = 0
+    canceled_count: int = 0
+
 # -------------------- Posts --------------------
 
 class PostOut(CamelModel):
@@ -266,6 +301,37 @@ class CommentOut(CamelModel):
     user_profile_image: Optional[str] = None
     post_id: str = Field(alias="postId")
     content: str
+    likes_count: int = 0
     created_at: datetime
     updated_at: datetime
 
+
+class ViewerStateRequest(CamelModel):
+    post_uids: List[str] = Field(default_factory=list, max_length=300)
+    user_uids: List[str] = Field(default_factory=list, max_length=300)
+
+class ViewerPostState(CamelModel):
+    is_liked: bool = False
+    is_bookmarked: bool = False
+
+class ViewerUserState(CamelModel):
+    is_following: bool = False
+
+class ViewerStateOut(CamelModel):
+    posts: Dict[str, ViewerPostState]  # keyed by post uid
+    users: Dict[str, ViewerUserState]  # keyed by user uid
+
+class QueuedAction(CamelModel):
+    type: str  # like | unlike | bookmark | unbookmark | follow | unfollow
+    target_uid: str  # post uid, or user uid for follow / unfollow
+
+class ActionBatchRequest(CamelModel):
+    actions: List[QueuedAction] = Field(max_length=100)
+
+class ActionResult(CamelModel):
+    type: str
+    target_uid: str
+    status: str
+
+class ActionBatchOut(CamelModel):
+    results: List[ActionResult]
@@ -0,0 +1,145 @@
+"""
+Full-text search over post captions.
+
+PostgreSQL: a generated `posts.caption_tsv` tsvector column with a GIN index,
+so the index follows every insert/update/delete of `posts` by itself.
+SQLite (local dev): an FTS5 virtual table `posts_fts` whose rowid is
+`posts.id`, kept in sync explicitly through `index_post` / `unindex_posts`.
+
+Queries are tokenised into words and every word is prefix-matched
+("sneak" finds "sneakers"); all words must match. Results are ranked by
+relevance, then recency. Other dialects fall back to the old ILIKE scan.
+"""
+import logging
+import re
+from typing import List, Optional
+
+from sqlalchemy import bindparam, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+from .models import Post
+
+logger = logging.getLogger(__name__)
+
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+# Set by ensure_search_index() / init_search_backend(): "postgresql", "sqlite" or None (ILIKE fallback)
+_backend: Optional[str] = None
+
+_BACKEND_PROBES = {
+    "postgresql": "SELECT 1 FROM information_schema.columns WHERE table_name = 'posts' AND column_name = 'caption_tsv'",
+    "sqlite": "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'posts_fts'",
+}
+
+
+def ensure_search_index(engine: Engine) -> None:
+    """Create the FTS structures if missing (idempotent, run by the baseline migration)"""
+    global _backend
+    dialect = engine.dialect.name
+    try:
+        if dialect == "postgresql":
+            with engine.begin() as conn:
+                conn.execute(text(
+                    "ALTER TABLE posts ADD COLUMN IF NOT EXISTS caption_tsv tsvector "
+                    "GENERATED ALWAYS AS (to_tsvector('simple', coalesce(caption, ''))) STORED"
+                ))
+                conn.execute(text(
+                    "CREATE INDEX IF NOT EXISTS ix_posts_caption_tsv ON posts USING GIN (caption_tsv)"
+                ))
+            _backend = "postgresql"
+        elif dialect == "sqlite":
+            with engine.begin() as conn:
+                exists = conn.execute(text(
+                    "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'posts_fts'"
+                )).first()
+                if not exists:
+                    conn.execute(text(
+                        "CREATE VIRTUAL TABLE posts_fts USING fts5("
+                        "caption, tokenize = 'unicode61 remove_diacritics 2')"
+                    ))
+                    conn.execute(text(
+                        "INSERT INTO posts_fts(rowid, caption) "
+                        "SELECT id, caption FROM posts WHERE caption IS NOT NULL"
+                    ))
+            _backend = "sqlite"
+    except Exception as e:
+        logger.warning(f"Full-text search index unavailable, falling back to ILIKE: {e}")
+        _backend = None
+
+
+def init_search_backend(engine: Engine) -> None:
+    """Pick the backend from the structures the migrations created (one catalog query, no DDL)"""
+    global _backend
+    probe = _BACKEND_PROBES.get(engine.dialect.name)
+    if probe is None:
+        _backend = None
+        return
+    with engine.connect() as conn:
+        _backend = engine.dialect.name if conn.execute(text(probe)).first() else None
+    if _backend is None:
+        logger.warning("Full-text search index missing, falling back to ILIKE")
+
+
+def index_post(db: Session, post: Post) -> None:
+    """Add a flushed post to the FTS index (no-op on PostgreSQL: generated column)"""
+    if _backend == "sqlite" and post.caption:
+        db.execute(
+            text("INSERT INTO posts_fts(rowid, caption) VALUES (:id, :caption)"),
+            {"id": post.id, "caption": post.caption},
+        )
+
+
+def unindex_posts(db: Session, *post_ids: int) -> None:
+    if _backend == "sqlite" and post_ids:
+        db.execute(
+            text("DELETE FROM posts_fts WHERE rowid IN :ids").bindparams(bindparam("ids", expanding=True)),
+            {"ids": list(post_ids)},
+        )
+
+
+def unindex_user_posts(db: Session, user_id: int) -> None:
+    if _backend == "sqlite":
+        db.execute(
+            text("DELETE FROM posts_fts WHERE rowid IN (SELECT id FROM posts WHERE user_id = :uid)"),
+            {"uid": user_id},
+        )
+
+
+def search_post_uids(
+    db: Session, q: str, type: Optional[str], limit: int, offset: int
+) -> List[str]:
+    """Post uids matching `q`, best match first"""
+    words = _WORD_RE.findall(q.lower())
+    if not words:
+        return []
+    params = {"limit": limit, "offset": offset}
+    type_filter = ""
+    if type:
+        type_filter = "AND p.type = :type"
+        params["type"] = type
+
+    if _backend == "postgresql":
+        params["tsq"] = " & ".join(f"{w}:*" for w in words)
+        sql = f"""
+            SELECT p.uid FROM posts p, to_tsquery('simple', :tsq) query
+            WHERE p.caption_tsv @@ query {type_filter}
+            ORDER BY ts_rank_cd(p.caption_tsv, query) DESC, p.created_at DESC
+            LIMIT :limit OFFSET :offset
+        """
+    elif _backend == "sqlite":
+        params["match"] = " ".join(f'"{w}"*' for w in words)
+        sql = f"""
+            SELECT p.uid FROM posts_fts f JOIN posts p ON p.id = f.rowid
+            WHERE posts_fts MATCH :match {type_filter}
+            ORDER BY bm25(posts_fts), p.created_at DESC
+            LIMIT :limit OFFSET :offset
+        """
+    else:
+        query = db.query(Post.uid).filter(Post.caption.ilike(f"%{q}%"))
+        if type:
+            query = query.filter(Post.type == type)
+        rows = query.order_by(Post.created_at.desc()).offset(offset).limit(limit).all()
+        return [r.uid for r in rows]
+
+    return [row[0] for row in db.execute(text(sql), params)]
@@ -0,0 +1,173 @@
+"""
+Fan-out-on-write home timeline.
+
+Every post is pushed into the `timeline_entries` inbox of each follower when
+it is created, so reading the home feed is an index range scan over the
+reader's own inbox. Authors above TIMELINE_CELEBRITY_THRESHOLD followers are
+not fanned out (one post would mean millions of inserts); their recent posts
+are merged into the page at read time instead.
+
+The switch is recorded in `users.fanout_mode` and is sticky: an author who
+drops back below the threshold stays in "pull", otherwise the posts written
+while they were above it would vanish from their followers' timelines.
+Inbox inserts skip existing (user, post) rows, so a follow racing a new post
+cannot fail on uq_timeline_entry.
+"""
+from typing import List, Optional, Tuple
+
+from sqlalchemy import and_, delete, literal, select, update
+from sqlalchemy.orm import Session
+
+from .config import TIMELINE_CELEBRITY_THRESHOLD, TIMELINE_FOLLOW_BACKFILL, TIMELINE_MAX_ENTRIES
+from .models import Follow, Post, TimelineEntry, User
+from .pagination import encode_cursor, keyset_before
+from .upserts import insert_select_missing
+
+PULL = "pull"
+
+ENTRY_COLUMNS = ["user_id", "post_id", "author_id", "created_at"]
+
+
+def is_pulled(db: Session, author_id: int) -> bool:
+    """Whether the author's posts are merged at read time; the first crossing of the threshold switches them for good"""
+    # Read from the row, not the caller's (possibly cached) User object
+    mode, followers_count = db.execute(
+        select(User.fanout_mode, User.followers_count).where(User.id == author_id)
+    ).one()
+    if mode == PULL:
+        return True
+    if (followers_count or 0) < TIMELINE_CELEBRITY_THRESHOLD:
+        return False
+    db.execute(update(User).where(User.id == author_id, User.fanout_mode != PULL).values(fanout_mode=PULL))
+    return True
+
+
+def _insert_entries(db: Session, rows) -> int:
+    return insert_select_missing(db, TimelineEntry, ("user_id", "post_id"), ENTRY_COLUMNS, rows)
+
+
+def fan_out_post(db: Session, post: Post, author: User) -> None:
+    """Push a freshly flushed post into the author's and their followers' inboxes"""
+    own = select(literal(author.id), literal(post.id), literal(author.id), literal(post.created_at))
+    _insert_entries(db, own)
+    if is_pulled(db, author.id):
+        return
+    followers = select(
+        Follow.follower_id,
+        literal(post.id),
+        literal(author.id),
+        literal(post.created_at),
+    ).where(Follow.followed_id == author.id)
+    _insert_entries(db, followers)
+
+
+def remove_post(db: Session, post_id: int) -> None:
+    db.execute(delete(TimelineEntry).where(TimelineEntry.post_id == post_id))
+
+
+def on_follow(db: Session, follower_id: int, followed: User) -> None:
+    """Copy the followed author's recent posts into the new follower's inbox"""
+    if is_pulled(db, followed.id):
+        return
+    recent = (
+        select(literal(follower_id), Post.id, Post.user_id, Post.created_at)
+        .where(Post.user_id == followed.id)
+        .order_by(Post.created_at.desc(), Post.id.desc())
+        .limit(TIMELINE_FOLLOW_BACKFILL)
+    )
+    # A post created concurrently may already have been fanned out to this follower
+    _insert_entries(db, recent)
+
+
+def on_unfollow(db: Session, follower_id: int, followed_id: int) -> None:
+    db.execute(
+        delete(TimelineEntry).where(
+            TimelineEntry.user_id == follower_id,
+            TimelineEntry.author_id == followed_id,
+        )
+    )
+
+
+def remove_user(db: Session, user_id: int) -> None:
+    """Drop a user's inbox and their posts from everyone else's inbox"""
+    db.execute(
+        delete(TimelineEntry).where(
+            (TimelineEntry.user_id == user_id) | (TimelineEntry.author_id == user_id)
+        )
+    )
+
+
+def rebuild_timeline(db: Session, user_id: int) -> int:
+    """Recreate one inbox from the follows graph (backfill / repair)"""
+    db.execute(delete(TimelineEntry).where(TimelineEntry.user_id == user_id))
+    followed_ids = select(Follow.followed_id).where(Follow.follower_id == user_id)
+    authors = (
+        select(User.id)
+        .where(
+            User.fanout_mode != PULL,
+            (User.id.in_(followed_ids)) | (User.id == user_id),
+        )
+    )
+    recent = (
+        select(literal(user_id), Post.id, Post.user_id, Post.created_at)
+        .where(Post.user_id.in_(authors))
+        .order_by(Post.created_at.desc(), Post.id.desc())
+        .limit(TIMELINE_MAX_ENTRIES)
+    )
+    return _insert_entries(db, recent)
+
+
+def trim_timeline(db: Session, user_id: int, keep: int = TIMELINE_MAX_ENTRIES) -> int:
+    """Delete inbox entries older than the newest `keep`"""
+    boundary = db.execute(
+        select(TimelineEntry.created_at, TimelineEntry.post_id)
+        .where(TimelineEntry.user_id == user_id)
+        .order_by(TimelineEntry.created_at.desc(), TimelineEntry.post_id.desc())
+        .offset(keep - 1)
+        .limit(1)
+    ).first()
+    if boundary is None:
+        return 0
+    ts, post_id = boundary
+    result = db.execute(
+        delete(TimelineEntry).where(
+            TimelineEntry.user_id == user_id,
+            (TimelineEntry.created_at < ts)
+            | and_(TimelineEntry.created_at == ts, TimelineEntry.post_id < post_id),
+        )
+    )
+    return result.rowcount or 0
+
+
+def read_timeline(
+    db: Session, user_id: int, limit: int, cursor: Optional[str] = None
+) -> Tuple[List[int], Optional[str]]:
+    """Post ids of one home timeline page, newest first, plus the cursor for the next page"""
+    inbox = select(TimelineEntry.post_id, TimelineEntry.created_at).where(
+        TimelineEntry.user_id == user_id
+    )
+    if cursor:
+        inbox = inbox.where(keyset_before(TimelineEntry.created_at, TimelineEntry.post_id, cursor))
+    inbox = inbox.order_by(TimelineEntry.created_at.desc(), TimelineEntry.post_id.desc()).limit(limit)
+    candidates = {post_id: created_at for post_id, created_at in db.execute(inbox)}
+
+    # Pull-mode authors the reader follows: their posts are not (all) in the inbox
+    celebrity_ids = db.execute(
+        select(Follow.followed_id)
+        .join(User, User.id == Follow.followed_id)
+        .where(Follow.follower_id == user_id, User.fanout_mode == PULL)
+    ).scalars().all()
+    if celebrity_ids:
+        pulled = select(Post.id, Post.created_at).where(Post.user_id.in_(celebrity_ids))
+        if cursor:
+            pulled = pulled.where(keyset_before(Post.created_at, Post.id, cursor))
+        pulled = pulled.order_by(Post.created_at.desc(), Post.id.desc()).limit(limit)
+        for post_id, created_at in db.execute(pulled):
+            candidates.setdefault(post_id, created_at)
+
+    page = sorted(candidates.items(), key=lambda kv: (kv[1], kv[0]), reverse=True)[:limit]
+    next_cursor = None
+    if page and len(page) == limit:
+        last_id, last_ts = page[-1]
+        next_cursor = encode_cursor(last_ts, last_id)
+    return [post_id for post_id, _ in page], next_cursor
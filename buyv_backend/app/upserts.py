@@ -0,0 +1,100 @@
+"""
+Dialect-aware "insert if missing" helpers.
+
+PostgreSQL and SQLite get a single `INSERT ... ON CONFLICT DO NOTHING`;
+other dialects fall back to SELECT-then-INSERT of the missing keys
+(`insert_missing`) or to one SAVEPOINT per row (`insert_new`).
+`insert_select_missing` is the `INSERT ... SELECT` variant and
+`delete_returning` is the matching removal helper.
+"""
+from typing import Iterable, List, Sequence
+
+from sqlalchemy import delete, insert, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from sqlalchemy.sql import Select
+
+
+def _dialect_insert(db: Session):
+    dialect = db.get_bind().dialect.name
+    if dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    elif dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    else:
+        return None
+    return dialect_insert
+
+
+def insert_missing(db: Session, model, key: str, values: Iterable[dict]) -> None:
+    """Insert `values` rows whose `key` column is not present yet (existing rows are left alone)"""
+    values: List[dict] = list(values)
+    if not values:
+        return
+    dialect_insert = _dialect_insert(db)
+    if dialect_insert is not None:
+        db.execute(dialect_insert(model).values(values).on_conflict_do_nothing(index_elements=[key]))
+        return
+    column = getattr(model, key)
+    existing = set(db.execute(select(column).where(column.in_([v[key] for v in values]))).scalars())
+    missing = [v for v in values if v[key] not in existing]
+    if missing:
+        db.execute(insert(model), missing)
+
+
+def insert_select_missing(db: Session, model, conflict_columns: Sequence[str], columns: Sequence[str],
+                          query: Select) -> int:
+    """`INSERT ... SELECT` skipping rows that hit the unique constraint on `conflict_columns`.
+
+    Returns the number of rows inserted. Safe under concurrent inserts of the
+    same keys (MySQL uses INSERT IGNORE); the caller commits.
+    """
+    dialect_insert = _dialect_insert(db)
+    if dialect_insert is not None:
+        stmt = dialect_insert(model).from_select(list(columns), query).on_conflict_do_nothing(
+            index_elements=list(conflict_columns)
+        )
+    else:
+        stmt = insert(model).from_select(list(columns), query).prefix_with("IGNORE", dialect="mysql")
+    return db.execute(stmt).rowcount or 0
+
+
+def insert_new(db: Session, model, conflict_columns: Sequence[str], values: Iterable[dict], returning) -> list:
+    """Insert `values`, skipping rows that hit the unique constraint on `conflict_columns`.
+
+    Returns the `returning` column of the rows actually inserted, so callers
+    can update counters only for real inserts. Safe under concurrent
+    duplicate inserts; the caller commits.
+    """
+    values = list(values)
+    if not values:
+        return []
+    dialect_insert = _dialect_insert(db)
+    if dialect_insert is not None:
+        stmt = (
+            dialect_insert(model).values(values)
+            .on_conflict_do_nothing(index_elements=list(conflict_columns))
+            .returning(returning)
+        )
+        return list(db.execute(stmt).scalars())
+    inserted = []
+    for row in values:
+        try:
+            with db.begin_nested():
+                db.execute(insert(model).values(row))
+        except IntegrityError:
+            continue
+        inserted.append(row[returning.key])
+    return inserted
+
+
+def delete_returning(db: Session, model, returning, *where) -> list:
+    """Delete the rows matching `where`; returns their `returning` column"""
+    stmt = delete(model).where(*where)
+    if db.get_bind().dialect.delete_returning:
+        return list(db.execute(stmt.returning(returning)).scalars())
+    # No DELETE ... RETURNING (MySQL): lock the rows first
+    rows = list(db.execute(select(returning).where(*where).with_for_update()).scalars())
+    if rows:
+        db.execute(stmt)
+    return rows
@@ -0,0 +1,165 @@
+"""
+Autocomplete-grade user search for /users/search.
+
+PostgreSQL: pg_trgm GIN indexes on lower(username) / lower(display_name)
+serve substring matches, and text_pattern_ops btree indexes serve
+`prefix_only` lookups.
+SQLite (local dev): substring search stays a LIKE scan, while `prefix_only`
+is answered from an in-memory sorted array of lowercased names (bisect),
+rebuilt lazily after USER_SEARCH_INDEX_TTL_SECONDS or on invalidation.
+
+Results are ordered exact match > prefix match > substring match, then by
+follower count. Only a bounded candidate set is ranked: exact matches plus
+up to USER_SEARCH_MAX_CANDIDATES index hits per name column and match kind,
+so a one-letter query never sorts the whole users table.
+"""
+import bisect
+import logging
+import threading
+import time
+from typing import List, Optional, Tuple
+
+from sqlalchemy import case, func, or_, select, text, union
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+from .config import USER_SEARCH_INDEX_TTL_SECONDS, USER_SEARCH_MAX_CANDIDATES
+from .models import User
+
+logger = logging.getLogger(__name__)
+
+_dialect: Optional[str] = None
+
+
+def ensure_user_search_index(engine: Engine) -> None:
+    """Create the trigram / prefix indexes on PostgreSQL (idempotent, run by the baseline migration)"""
+    global _dialect
+    _dialect = engine.dialect.name
+    if _dialect != "postgresql":
+        return
+    statements = [
+        "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+        "CREATE INDEX IF NOT EXISTS ix_users_username_trgm ON users USING GIN (lower(username) gin_trgm_ops)",
+        "CREATE INDEX IF NOT EXISTS ix_users_display_name_trgm ON users USING GIN (lower(display_name) gin_trgm_ops)",
+        "CREATE INDEX IF NOT EXISTS ix_users_username_prefix ON users (lower(username) text_pattern_ops)",
+        "CREATE INDEX IF NOT EXISTS ix_users_display_name_prefix ON users (lower(display_name) text_pattern_ops)",
+    ]
+    for statement in statements:
+        try:
+            with engine.begin() as conn:
+                conn.execute(text(statement))
+        except Exception as e:
+            logger.warning(f"User search index setup failed ({statement[:40]}...): {e}")
+
+
+def init_user_search(engine: Engine) -> None:
+    global _dialect
+    _dialect = engine.dialect.name
+
+
+class _PrefixIndex:
+    """Sorted (lowercased name, user id) array answering prefix queries with bisect"""
+
+    def __init__(self):
+        self._keys: List[Tuple[str, int]] = []
+        self._built_at = 0.0
+        self._lock = threading.Lock()
+
+    def invalidate(self) -> None:
+        self._built_at = 0.0
+
+    def _ensure(self, db: Session) -> None:
+        if time.monotonic() - self._built_at < USER_SEARCH_INDEX_TTL_SECONDS:
+            return
+        with self._lock:
+            if time.monotonic() - self._built_at < USER_SEARCH_INDEX_TTL_SECONDS:
+                return
+            keys = []
+            for user_id, username, display_name in db.query(User.id, User.username, User.display_name).all():
+                keys.append(((username or "").lower(), user_id))
+                if display_name:
+                    keys.append((display_name.lower(), user_id))
+            keys.sort()
+            self._keys = keys
+            self._built_at = time.monotonic()
+
+    def lookup(self, db: Session, prefix: str, max_results: int) -> List[int]:
+        self._ensure(db)
+        keys = self._keys
+        start = bisect.bisect_left(keys, (prefix, -1))
+        found: List[int] = []
+        seen = set()
+        for key, user_id in keys[start:]:
+            if not key.startswith(prefix) or len(found) >= max_results:
+                break
+            if user_id not in seen:
+                seen.add(user_id)
+                found.append(user_id)
+        return found
+
+
+_prefix_index = _PrefixIndex()
+
+
+def invalidate() -> None:
+    """Call after a username / display_name is created, changed or deleted"""
+    _prefix_index.invalidate()
+
+
+def _escape_like(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def _rank(user: User, q: str) -> tuple:
+    names = [(user.username or "").lower(), (user.display_name or "").lower()]
+    if q in names:
+        tier = 0
+    elif any(n.startswith(q) for n in names):
+        tier = 1
+    else:
+        tier = 2
+    return (tier, -(user.followers_count or 0), user.id)
+
+
+def _candidate_ids(username, display_name, q: str, prefix: str, pattern: str):
+    """Ids to rank: exact matches plus the first USER_SEARCH_MAX_CANDIDATES hits of each LIKE"""
+    branches = [select(User.id).where(or_(username == q, display_name == q))]
+    for column in (username, display_name):
+        for like in dict.fromkeys((prefix, pattern)):
+            # No ORDER BY: the LIMIT stops the prefix / trigram index scan early
+            hits = select(User.id).where(column.like(like, escape="\\")).limit(USER_SEARCH_MAX_CANDIDATES)
+            branches.append(hits)
+    return union(*(select(branch.subquery().c.id) for branch in branches))
+
+
+def search_users(db: Session, q: str, limit: int, offset: int, prefix_only: bool = False) -> List[User]:
+    q = q.strip().lower()
+    if not q:
+        return []
+
+    if prefix_only and _dialect != "postgresql":
+        candidate_ids = _prefix_index.lookup(db, q, USER_SEARCH_MAX_CANDIDATES)
+        if not candidate_ids:
+            return []
+        users = db.query(User).filter(User.id.in_(candidate_ids)).all()
+        users.sort(key=lambda u: _rank(u, q))
+        return users[offset:offset + limit]
+
+    username = func.lower(User.username)
+    display_name = func.lower(User.display_name)
+    escaped = _escape_like(q)
+    prefix = f"{escaped}%"
+    pattern = prefix if prefix_only else f"%{escaped}%"
+    tier = case(
+        (or_(username == q, display_name == q), 0),
+        (or_(username.like(prefix, escape="\\"), display_name.like(prefix, escape="\\")), 1),
+        else_=2,
+    )
+    return (
+        db.query(User)
+        .filter(User.id.in_(_candidate_ids(username, display_name, q, prefix, pattern)))
+        .order_by(tier, User.followers_count.desc(), User.id)
+        .offset(offset)
+        .limit(limit)
+        .all()
+    )
@@ -1,11 +1,16 @@
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Query, status
+from sqlalchemy import func, select
 from sqlalchemy.orm import Session
-from typing import List
+from typing import List, Optional
 from pydantic import BaseModel
 from .database import get_db
+from .replicas import get_read_db
 from . import models
 from .schemas import UserOut, UserUpdate, UserStats
-from .auth import get_current_user
+from .auth import get_current_user, invalidate_principal, verify_password
+from . import comments, counters, devices, fanout, inbox, ledger, search, timeline, user_search
+from .hydration import invalidate_user
+from .upserts import delete_returning
 import json
 
 router = APIRouter(prefix="/users", tags=["users"])
@@ -14,6 +19,7 @@ router = APIRouter(prefix="/users", tags=["users"])
 class FCMTokenUpdate(BaseModel):
     """Schema for updating FCM token"""
     fcm_token: str
+    platform: Optional[str] = None  # 'android' | 'ios' | 'web'
 
 
 def user_to_out(user: models.User) -> UserOut:
@@ -50,68 +56,46 @@ def search_users(
     q: str = Query(..., min_length=1, description="Search query"),
     limit: int = Query(default=20, ge=1, le=100),
     offset: int = Query(default=0, ge=0),
-    db: Session = Depends(get_db)
+    prefix_only: bool = Query(default=False, description="Only match names starting with q (typeahead)"),
+    db: Session = Depends(get_read_db)
 ):
-    """Search users by username or display name with pagination"""
-    search_pattern = f"%{q}%"
-    
-    users = (
-        db.query(models.User)
-        .filter(
-            (models.User.username.ilike(search_pattern)) |
-            (models.User.display_name.ilike(search_pattern))
-        )
-        .offset(offset)
-        .limit(limit)
-        .all()
-    )
-    
+    """Search users by username or display name with pagination, best matches first"""
+    users = user_search.search_users(db, q, limit, offset, prefix_only=prefix_only)
     return [user_to_out(user) for user in users]
 
 
 @router.get("/{uid}", response_model=UserOut)
-def get_user(uid: str, db: Session = Depends(get_db)):
+def get_user(uid: str, db: Session = Depends(get_read_db)):
     user = db.query(models.User).filter(models.User.uid == uid).first()
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     return user_to_out(user)
 
 @router.get("/{uid}/stats", response_model=UserStats)
-def get_user_stats(uid: str, db: Session = Depends(get_db)):
-    """Get summarized user statistics in ONE call"""
-    user = db.query(models.User).filter(models.User.uid == uid).first()
-    if not user:
+def get_user_stats(uid: str, db: Session = Depends(get_read_db)):
+    """Get summarized user statistics in ONE call (users row + user_stats row, no aggregates)"""
+    row = db.execute(
+        select(
+            models.User.followers_count,
+            models.User.following_count,
+            models.User.reels_count,
+            models.UserStat.products_count,
+            models.UserStat.total_likes,
+            models.UserStat.saved_posts_count,
+        )
+        .outerjoin(models.UserStat, models.UserStat.user_id == models.User.id)
+        .where(models.User.uid == uid)
+    ).first()
+    if not row:
         raise HTTPException(status_code=404, detail="User not found")
-    
-    # Efficiently count reels and products
-    reels_count = db.query(models.Post).filter(
-        models.Post.user_id == user.id, 
-        models.Post.type == "reel"
-    ).count()
-    
-    products_count = db.query(models.Post).filter(
-        models.Post.user_id == user.id, 
-        models.Post.type == "product"
-    ).count()
-
-    # Calculate total likes (sum of likes on all user's posts)
-    from sqlalchemy import func
-    total_likes = db.query(func.sum(models.Post.likes_count)).filter(
-        models.Post.user_id == user.id
-    ).scalar() or 0
-
-    # Count bookmarked posts
-    saved_posts_count = db.query(models.PostBookmark).filter(
-        models.PostBookmark.user_id == user.id
-    ).count()
 
     return UserStats(
-        followers_count=user.followers_count,
-        following_count=user.following_count,
-        reels_count=reels_count,
-        products_count=products_count,
-        total_likes=total_likes,
-        saved_posts_count=saved_posts_count
+        followers_count=row.followers_count or 0,
+        following_count=row.following_count or 0,
+        reels_count=row.reels_count or 0,
+        products_count=row.products_count or 0,
+        total_likes=row.total_likes or 0,
+        saved_posts_count=row.saved_posts_count or 0
     )
 
 @router.put("/{uid}", response_model=UserOut)
@@ -135,6 +119,10 @@ def update_user(uid: str, payload: UserUpdate, db: Session = Depends(get_db)):
     db.add(user)
     db.commit()
     db.refresh(user)
+    invalidate_user(user.id)
+    invalidate_principal(user.uid)
+    if payload.display_name is not None:
+        user_search.invalidate()
 
     return user_to_out(user)
 
@@ -142,21 +130,44 @@ def update_user(uid: str, payload: UserUpdate, db: Session = Depends(get_db)):
 @router.post("/me/fcm-token")
 def update_fcm_token(
     payload: FCMTokenUpdate,
+    background_tasks: BackgroundTasks,
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_user)
 ):
     """
-    Update user's FCM (Firebase Cloud Messaging) token for push notifications.
-    This token is used to send push notifications to the user's device.
+    Register the FCM (Firebase Cloud Messaging) token of the calling device.
+    Each device keeps its own token, so pushes reach every device the user
+    is signed in on; the app calls this on start-up and on token refresh.
     """
-    current_user.fcm_token = payload.fcm_token
+    token_changed = False
+    if payload.fcm_token:
+        token_changed = devices.register(db, current_user.id, payload.fcm_token, payload.platform)
+    # Latest token, kept for older readers of users.fcm_token
+    current_user.fcm_token = payload.fcm_token or None
     db.commit()
+    invalidate_principal(current_user.uid)
+    if token_changed:
+        # New device token: subscribe it to the topics of followed large creators
+        background_tasks.add_task(fanout.sync_token_topics, current_user.id, payload.fcm_token)
     return {
         "message": "FCM token updated successfully",
         "user_id": current_user.uid
     }
 
 
+@router.delete("/me/fcm-token")
+def delete_fcm_token(
+    payload: FCMTokenUpdate,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_user)
+):
+    """Unregister the calling device's FCM token (e.g. on sign-out)"""
+    devices.unregister(db, current_user.id, payload.fcm_token)
+    db.commit()
+    invalidate_principal(current_user.uid)
+    return {"message": "FCM token removed", "user_id": current_user.uid}
+
+
 @router.delete("/me")
 def delete_account(
     password_data: dict,
@@ -179,14 +190,14 @@ def delete_account(
     Requires password confirmation for security.
     """
     # Verify password before deletion
-    from .auth import verify_password
-    if not verify_password(password_data.get('password', ''), current_user.hashed_password):
+    if not verify_password(password_data.get('password', ''), current_user.password_hash):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid password"
         )
     
     user_id = current_user.id
+    user_uid = current_user.uid
     
     # The cascade deletes are handled by SQLAlchemy relationships
     # defined in models.py with cascade="all, delete-orphan"
@@ -198,7 +209,15 @@ def delete_account(
         (models.Follow.followed_id == user_id)
     ).delete(synchronize_session=False)
     
-    # Delete post likes
+    # Delete post likes (and take them off the liked authors' totals)
+    liked_authors = db.execute(
+        select(models.Post.user_id, func.count(models.PostLike.id))
+        .join(models.Post, models.Post.id == models.PostLike.post_id)
+        .where(models.PostLike.user_id == user_id, models.Post.user_id != user_id)
+        .group_by(models.Post.user_id)
+    ).all()
+    for author_id, likes in liked_authors:
+        counters.record(db, "user_stats", author_id, "total_likes", -likes)
     db.query(models.PostLike).filter(
         models.PostLike.user_id == user_id
     ).delete(synchronize_session=False)
@@ -207,17 +226,48 @@ def delete_account(
     db.query(models.Commission).filter(
         models.Commission.user_id == user_id
     ).delete(synchronize_session=False)
+    ledger.remove_promoter(db, user_uid)
     
     # Delete notifications for this user
     db.query(models.Notification).filter(
         models.Notification.user_id == user_id
     ).delete(synchronize_session=False)
+    inbox.remove_user(db, user_id)
+    devices.remove_user(db, user_id)
+    
+    # Delete bookmarks by this user and on this user's posts
+    own_posts = select(models.Post.id).where(models.Post.user_id == user_id)
+    bookmarkers = db.execute(
+        select(models.PostBookmark.user_id, func.count(models.PostBookmark.id))
+        .where(models.PostBookmark.post_id.in_(own_posts), models.PostBookmark.user_id != user_id)
+        .group_by(models.PostBookmark.user_id)
+    ).all()
+    for bookmarker_id, saved in bookmarkers:
+        counters.record(db, "user_stats", bookmarker_id, "saved_posts_count", -saved)
+    db.query(models.PostBookmark).filter(
+        (models.PostBookmark.user_id == user_id) |
+        (models.PostBookmark.post_id.in_(own_posts))
+    ).delete(synchronize_session=False)
+    db.query(models.UserStat).filter(
+        models.UserStat.user_id == user_id
+    ).delete(synchronize_session=False)
     
-    # Delete all comments by this user
+    # Delete all comments by this user (with their likes and scores) and the user's comment likes
+    comments.remove_comments(db, models.Comment.user_id == user_id)
+    for comment_id in delete_returning(
+        db, models.CommentLike, models.CommentLike.comment_id, models.CommentLike.user_id == user_id
+    ):
+        counters.record(db, "comment", comment_id, "likes_count", -1)
     db.query(models.Comment).filter(
         models.Comment.user_id == user_id
     ).delete(synchronize_session=False)
     
+    fanout.remove_creator(db, user_id)
+    
+    # Remove the user's home timeline and their posts from other inboxes
+    timeline.remove_user(db, user_id)
+    search.unindex_user_posts(db, user_id)
+    
     # Delete all posts by this user (will cascade delete likes and comments on those posts)
     db.query(models.Post).filter(
         models.Post.user_id == user_id
@@ -231,8 +281,11 @@ def delete_account(
     # Finally, delete the user
     db.delete(current_user)
     db.commit()
+    invalidate_user(user_id)
+    invalidate_principal(user_uid)
+    user_search.invalidate()
     
     return {
         "message": "Account successfully deleted",
-        "deleted_user_id": current_user.uid
+        "deleted_user_id": user_uid
     }
\ No newline at end of file
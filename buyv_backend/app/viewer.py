@@ -0,0 +1,113 @@
+"""
+Viewer relationship state: is_liked / is_bookmarked / is_following for many
+posts and users at once.
+
+`POST /viewer/state` answers a whole screen with two IN queries (posts
+outer-joined to the viewer's likes and bookmarks; follows, usually served
+from cache) instead of one request per item. The single-item
+endpoints in posts.py / follows.py are thin wrappers around the same helpers.
+
+Each viewer's followed-user set is cached in a TwoTierCache for
+VIEWER_FOLLOWING_CACHE_TTL_SECONDS (viewers following more than
+VIEWER_FOLLOWING_CACHE_MAX users are not cached); follow/unfollow invalidate
+the entry, which reaches every worker through the cache's invalidation channel.
+"""
+import math
+from typing import Dict, Iterable, Set
+
+from fastapi import APIRouter, Depends
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from .auth import Principal, get_current_principal
+from .cache import TwoTierCache
+from .config import (
+    VIEWER_FOLLOWING_CACHE_ENTRIES,
+    VIEWER_FOLLOWING_CACHE_MAX,
+    VIEWER_FOLLOWING_CACHE_TTL_SECONDS,
+)
+from .database import get_db
+from .models import Follow, Post, PostBookmark, PostLike, User
+from .schemas import ViewerPostState, ViewerStateOut, ViewerStateRequest, ViewerUserState
+
+router = APIRouter(prefix="/viewer", tags=["viewer"])
+
+# viewer id -> {"uids": [...]}
+_following = TwoTierCache(
+    "following",
+    max_entries=VIEWER_FOLLOWING_CACHE_ENTRIES,
+    local_ttl=VIEWER_FOLLOWING_CACHE_TTL_SECONDS,
+    shared_ttl=max(1, math.ceil(VIEWER_FOLLOWING_CACHE_TTL_SECONDS)),
+)
+
+
+def post_states(db: Session, viewer_id: int, post_uids: Iterable[str]) -> Dict[str, ViewerPostState]:
+    """State of every existing post in `post_uids`; unknown uids are left out"""
+    post_uids = list(set(post_uids))
+    if not post_uids:
+        return {}
+    liked = PostLike.__table__.alias("viewer_like")
+    saved = PostBookmark.__table__.alias("viewer_bookmark")
+    rows = db.execute(
+        select(Post.uid, liked.c.id.label("like_id"), saved.c.id.label("bookmark_id"))
+        .outerjoin(liked, (liked.c.post_id == Post.id) & (liked.c.user_id == viewer_id))
+        .outerjoin(saved, (saved.c.post_id == Post.id) & (saved.c.user_id == viewer_id))
+        .where(Post.uid.in_(post_uids))
+    ).all()
+    return {
+        r.uid: ViewerPostState(is_liked=r.like_id is not None, is_bookmarked=r.bookmark_id is not None)
+        for r in rows
+    }
+
+
+def _following_set(db: Session, viewer_id: int):
+    cached = _following.get_many([viewer_id]).get(viewer_id)
+    if cached is not None:
+        return frozenset(cached["uids"])
+    uids = db.execute(
+        select(User.uid)
+        .join(Follow, Follow.followed_id == User.id)
+        .where(Follow.follower_id == viewer_id)
+        .limit(VIEWER_FOLLOWING_CACHE_MAX + 1)
+    ).scalars().all()
+    if len(uids) > VIEWER_FOLLOWING_CACHE_MAX:
+        return None
+    _following.set_many({viewer_id: {"uids": list(uids)}})
+    return frozenset(uids)
+
+
+def followed_uids(db: Session, viewer_id: int, user_uids: Iterable[str]) -> Set[str]:
+    """The subset of `user_uids` the viewer follows"""
+    user_uids = set(user_uids)
+    if not user_uids:
+        return set()
+    following = _following_set(db, viewer_id)
+    if following is not None:
+        return user_uids & following
+    return set(db.execute(
+        select(User.uid)
+        .join(Follow, Follow.followed_id == User.id)
+        .where(Follow.follower_id == viewer_id, User.uid.in_(user_uids))
+    ).scalars().all())
+
+
+def invalidate_following(viewer_id: int) -> None:
+    _following.invalidate(viewer_id)
+
+
+@router.post("/state", response_model=ViewerStateOut)
+def viewer_state(
+    payload: ViewerStateRequest,
+    db: Session = Depends(get_db),
+    current_user: Principal = Depends(get_current_principal),
+):
+    """
+    Relationship bits for up to 300 post uids and 300 user uids in one call.
+    Every requested uid is present in the response; unknown uids report false.
+    """
+    posts = post_states(db, current_user.id, payload.post_uids)
+    following = followed_uids(db, current_user.id, payload.user_uids)
+    return ViewerStateOut(
+        posts={uid: posts.get(uid) or ViewerPostState() for uid in payload.post_uids},
+        users={uid: ViewerUserState(is_following=uid in following) for uid in payload.user_uids},
+    )
@@ -0,0 +1,37 @@
+"""
+Move notifications older than NOTIFICATION_RETENTION_DAYS (default 90) to
+notifications_archive, then recompute the unread counters.
+Schedule nightly (e.g. Railway cron):
+
+    python archive_notifications.py [--days 90]
+"""
+import argparse
+
+from app.database import SessionLocal, engine
+from app import inbox, migrations
+from app.config import NOTIFICATION_RETENTION_DAYS
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--days", type=int, default=NOTIFICATION_RETENTION_DAYS)
+    args = parser.parse_args()
+
+    migrations.check(engine)
+    db = SessionLocal()
+    try:
+        moved = inbox.archive(db, retention_days=args.days)
+        print(f"✅ Archived {moved} notifications older than {args.days} days")
+        corrected = inbox.reconcile_unread(db)
+        print(f"✅ Unread counters reconciled ({corrected} corrected)")
+    except Exception as e:
+        db.rollback()
+        print(f"❌ Notification archival failed: {e}")
+        return 1
+    finally:
+        db.close()
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())
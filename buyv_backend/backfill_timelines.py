@@ -0,0 +1,53 @@
+"""
+Backfill (or trim) the fan-out home timelines in timeline_entries.
+migrate.py fills empty timelines on upgrade (revision 0005); run this to rebuild
+them from scratch, and periodically with --trim:
+
+    python backfill_timelines.py          # rebuild every inbox from the follows graph
+    python backfill_timelines.py --trim   # only cut inboxes down to TIMELINE_MAX_ENTRIES
+"""
+import sys
+
+from app.database import SessionLocal, engine
+from app.models import User
+from app import migrations, timeline
+
+BATCH_SIZE = 500
+
+
+def main():
+    trim_only = "--trim" in sys.argv[1:]
+    migrations.check(engine)
+    db = SessionLocal()
+    processed = 0
+    last_id = 0
+    try:
+        while True:
+            user_ids = [
+                row.id for row in
+                db.query(User.id).filter(User.id > last_id).order_by(User.id).limit(BATCH_SIZE).all()
+            ]
+            if not user_ids:
+                break
+            for user_id in user_ids:
+                if trim_only:
+                    timeline.trim_timeline(db, user_id)
+                else:
+                    timeline.rebuild_timeline(db, user_id)
+            db.commit()
+            processed += len(user_ids)
+            last_id = user_ids[-1]
+            print(f"✓ {processed} timelines {'trimmed' if trim_only else 'rebuilt'}")
+    except Exception as e:
+        db.rollback()
+        print(f"❌ Timeline backfill failed: {e}")
+        return 1
+    finally:
+        db.close()
+
+    print("🎉 Timeline backfill completed")
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())
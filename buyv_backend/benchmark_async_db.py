@@ -0,0 +1,126 @@
+"""
+Compare feed throughput with the sync (threadpool) and async database layers.
+
+Each mode runs in a fresh interpreter (USE_ASYNC_DB is read at import time)
+against its own copy of a seeded database, drives GET /posts/feed in-process
+through httpx's ASGI transport with the given concurrency, and reports
+requests/second and latency percentiles:
+
+    python benchmark_async_db.py [--requests 2000] [--concurrency 200]
+    python benchmark_async_db.py --database-url postgresql://user:pw@host/bench_db
+
+With --database-url the tables are created in (and posts added to) that
+database, so point it at a scratch database, never production. The async
+mode needs asyncpg (PostgreSQL) or aiosqlite (SQLite) installed.
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+
+def _percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+async def _drive(args):
+    import logging
+
+    import httpx
+    from app.database import engine
+    from app import migrations
+
+    # Scratch database: build it the way the release step does, before app.main's boot check
+    migrations.upgrade(engine)
+    from app.main import app
+
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        email = f"bench-{os.getpid()}@example.com"
+        r = await client.post("/auth/register", json={
+            "email": email, "username": f"bench{os.getpid()}", "displayName": "Bench", "password": "benchmark",
+        })
+        r.raise_for_status()
+        headers = {"Authorization": f"Bearer {r.json()['access_token']}"}
+        for i in range(args.posts):
+            r = await client.post("/posts/", headers=headers, json={
+                "type": "reel", "mediaUrl": "https://example.com/v.mp4", "caption": f"bench {i}",
+            })
+            r.raise_for_status()
+
+        latencies = []
+        errors = 0
+        pending = iter(range(args.requests))
+
+        async def worker():
+            nonlocal errors
+            for _ in pending:
+                started = time.perf_counter()
+                r = await client.get("/posts/feed", headers=headers, params={"limit": 20})
+                latencies.append(time.perf_counter() - started)
+                if r.status_code != 200:
+                    errors += 1
+
+        await asyncio.gather(*[worker() for _ in range(min(10, args.concurrency))])  # warm-up caches
+        latencies.clear()
+        pending = iter(range(args.requests))
+        started = time.perf_counter()
+        await asyncio.gather(*[worker() for _ in range(args.concurrency)])
+        elapsed = time.perf_counter() - started
+    return {
+        "requests_per_second": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(_percentile(latencies, 0.50) * 1000, 1),
+        "p99_ms": round(_percentile(latencies, 0.99) * 1000, 1),
+        "errors": errors,
+    }
+
+
+def _run_mode(mode, args, database_url):
+    env = dict(os.environ, USE_ASYNC_DB="true" if mode == "async" else "false", DATABASE_URL=database_url)
+    cmd = [sys.executable, __file__, "--worker", "--requests", str(args.requests),
+           "--concurrency", str(args.concurrency), "--posts", str(args.posts)]
+    out = subprocess.run(cmd, env=env, capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+    if out.returncode != 0:
+        raise RuntimeError(f"{mode} run failed:\n{out.stderr[-2000:]}")
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=200)
+    parser.add_argument("--posts", type=int, default=200)
+    parser.add_argument("--database-url", default="")
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(asyncio.run(_drive(args))))
+        return 0
+
+    results = {}
+    try:
+        for mode in ("sync", "async"):
+            if args.database_url:
+                database_url = args.database_url
+            else:
+                database_url = f"sqlite:///{tempfile.mkdtemp(prefix='buyv-bench-')}/bench.db"
+            results[mode] = _run_mode(mode, args, database_url)
+            print(f"✅ {mode:5}: {results[mode]}")
+    except Exception as e:
+        print(f"❌ Benchmark failed: {e}")
+        return 1
+    speedup = results["async"]["requests_per_second"] / max(results["sync"]["requests_per_second"], 0.1)
+    print(f"✅ async / sync throughput: {speedup:.2f}x at concurrency {args.concurrency}")
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())
@@ -4,6 +4,8 @@ Run this script once to reset all auto-increment sequences
 """
 import os
 from sqlalchemy import create_engine, text
+from app.database import Base
+from app import models  # noqa: F401  (registers the tables on Base.metadata)
 
 # Get database URL from environment
 DATABASE_URL = os.getenv("DATABASE_URL")
@@ -17,25 +19,11 @@ if DATABASE_URL.startswith("postgres://"):
 
 engine = create_engine(DATABASE_URL)
 
-# List of tables with auto-increment IDs
+# Tables with an auto-increment `id` primary key, taken from the models
 tables = [
-    "users",
-    "reels", 
-    "likes",
-    "comments",
-    "follows",
-    "notifications",
-    "products",
-    "orders",
-    "order_items",
-    "categories",
-    "carts",
-    "cart_items",
-    "addresses",
-    "reviews",
-    "payments",
-    "wishlists",
-    "wishlist_items"
+    table.name
+    for table in Base.metadata.sorted_tables
+    if [column.name for column in table.primary_key.columns] == ["id"]
 ]
 
 print("Fixing PostgreSQL sequences...")
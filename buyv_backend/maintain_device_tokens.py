@@ -0,0 +1,38 @@
+"""
+Copy legacy users.fcm_token values into device_tokens and delete device
+tokens the app has not refreshed for DEVICE_TOKEN_STALE_DAYS (default 270).
+migrate.py does the copy once on upgrade (revision 0005); schedule nightly
+(e.g. Railway cron):
+
+    python maintain_device_tokens.py [--days 270]
+"""
+import argparse
+
+from app.database import SessionLocal, engine
+from app import devices, migrations
+from app.config import DEVICE_TOKEN_STALE_DAYS
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--days", type=int, default=DEVICE_TOKEN_STALE_DAYS)
+    args = parser.parse_args()
+
+    migrations.check(engine)
+    db = SessionLocal()
+    try:
+        copied = devices.backfill(db)
+        print(f"✅ Backfilled {copied} legacy FCM tokens")
+        removed = devices.prune_stale(db, days=args.days)
+        print(f"✅ Removed {removed} device tokens not seen for {args.days} days")
+    except Exception as e:
+        db.rollback()
+        print(f"❌ Device token maintenance failed: {e}")
+        return 1
+    finally:
+        db.close()
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())
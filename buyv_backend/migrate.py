@@ -0,0 +1,33 @@
+"""
+Apply pending schema migrations (app/migrations). Runs as the release step
+before new workers start, so boots only need to read schema_migrations:
+
+    python migrate.py            # apply pending revisions
+    python migrate.py --status   # list applied / pending revisions
+"""
+import logging
+import sys
+
+from app.database import engine
+from app import migrations
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    try:
+        if "--status" in sys.argv[1:]:
+            done = migrations.applied(engine)
+            for module in migrations.REVISIONS:
+                state = "applied" if module.revision in done else "pending"
+                print(f"{module.revision} {state:8} {module.description}")
+            return 0
+        ran = migrations.upgrade(engine)
+        print(f"✅ Schema up to date ({len(ran)} migrations applied: {', '.join(ran) or 'none'})")
+    except Exception as e:
+        print(f"❌ Migration failed: {e}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())
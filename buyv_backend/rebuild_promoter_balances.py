@@ -0,0 +1,28 @@
+"""
+Recompute promoter_balances from the commissions table.
+migrate.py fills the table on upgrade (revision 0005); run nightly (e.g. Railway cron)
+to correct any drift:
+
+    python rebuild_promoter_balances.py
+"""
+from app.database import SessionLocal, engine
+from app import ledger, migrations
+
+
+def main():
+    migrations.check(engine)
+    db = SessionLocal()
+    try:
+        count = ledger.rebuild(db)
+        print(f"✅ Rebuilt balances for {count} promoters")
+    except Exception as e:
+        db.rollback()
+        print(f"❌ Balance rebuild failed: {e}")
+        return 1
+    finally:
+        db.close()
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())
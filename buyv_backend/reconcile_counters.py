@@ -0,0 +1,30 @@
+"""
+Recompute likes/comments/followers/following/reels counters, the user_stats
+table (products, total likes, saved posts) and comment like counts from the
+source tables. Schedule nightly (e.g. Railway cron) to correct any counter
+drift; it runs in small batches next to live traffic:
+
+    python reconcile_counters.py
+"""
+from app.database import SessionLocal, engine
+from app import counters, migrations
+
+
+def main():
+    migrations.check(engine)
+    db = SessionLocal()
+    try:
+        drifted = counters.reconcile(db)
+        summary = ", ".join(f"{entity}: {count}" for entity, count in drifted.items())
+        print(f"✅ Counters reconciled (rows corrected - {summary})")
+    except Exception as e:
+        db.rollback()
+        print(f"❌ Counter reconciliation failed: {e}")
+        return 1
+    finally:
+        db.close()
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())